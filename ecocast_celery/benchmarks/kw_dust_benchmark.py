@@ -0,0 +1,92 @@
+import datetime
+import random
+import sys
+import time
+from ..ecocast_conf import psql_connect
+from ..tasks.kw_dust_task import kw_dust_rows, copy_kw_dust
+
+""" Kweather Fine Dust Loader Benchmark
+
+    Compare the row by row INSERT loop with the COPY loader on a synthetic findust.station payload.
+    Rows are written into a temporary copy of kweather_dust and rolled back, the real table is not touched.
+
+    Usage:
+        python -m ecocast_celery.benchmarks.kw_dust_benchmark [station_count] [repeat]
+"""
+
+
+def make_station_list(station_count: int):
+    """ Synthetic Kweather's fine dust station data
+        Args:
+            station_count (int): Number of stations
+
+        Returns:
+            station_list (list): Same keys as findust.station of the Kweather API
+    """
+    announce_time = datetime.datetime.now().strftime('%Y%m%d%H') + '00'
+    return [{'areaName_wide': '시도' + str(i % 17), 'areaName_city': '시군구' + str(i % 250),
+             'areaName_dong': '읍면동' + str(i), 'announceTime': announce_time,
+             'Lat': str(round(33 + random.random() * 5, 6)), 'Lng': str(round(124 + random.random() * 7, 6)),
+             'PM10_VALUE': str(random.randint(0, 150)), 'PM25_VALUE': str(random.randint(0, 80))}
+            for i in range(station_count)]
+
+
+def insert_loop(conn, kw_dust_list: list):
+    """ Previous loader of insert_kw_dust, one INSERT and one strptime per station """
+    curs = conn.cursor()
+    for kw_dust_dict in kw_dust_list:
+        values_data = (kw_dust_dict['areaName_wide'], kw_dust_dict['areaName_city'], kw_dust_dict['areaName_dong'],
+                       datetime.datetime.strptime(kw_dust_dict['announceTime'], '%Y%m%d%H%M'), kw_dust_dict['Lat'],
+                       kw_dust_dict['Lng'], kw_dust_dict['PM10_VALUE'], kw_dust_dict['PM25_VALUE'])
+        curs.execute(
+            'INSERT INTO kweather_dust(kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd, '
+            'kweather_dust_announce_time, kweather_dust_lat, kweather_dust_lon, kweather_dust_pm100, '
+            'kweather_dust_pm25) '
+            'VALUES(%s, %s, %s, %s, %s, %s, %s, %s)', values_data)
+    curs.close()
+
+
+def insert_copy(conn, kw_dust_list: list):
+    """ Current loader of insert_kw_dust """
+    copy_kw_dust(conn, kw_dust_rows(kw_dust_list))
+
+
+def run(loader, kw_dust_list: list, repeat: int):
+    """ Best elapsed seconds of the loader
+        Args:
+            loader (function): insert_loop or insert_copy
+            kw_dust_list (list): Result of make_station_list
+            repeat (int): Number of runs
+
+        Returns:
+            best (float): Fastest run in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        with psql_connect() as conn:
+            curs = conn.cursor()
+            # The temporary table shadows kweather_dust for this session only
+            curs.execute('CREATE TEMP TABLE kweather_dust (LIKE public.kweather_dust INCLUDING DEFAULTS) '
+                         'ON COMMIT DROP')
+            curs.close()
+            start = time.perf_counter()
+            loader(conn, kw_dust_list)
+            elapsed = time.perf_counter() - start
+            conn.rollback()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(station_count: int = 3500, repeat: int = 5):
+    kw_dust_list = make_station_list(station_count)
+    loop_time = run(insert_loop, kw_dust_list, repeat)
+    copy_time = run(insert_copy, kw_dust_list, repeat)
+    print('stations : ' + str(station_count) + ', repeat : ' + str(repeat))
+    print('insert loop : ' + format(loop_time, '.4f') + 's')
+    print('copy        : ' + format(copy_time, '.4f') + 's')
+    print('speedup     : ' + format(loop_time / copy_time, '.1f') + 'x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,9 +1,11 @@
 from celery import Celery
-from celery.result import allow_join_result
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, task_prerun, task_postrun
+from . import ecocast_conf, ecocast_http
+from .ecocast_redis import task_key, claim_task, release_task, record_outcome
+from .ecocast_scheduler import first_poll_delay, poll_backoff, record_probe
 from .tasks import ak_station_task, ak_air_quality_task, kw_dust_task, ow_weather_task, data_weather_task, \
-    test_task
-from time import sleep
-import random, datetime
+    partition_task, test_task
+import random, datetime, hashlib, time
 
 """ Celery Main Module
     Version: 1.0
@@ -13,9 +15,145 @@ import random, datetime
         1. Airkorea Data: 1시간 주기, Kweather Data: 5분 주기, Public Data Porter
         2. 공공데이터포털에서 제공하는 인증키(AIRKOREA_KEY)는 URL인코딩 상태의 키를 제공, 
         URL인코딩된 키를 다시 인코딩 하기 때문에 디코딩된 데이터로 바꿔서 넣어야됩니다.
+        3. 수집 Task는 자연키(관측소·시각, 격자·발표시각)를 Redis에 먼저 선점(claim_task)하고, 이미 선점된 경우 건너뜁니다.
+        재시도 전에는 선점을 해제(release_task)합니다. 관측소 목록 Task의 키에는 목록 Task의 재시도 횟수(attempt)가 들어가므로
+        같은 시각에 늦은 관측소를 다시 요청할 수 있습니다.
+        4. Task 결과는 저장하지 않습니다(task_ignore_result). 모니터링은 Redis 'task_outcome:<task name>' 해시를 봅니다.
+        5. Task 메시지는 msgpack(TASK_SERIALIZER)으로 보내고, 격자 Task 인자는 (x int, y int, 발표시각 epoch, 버전)입니다.
 """
 
-app = Celery('ecocast_celery', backend='rpc://', broker='redis://')
+app = Celery('ecocast_celery', broker=ecocast_conf.REDIS_URL)
+app.conf.task_ignore_result = True  # Fire-and-forget tasks, outcomes are kept by record_task_outcome
+app.conf.task_serializer = ecocast_conf.TASK_SERIALIZER
+app.conf.accept_content = ['msgpack', 'json']  # json for the messages sent before the switch to msgpack
+app.conf.task_compression = ecocast_conf.TASK_COMPRESSION
+
+TASK_START_TIMES = {}
+
+
+def stagger_countdowns(count: int, interval: tuple, window: int = None):
+    """ Countdown of each task of a fan-out, so the broker spreads the wave instead of a sleeping worker
+        Args:
+            count (int): Number of tasks
+            interval (tuple): (min, max) seconds between two tasks
+            window (int): Seconds the whole wave may last, DISPATCH_WINDOW if None
+
+        Returns:
+            countdowns (list): Cumulative seconds, the first task runs immediately,
+                               intervals shrunk in proportion when the wave would last longer than window
+
+        Examples:
+            >>> stagger_countdowns(4, (2, 4))
+            [0, 3, 5, 9]
+    """
+    countdowns = []
+    countdown = 0
+    for _ in range(count):
+        countdowns.append(countdown)
+        countdown += random.randint(*interval)
+    if window is None:
+        window = ecocast_conf.DISPATCH_WINDOW
+    if countdowns and countdowns[-1] > window:
+        countdowns = [countdown * window // countdowns[-1] for countdown in countdowns]
+    return countdowns
+
+
+def current_hour():
+    """ Natural key of the AirKorea hour being collected """
+    return datetime.datetime.now().strftime('%Y%m%d%H')
+
+
+def kw_dust_period():
+    """ Start of the 5-minute Kweather period being collected """
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    return now.replace(minute=now.minute - now.minute % 5)
+
+
+def kw_dust_json_key():
+    """ Natural key of the 5-minute Kweather period being collected """
+    return task_key('kweather_dust_json', kw_dust_period().strftime('%Y%m%d%H%M'))
+
+
+def data_weather_task_args(area: dict, base_date: str, base_time: str):
+    """ Arguments of a forecast cell task, version TASK_ARGS_VERSION
+        Args:
+            area (dict): An item of insert_data_weather_area_list
+            base_date (str): YYYYMMDD
+            base_time (str): HHMI
+
+        Returns:
+            args (list): [x (int), y (int), base time (int, epoch seconds of the KST base time), TASK_ARGS_VERSION]
+
+        Examples:
+            >>> data_weather_task_args({'data_weather_area_x': 60.0, 'data_weather_area_y': 127.0}, '20201026', '2030')
+            [60, 127, 1603711800, 2]
+    """
+    return [int(area['data_weather_area_x']), int(area['data_weather_area_y']),
+            data_weather_base_epoch(base_date, base_time), ecocast_conf.TASK_ARGS_VERSION]
+
+
+def data_weather_base_epoch(base_date: str, base_time: str):
+    """ Epoch seconds of a KST base time, read back by data_weather_task_base """
+    base = datetime.datetime.strptime(base_date + base_time, '%Y%m%d%H%M').replace(tzinfo=ecocast_conf.TASK_TIME_ZONE)
+    return int(base.timestamp())
+
+
+def data_weather_task_base(base_time, version: int):
+    """ Base time of a forecast cell task from its arguments
+        Args:
+            base_time (int or str): Epoch seconds(version 2), or the ISO format dispatch time(version 1)
+            version (int): Version of the task arguments
+
+        Returns:
+            base (datetime.datetime): Base time of version 2, dispatch time of version 1, naive KST
+
+        Comment:
+            Both sides use TASK_TIME_ZONE, so a dispatcher and a worker in different system time zones agree.
+    """
+    if version >= 2:
+        return datetime.datetime.fromtimestamp(base_time, ecocast_conf.TASK_TIME_ZONE).replace(tzinfo=None)
+    return datetime.datetime.fromisoformat(base_time)
+
+
+def station_names_digest(station_names: list):
+    """ Short natural key of a list of stations, independent of their order """
+    return hashlib.sha1(','.join(sorted(station_names)).encode('utf-8')).hexdigest()[:12]
+
+
+@worker_init.connect
+def configure_db_pool(sender=None, **kwargs):
+    """ Size the connection pool with the worker --concurrency (threads, gevent, eventlet pool) """
+    if sender is not None and sender.concurrency:
+        ecocast_conf.DB_POOL_MAX_CONN = sender.concurrency
+
+
+@worker_process_init.connect
+def init_db_pool(**kwargs):
+    """ Create the connection pool in each prefork child after the fork """
+    ecocast_conf.init_db_pool(ecocast_conf.DB_POOL_PROCESS_MAX_CONN)
+
+
+@worker_process_shutdown.connect
+def close_db_pool(**kwargs):
+    """ Close the connection pool and the HTTP sessions of the prefork child """
+    ecocast_conf.close_db_pool()
+    ecocast_http.close_http_sessions()
+
+
+@task_prerun.connect
+def start_task_outcome(task_id=None, **kwargs):
+    """ Start the clock and the row count of the task """
+    TASK_START_TIMES[task_id] = time.monotonic()
+    ecocast_conf.reset_row_count()
+
+
+@task_postrun.connect
+def record_task_outcome(task_id=None, task=None, state=None, **kwargs):
+    """ Record the status, duration and row count of the task in Redis """
+    start_time = TASK_START_TIMES.pop(task_id, None)
+    if task is None or start_time is None:
+        return
+    record_outcome(task.name, state or 'UNKNOWN', time.monotonic() - start_time, ecocast_conf.reset_row_count())
 
 
 @app.task(bind=True, queue='sub', max_retries=3, expires=300)
@@ -25,34 +163,109 @@ def insert_ak_station(self):
 
 
 @app.task(bind=True, queue='ak', expires=1500)
-def insert_ak_air_quality_list(self):
-    with allow_join_result():
-        station_result = ak_air_quality_task.insert_ak_air_quality_list()
-    if station_result is True:
-        self.retry(countdown=(3 * 60), max_retries=15, queue='ak', time_limit=1500)
+def insert_ak_air_quality_list(self, hour: str = None):
+    # The hour is fixed by the first run, a retry after the hour rolled over leaves it to the chain of the new hour
+    if hour is None:
+        hour = current_hour()
+    elif hour != current_hour():
+        return
+    if not claim_task(task_key('airkorea_air_quality_list', hour, self.request.retries)):
+        return
+    record_probe('airkorea_air_quality', datetime.datetime.strptime(hour, '%Y%m%d%H'))
+    station_result = ak_air_quality_task.insert_ak_air_quality_list(self.request.retries > 0)
+    if not station_result:
+        return
+    station_names = [station[0] for station in station_result]
+    retry_countdown = poll_backoff('airkorea_air_quality', self.request.retries)
+    if ecocast_conf.AK_AIR_QUALITY_MODE == 'province':
+        sido_names = ak_air_quality_task.ak_station_sido_names(station_result)
+        province_ak_air_quality.apply_async(args=[station_names, sido_names, self.request.retries], queue='ak',
+                                            expires=600)
+    elif ecocast_conf.AK_AIR_QUALITY_MODE == 'batch':
+        chunk_list = chunk_station_names(station_names)
+        countdowns = stagger_countdowns(len(chunk_list), ecocast_conf.AK_DISPATCH_INTERVAL)
+        for chunk, countdown in zip(chunk_list, countdowns):
+            insert_ak_air_quality_batch.apply_async(args=[chunk, self.request.retries], queue='ak',
+                                                    countdown=countdown, expires=countdown + 600)
+        retry_countdown = max(retry_countdown, countdowns[-1] + 60)
+    elif ecocast_conf.AK_AIR_QUALITY_MODE == 'sweep':
+        sweep_ak_air_quality.apply_async(args=[station_names, self.request.retries], queue='ak', expires=600)
     else:
-        for station in station_result:
-            insert_ak_air_quality.apply_async(args=[station[0]], queue='ak', expires=600)
-            sleep(random.randint(11, 20))
+        countdowns = stagger_countdowns(len(station_names), ecocast_conf.AK_DISPATCH_INTERVAL)
+        for station_name, countdown in zip(station_names, countdowns):
+            insert_ak_air_quality.apply_async(args=[station_name], queue='ak', countdown=countdown,
+                                              expires=countdown + 600)
+        return
+    # Poll again only the stations still older than the current hour
+    self.retry(countdown=retry_countdown, args=[hour], max_retries=15, queue='ak', time_limit=1500)
+
+
+@app.task(bind=True, queue='sub', expires=240)
+def plan_poll(self, source: str):
+    """ Delay the first poll of the period of the source to its expected publication time """
+    countdown = first_poll_delay(source)
+    app.signature(POLL_TASKS[source]).apply_async(countdown=countdown, expires=countdown + 600)
 
 
 @app.task(bind=True, queue='ak', max_retries=3, expires=600)
 def insert_ak_air_quality(self, station_name):
-    with allow_join_result():
-        insert_result = ak_air_quality_task.insert_ak_air_quality(station_name)
-    if insert_result is True:
-        null_ak_air_quality.apply_async(countdown=(2 * 60), args=[station_name], max_retries=2, queue='sub',
-                                        expires=600)
-    elif insert_result == 'Retry':
+    key = task_key('airkorea_air_quality', station_name, current_hour())
+    if not claim_task(key):
+        return
+    insert_result = ak_air_quality_task.insert_ak_air_quality(station_name)
+    if insert_result == 'Retry':
+        release_task(key)
         self.retry(countdown=(25), args=[station_name], queue='ak', expires=600)
 
 
-@app.task(bind=True, queue='sub', max_retries=10, time_limit=600)
-def null_ak_air_quality(self, station_name):
-    with allow_join_result():
-        null_result = ak_air_quality_task.null_ak_air_quality(station_name)
-    if null_result is True:
-        self.retry(countdown=(2 * 60), max_retries=9, queue='sub', time_limit=600)
+@app.task(bind=True, queue='ak', expires=600, time_limit=900)
+def sweep_ak_air_quality(self, station_names: list, attempt: int = 0):
+    if not claim_task(task_key('airkorea_air_quality_sweep', current_hour(), attempt,
+                               station_names_digest(station_names))):
+        return
+    failed_list, null_list = ak_air_quality_task.sweep_ak_air_quality(station_names)
+    retry_ak_air_quality(failed_list, attempt)
+
+
+@app.task(bind=True, queue='ak', expires=600, time_limit=300)
+def province_ak_air_quality(self, station_names: list, sido_names: list = None, attempt: int = 0):
+    if not claim_task(task_key('airkorea_air_quality_province', current_hour(), attempt,
+                               station_names_digest(station_names))):
+        return
+    failed_list, null_list = ak_air_quality_task.province_ak_air_quality(station_names, sido_names)
+    retry_ak_air_quality(failed_list, attempt)
+
+
+def retry_ak_air_quality(failed_list: list, attempt: int):
+    """ Follow up of the bulk AirKorea tasks(sweep, province), one message per chunk instead of per station
+        Null data is repaired by backfill_ak_air_quality.
+    """
+    for chunk in chunk_station_names(failed_list):
+        insert_ak_air_quality_batch.apply_async(countdown=(25), args=[chunk, attempt], queue='ak', expires=600)
+
+
+def chunk_station_names(station_names: list):
+    """ Station names split by AK_AIR_QUALITY_CHUNK_SIZE """
+    chunk_size = ecocast_conf.AK_AIR_QUALITY_CHUNK_SIZE
+    return [station_names[i:i + chunk_size] for i in range(0, len(station_names), chunk_size)]
+
+
+@app.task(bind=True, queue='ak', max_retries=3, expires=600)
+def insert_ak_air_quality_batch(self, station_names: list, attempt: int = 0):
+    key = task_key('airkorea_air_quality_batch', current_hour(), attempt, self.request.retries,
+                   station_names_digest(station_names))
+    if not claim_task(key):
+        return
+    failed_list, null_list = ak_air_quality_task.insert_ak_air_quality_batch(station_names)
+    if failed_list:
+        release_task(key)
+        self.retry(countdown=(25), args=[failed_list, attempt], queue='ak', expires=600)
+
+
+@app.task(bind=True, queue='sub', max_retries=2, expires=540, time_limit=540)
+def backfill_ak_air_quality(self):
+    if ak_air_quality_task.backfill_ak_air_quality() is True:
+        self.retry(countdown=(60), queue='sub', expires=540, time_limit=540)
 
 
 @app.task(bind=True, queue='sub', max_retries=3, expires=240)
@@ -63,14 +276,25 @@ def insert_kw_dust(self):
 
 @app.task(bind=True, queue='sub', expires=240)
 def insert_kw_dust_json(self):
+    key = kw_dust_json_key()
+    if not claim_task(key):
+        return
+    record_probe('kweather_dust_json', kw_dust_period())
     if kw_dust_task.insert_kw_dust_json() is True:
-        null_kw_dust_json.apply_async(countdown=(60), queue='sub', expires=240)
+        release_task(key)
+        null_kw_dust_json.apply_async(countdown=poll_backoff('kweather_dust_json', 0), queue='sub', expires=240)
 
 
 @app.task(bind=True, queue='sub', max_retries=3, time_limit=240)
 def null_kw_dust_json(self):
+    key = kw_dust_json_key()
+    if not claim_task(key):
+        return
+    record_probe('kweather_dust_json', kw_dust_period())
     if kw_dust_task.null_kw_dust_json() is True:
-        self.retry(countdown=(60), max_retries=2, queue='sub', time_limit=240)
+        release_task(key)
+        self.retry(countdown=poll_backoff('kweather_dust_json', self.request.retries + 1), max_retries=2, queue='sub',
+                   time_limit=240)
 
 
 @app.task(bind=True, queue='sub', max_retries=3, time_limit=240)
@@ -80,49 +304,79 @@ def insert_ow_weather_json(self, lat: float, lon: float):
 
 
 @app.task(bind=True, queue='data', max_retries=10, expires=1500)
-def insert_data_weather_area_list_1_hour(self):
-    with allow_join_result():
-        area_result = data_weather_task.insert_data_weather_area_list()
-    if area_result is True:
-        self.retry(countdown=(2 * 60), max_retries=9, queue='data', time_limit=1500)
+def insert_data_weather_area_list_1_hour(self, base: int = None):
+    # The base time is fixed by the first run, so a retry past the hour still polls the same forecast
+    now = datetime.datetime.now() if base is None else data_weather_task_base(base, ecocast_conf.TASK_ARGS_VERSION)
+    base_date, base_time = data_weather_task.data_weather_base_1_hour(now)
+    if not claim_task(task_key('data_weather_1_hour_list', base_date + base_time, self.request.retries)):
+        return
+    record_probe('data_weather_1_hour', datetime.datetime.strptime(base_date + base_time, '%Y%m%d%H%M'))
+    area_result = data_weather_task.insert_data_weather_area_list()
+    if area_result and not data_weather_task.probe_data_weather(1, area_result[0], now):
+        self.retry(countdown=poll_backoff('data_weather_1_hour', self.request.retries),
+                   args=[data_weather_base_epoch(base_date, base_time)], max_retries=9, queue='data', time_limit=1500)
     else:
-        now = datetime.datetime.now()
         # now = datetime.datetime.strptime(str(int(datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d%H%M')) - 100), '%Y%m%d%H%M')
-        for area in area_result:
-            insert_data_weather_1_hour.apply_async(args=[area['data_weather_area_x'], area['data_weather_area_y'], now],
-                                                   queue='data', expires=600)
-            sleep(random.randint(2, 4))
+        countdowns = stagger_countdowns(len(area_result), ecocast_conf.DATA_WEATHER_DISPATCH_INTERVAL)
+        for area, countdown in zip(area_result, countdowns):
+            insert_data_weather_1_hour.apply_async(args=data_weather_task_args(area, base_date, base_time),
+                                                   queue='data', countdown=countdown, expires=countdown + 600)
 
 
 @app.task(bind=True, queue='data', max_retries=3, expires=600)
-def insert_data_weather_1_hour(self, x: int, y: int, nows: str):
-    now = datetime.datetime.strptime(nows, '%Y-%m-%dT%H:%M:%S.%f')
-    # now = datetime.datetime.strptime(nows, '%Y-%m-%dT%H:%M:%S')
+def insert_data_weather_1_hour(self, x: int, y: int, base_time, version: int = 1):
+    now = data_weather_task_base(base_time, version)
+    key = task_key('data_weather_1_hour', int(x), int(y), ''.join(data_weather_task.data_weather_base_1_hour(now)))
+    if not claim_task(key):
+        return
     if data_weather_task.insert_data_weather_1_hour(int(x), int(y), now) is True:
+        release_task(key)
         self.retry(countdown=(25), max_retries=2, queue='data', time_limit=600)
 
 
 @app.task(bind=True, queue='data', max_retries=10, expires=1500)
-def insert_data_weather_area_list_3_hour(self):
-    with allow_join_result():
-        area_result = data_weather_task.insert_data_weather_area_list()
-    if area_result is True:
-        self.retry(countdown=(2 * 60), max_retries=9, queue='data', time_limit=1500)
+def insert_data_weather_area_list_3_hour(self, base: int = None):
+    # The base time is fixed by the first run, so a retry past the hour still polls the same forecast
+    now = datetime.datetime.now() if base is None else data_weather_task_base(base, ecocast_conf.TASK_ARGS_VERSION)
+    base_date, base_time = data_weather_task.data_weather_base_3_hour(now)
+    if not claim_task(task_key('data_weather_3_hour_list', base_date + base_time, self.request.retries)):
+        return
+    record_probe('data_weather_3_hour', datetime.datetime.strptime(base_date + base_time, '%Y%m%d%H%M'))
+    area_result = data_weather_task.insert_data_weather_area_list()
+    if area_result and not data_weather_task.probe_data_weather(3, area_result[0], now):
+        self.retry(countdown=poll_backoff('data_weather_3_hour', self.request.retries),
+                   args=[data_weather_base_epoch(base_date, base_time)], max_retries=9, queue='data', time_limit=1500)
     else:
-        now = datetime.datetime.now()
-        for area in area_result:
-            insert_data_weather_3_hour.apply_async(args=[area['data_weather_area_x'], area['data_weather_area_y'], now],
-                                                   queue='data', expires=600)
-            sleep(random.randint(2, 4))
+        countdowns = stagger_countdowns(len(area_result), ecocast_conf.DATA_WEATHER_DISPATCH_INTERVAL)
+        for area, countdown in zip(area_result, countdowns):
+            insert_data_weather_3_hour.apply_async(args=data_weather_task_args(area, base_date, base_time),
+                                                   queue='data', countdown=countdown, expires=countdown + 600)
 
 
 @app.task(bind=True, queue='data', max_retries=3, expires=600)
-def insert_data_weather_3_hour(self, x: int, y: int, nows: str):
-    now = datetime.datetime.strptime(nows, '%Y-%m-%dT%H:%M:%S.%f')
+def insert_data_weather_3_hour(self, x: int, y: int, base_time, version: int = 1):
+    now = data_weather_task_base(base_time, version)
+    key = task_key('data_weather_3_hour', int(x), int(y), ''.join(data_weather_task.data_weather_base_3_hour(now)))
+    if not claim_task(key):
+        return
     if data_weather_task.insert_data_weather_3_hour(int(x), int(y), now) is True:
+        release_task(key)
         self.retry(countdown=(25), max_retries=2, queue='data', time_limit=600)
 
 
+@app.task(bind=True, queue='sub', max_retries=3, expires=3600)
+def maintain_partitions(self):
+    partition_task.maintain_partitions()
+
+
 @app.task(bind=True, queue='main', expires=60)
 def test(self):
     result = test_task.test()
+
+
+POLL_TASKS = {  # Source of ecocast_scheduler: first poll task of the period
+    'airkorea_air_quality': 'ecocast_celery.ecocast_app.insert_ak_air_quality_list',
+    'kweather_dust_json': 'ecocast_celery.ecocast_app.insert_kw_dust_json',
+    'data_weather_1_hour': 'ecocast_celery.ecocast_app.insert_data_weather_area_list_1_hour',
+    'data_weather_3_hour': 'ecocast_celery.ecocast_app.insert_data_weather_area_list_3_hour',
+}
@@ -1,6 +1,5 @@
 from celery.schedules import crontab
 from .ecocast_app import app
-from datetime import timedelta
 
 """ Celery Beat 설정 모듈 """
 
@@ -11,34 +10,45 @@ from datetime import timedelta
             'args': ()
         },
     timedelta는 일정시간마다 반복이고, crontab은 일정시간에 실행합니다.
+    plan_poll은 데이터 기준시각(주기 시작)에 실행되어, 관측된 공개 지연시간(ecocast_scheduler)만큼 뒤에 첫 호출을 예약합니다.
 """
 app.conf.update(
     CELERY_TIMEZONE='Asia/Seoul',
     CELERY_ENABLE_UTC=False,
     CELERYBEAT_SCHEDULE={
         'insert_ak_air_quality_list-1-hour': {
-            'task': 'ecocast_celery.ecocast_app.insert_ak_air_quality_list',
-            'schedule': crontab(minute='1', hour='*'),  # timedelta(hours=1)
+            'task': 'ecocast_celery.ecocast_app.plan_poll',
+            'schedule': crontab(minute='0', hour='*'),  # timedelta(hours=1)
+            'args': ('airkorea_air_quality',)
+        },
+        'backfill_ak_air_quality-10-minute': {
+            'task': 'ecocast_celery.ecocast_app.backfill_ak_air_quality',
+            'schedule': crontab(minute='5,15,25,35,45,55'),
             'args': ()
         },
         'insert_kw_dust_json-5-minute': {
-            'task': 'ecocast_celery.ecocast_app.insert_kw_dust_json',
-            'schedule': crontab(minute='1,6,11,16,21,26,31,36,41,46,51,56'),  # timedelta(minutes=5)
-            'args': ()
+            'task': 'ecocast_celery.ecocast_app.plan_poll',
+            'schedule': crontab(minute='0,5,10,15,20,25,30,35,40,45,50,55'),  # timedelta(minutes=5)
+            'args': ('kweather_dust_json',)
         },
         'insert_data_weather_list-1-hour': {
-            'task': 'ecocast_celery.ecocast_app.insert_data_weather_area_list_1_hour',
-            'schedule': crontab(minute='46', hour='*'),
-            'args': ()
+            'task': 'ecocast_celery.ecocast_app.plan_poll',
+            'schedule': crontab(minute='30', hour='*'),
+            'args': ('data_weather_1_hour',)
         },
         'insert_data_weather_list-3-hour': {
-            'task': 'ecocast_celery.ecocast_app.insert_data_weather_area_list_3_hour',
-            'schedule': crontab(minute='11', hour='2,5,8,11,14,17,20,23'),
-            'args': ()
+            'task': 'ecocast_celery.ecocast_app.plan_poll',
+            'schedule': crontab(minute='0', hour='2,5,8,11,14,17,20,23'),
+            'args': ('data_weather_3_hour',)
         },
-        'insert_ak_station-once': {
+        'insert_ak_station-1-day': {
             'task': 'ecocast_celery.ecocast_app.insert_ak_station',
-            'schedule': timedelta(seconds=5),
+            'schedule': crontab(minute='30', hour='4'),
+            'args': ()
+        },
+        'maintain_partitions-1-day': {
+            'task': 'ecocast_celery.ecocast_app.maintain_partitions',
+            'schedule': crontab(minute='40', hour='3'),
             'args': ()
         },
         # 'insert_ow_weather_json-1-hour': {
@@ -1,9 +1,15 @@
 from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extras
 from psycopg2.extensions import new_type, DECIMAL
 import logging.handlers
 import json
+import os
+import io
+import csv
+import threading
+import datetime
 
 """ Celery Main Module
     Version: 1.0
@@ -46,28 +52,196 @@ DATA_WEATHER_KEY = 'DATA_WEATHER_KEY'  # URL Decoded
 REQUEST_CONNECT = 10
 REQUEST_READ = 15
 REQUEST_TIME_OUT = (REQUEST_CONNECT, REQUEST_READ)
+HTTP_POOL_CONNECTIONS = 4  # Number of hosts kept in one session
+HTTP_POOL_MAXSIZE = 10  # Keep-alive connections per host
+HTTP_MAX_RETRIES = 0  # Connection retries of urllib3, tasks retry with Celery
+REDIS_URL = 'redis://'  # Broker of Celery, also used for rate limits, watermarks and publication lags
+RATE_LIMITS = {  # upstream: (tokens per second, bucket capacity), shared by every worker with the same API key
+    'airkorea': (10, 20),
+    'data_weather': (10, 20),
+    'openweather': (1, 5),
+}
+PUBLICATION_LAG = {  # source: (default lag, first backoff, max backoff) seconds after the period start
+    'airkorea_air_quality': (60, 60, 10 * 60),
+    'kweather_dust_json': (60, 30, 2 * 60),
+    'data_weather_1_hour': (16 * 60, 60, 5 * 60),
+    'data_weather_3_hour': (11 * 60, 60, 5 * 60),
+}
+TASK_OUTCOME_TTL = 7 * 24 * 60 * 60  # Seconds the outcome of a task name is kept after its last run
+PUBLICATION_LAG_HISTORY = 48  # Observed lags kept per source
+PUBLICATION_LAG_MIN_SAMPLES = 6  # Default lag until enough lags are observed
+PUBLICATION_LAG_QUANTILE = 0.2  # First poll at this quantile of the observed lags, later polls back off
+PUBLICATION_LAG_EXPLORE_RATE = 0.25  # First polls sent one max backoff early, above the quantile so it can drop
+TASK_SERIALIZER = 'msgpack'  # Serializer of the task messages (requires the msgpack package), 'json' also accepted
+TASK_COMPRESSION = None  # None, 'zlib', 'gzip' or 'bzip2'
+TASK_ARGS_VERSION = 2  # Version of the fan-out task arguments, 2: (x int, y int, base time epoch seconds, version)
+TASK_TIME_ZONE = datetime.timezone(datetime.timedelta(hours=9), 'Asia/Seoul')  # Epoch seconds of task arguments
+# are read as KST on every host, whatever its system time zone(Korea has no daylight saving time)
+IDEMPOTENCY_TTL = 60 * 60  # Seconds a claimed natural key of an ingestion task blocks redeliveries and duplicates
+AK_STATION_PAGE_ROWS = 1000  # Stations per page of the station list(about 700, one call), read up to totalCount
+AK_AIR_QUALITY_MODE = 'province'  # station: task per station, batch: task per chunk of stations,
+# sweep: concurrent fetch of every station, province: fetch per sido
+AK_AIR_QUALITY_CHUNK_SIZE = 20  # Stations per task in the batch mode, smaller chunks retry less work
+AK_AIR_QUALITY_HISTORY_ROWS = 3  # Recent hours upserted by each station fetch, fills null values of earlier hours
+AK_DISPATCH_INTERVAL = (11, 20)  # Seconds between station tasks in the station mode, spread with countdown
+DATA_WEATHER_DISPATCH_INTERVAL = (2, 4)  # Seconds between area tasks, spread with countdown
+DISPATCH_WINDOW = 50 * 60  # Seconds a countdown wave may last, so it ends inside the hour and under the default
+# visibility_timeout(3600 s) of the Redis broker, a longer wave is squeezed into it
+AK_SIDO_NAMES = ('서울', '부산', '대구', '인천', '광주', '대전', '울산', '경기', '강원', '충북', '충남', '전북', '전남',
+                 '경북', '경남', '제주', '세종')
+AK_SIDO_ALIASES = {'충청북도': '충북', '충청남도': '충남', '전라북도': '전북', '전라남도': '전남', '경상북도': '경북',
+                   '경상남도': '경남'}  # Full sido names of station addresses not starting with the short name
+AK_REPOLL_STALE_HOURS = 3  # Hours without data after which a station is only polled by the first poll of the hour
+AK_SWEEP_CONCURRENCY = 10  # Requests in flight during the sweep
+AK_SWEEP_RATE = 20  # Requests started per second during the sweep
 DB_HOST = 'DB_HOST'
 DB_NAME = 'DB_NAME'
 DB_USER = 'DB_USER'
 DB_PW = 'DB_PW'
 DB_PORT = 'DB_PORT'
-DB_POOL = ThreadedConnectionPool(1, 30, host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PW, port=DB_PORT)
+DB_INGEST_JSONB = True  # Send each fetch as one jsonb parameter to the ingest_* functions(sql/006_jsonb_ingest.sql)
+PARTITION_TABLES = {  # table: (time column, retention months, None keeps every month)(sql/009_monthly_partitions.sql)
+    'airkorea_air_quality': ('airkorea_air_quality_time', None),
+    'data_weather_1_hour': ('data_weather_1_hour_date', 12),
+    'data_weather_3_hour': ('data_weather_3_hour_date', 12),
+    'kweather_dust': ('kweather_dust_announce_time', 12),
+}
+KWEATHER_SNAPSHOT_RETENTION_MONTHS = 3  # Months of kweather_dust_snapshot kept, whole keyframe groups are deleted
+PARTITION_MONTHS_AHEAD = 2  # Partitions created ahead of the current month
+PARTITION_DROP_EXPIRED = False  # Expired partitions are only detached, dropped by hand after a backup
+LATEST_FORECAST_RETENTION_DAYS = 2  # Past forecasts kept in data_weather_*_latest, history stays in the partitions
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = 30  # Replaced with the worker --concurrency on worker_init (threads, gevent, eventlet pool)
+DB_POOL_PROCESS_MAX_CONN = 2  # A prefork child runs one task at a time
+DB_POOL = None
+DB_POOL_PID = None
+DB_POOL_LOCK = threading.Lock()
+DB_ROW_COUNT = threading.local()  # Rows sent by psql_bulk_insert and psql_copy in the current task
+DEC_2_FLOAT = new_type(DECIMAL.values, 'DEC2FLOAT', lambda value, curs: float(value) if value is not None else None)
+psycopg2.extensions.register_type(DEC_2_FLOAT)
 
 
+def init_db_pool(maxconn: int = None):
+    """ Create the PostgreSQL Connection Pool of the current process
+        Args:
+            maxconn (int): Maximum number of connections, DB_POOL_MAX_CONN if None
+
+        Returns:
+            DB_POOL (object): ThreadedConnectionPool Object
+
+        Comment:
+            Called from worker_process_init in each prefork child, so no socket is opened in the parent
+            and shared between processes after the fork.
+    """
+    global DB_POOL, DB_POOL_PID
+    close_db_pool()
+    if maxconn is None:
+        maxconn = DB_POOL_MAX_CONN
+    maxconn = max(maxconn, DB_POOL_MIN_CONN)
+    logger.debug('init_db_pool(' + str(maxconn) + ') 실행, pid : ' + str(os.getpid()))
+    DB_POOL = ThreadedConnectionPool(DB_POOL_MIN_CONN, maxconn, host=DB_HOST, dbname=DB_NAME, user=DB_USER,
+                                     password=DB_PW, port=DB_PORT)
+    DB_POOL_PID = os.getpid()
+    return DB_POOL
+
+
+def close_db_pool():
+    """ Close every connection of the PostgreSQL Connection Pool
+        Args:
+
+        Returns:
+
+        Comment:
+            A pool inherited from the parent process is only dropped, its sockets belong to the parent.
+    """
+    global DB_POOL, DB_POOL_PID
+    if DB_POOL is not None and DB_POOL_PID == os.getpid() and not DB_POOL.closed:
+        DB_POOL.closeall()
+    DB_POOL = None
+    DB_POOL_PID = None
+
+
+def get_db_pool():
+    """ PostgreSQL Connection Pool of the current process, created lazily
+        Args:
+
+        Returns:
+            DB_POOL (object): ThreadedConnectionPool Object
+    """
+    if DB_POOL is None or DB_POOL_PID != os.getpid():
+        with DB_POOL_LOCK:
+            if DB_POOL is None or DB_POOL_PID != os.getpid():
+                return init_db_pool()
+    return DB_POOL
+
+
+def psql_checkout(pool):
+    """ Take a healthy connection out of the PostgreSQL Connection Pool
+        Args:
+            pool (object): ThreadedConnectionPool Object
+
+        Returns:
+            conn (object): connection Object
+
+        Comment:
+            Connections closed by the server(restart, idle timeout) are discarded until one passes the check.
+            After a restart every idle connection is dead, so at most the pool size plus one are tried,
+            the last one is newly opened by the pool.
+    """
+    for _ in range(pool.maxconn + 1):
+        conn = pool.getconn()
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError('connection already closed')
+            curs = conn.cursor()
+            curs.execute('SELECT 1')
+            curs.close()
+            conn.rollback()
+            return conn
+        except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+            logger.debug('psql_checkout Except : ' + str(e))
+            pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError('psql_checkout : no healthy connection in the pool')
+
+
+def psql_rollback(conn):
+    """ Roll back an open transaction, a failed rollback(connection lost) only closes the connection
+        so the exception of the with block is not replaced.
+    """
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+        logger.debug('psql_rollback Except : ' + str(e))
+        conn.close()
+
+
+@contextmanager
 def psql_connect():
     """ PostgreSQL Connection Pool
         Args:
 
         Returns:
-            conn (object): connection Object
+            conn (object): connection Object, returned to the pool when the with block ends
+
+        Examples:
+            >>> with psql_connect() as conn:
+            >>>     curs = conn.cursor()
+            >>>     curs.execute(sql)
+            >>>     conn.commit()
     """
-    DEC_2_FLOAT = new_type(DECIMAL.values, 'DEC2FLOAT', lambda value, curs: float(value) if value is not None else None)
-    psycopg2.extensions.register_type(DEC_2_FLOAT)
-    return psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PW, port=DB_PORT)
-    if DB_POOL:
-        return DB_POOL.getconn()
-    else:
-        return psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PW, port=DB_PORT)
+    pool = get_db_pool()
+    conn = psql_checkout(pool)
+    try:
+        yield conn
+    except Exception:
+        psql_rollback(conn)
+        raise
+    finally:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            psql_rollback(conn)
+        pool.putconn(conn, close=bool(conn.closed))
 
 
 def psql_select(conn, sql):
@@ -98,3 +272,99 @@ def psql_dict_select(conn, sql):
     result = json.loads(json.dumps(curs.fetchall(), ensure_ascii=False))
     curs.close()
     return result
+
+
+def psql_bulk_insert(conn, sql, values_list, page_size=1000):
+    """ PostgreSQL Multi-row Insert
+        Args:
+            conn (object): connection Object
+            sql (str): SQL Query with a single VALUES %s placeholder
+            values_list (list): Rows to be inserted, list of tuple
+            page_size (int): Maximum number of rows in one statement
+
+        Returns:
+            len(values_list) (int): Number of rows sent
+
+        Examples:
+            >>> psql_bulk_insert(conn, 'INSERT INTO data_weather_area(data_weather_area_x, data_weather_area_y) '
+            >>>                  'VALUES %s', [(60, 127), (61, 126)])
+            2
+    """
+    if not values_list:
+        return 0
+    curs = conn.cursor()
+    psycopg2.extras.execute_values(curs, sql, values_list, page_size=page_size)
+    curs.close()
+    count_rows(len(values_list))
+    return len(values_list)
+
+
+def psql_copy(conn, table, columns, values_list):
+    """ PostgreSQL COPY FROM STDIN with an in-memory CSV buffer
+        Args:
+            conn (object): connection Object
+            table (str): Table name
+            columns (tuple): Column names in the order of each row
+            values_list (list): Rows to be loaded, list of tuple
+
+        Returns:
+            len(values_list) (int): Number of rows loaded
+
+        Comment:
+            None and '' are both loaded as NULL.
+    """
+    if not values_list:
+        return 0
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(values_list)
+    buffer.seek(0)
+    curs = conn.cursor()
+    curs.copy_expert('COPY ' + table + '(' + ', '.join(columns) + ') FROM STDIN WITH (FORMAT csv)', buffer)
+    curs.close()
+    count_rows(len(values_list))
+    return len(values_list)
+
+
+def psql_ingest(conn, function, payload):
+    """ Send a parsed API response as a single jsonb parameter to a server-side ingest function
+        Args:
+            conn (object): connection Object
+            function (str): Function name of sql/006_jsonb_ingest.sql
+            payload (list or dict): JSON data to be unpacked by the function with jsonb_to_recordset
+
+        Returns:
+            row_count (int): Number of rows written
+            data_time (datetime.datetime): Newest data time of the payload, None if empty
+
+        Examples:
+            >>> psql_ingest(conn, 'ingest_data_weather_1_hour', weather_list)
+            (60, datetime.datetime(2020, 10, 26, 20, 30))
+    """
+    curs = conn.cursor()
+    curs.execute('SELECT * FROM ' + function + '(%s)', (psycopg2.extras.Json(payload, dumps=compact_json),))
+    result = curs.fetchone()
+    curs.close()
+    count_rows(result[0])
+    return result[0], result[1]
+
+
+def compact_json(obj):
+    """ JSON text without spaces and escapes of non-ASCII characters """
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def count_rows(row_count):
+    """ Add rows sent to the database to the count of the current thread """
+    DB_ROW_COUNT.value = getattr(DB_ROW_COUNT, 'value', 0) + row_count
+
+
+def reset_row_count():
+    """ Rows counted by count_rows in the current thread since the last reset
+        Args:
+
+        Returns:
+            row_count (int): Number of rows, the count starts again from 0
+    """
+    row_count = getattr(DB_ROW_COUNT, 'value', 0)
+    DB_ROW_COUNT.value = 0
+    return row_count
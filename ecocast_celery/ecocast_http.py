@@ -0,0 +1,160 @@
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import requests
+import aiohttp
+import asyncio
+import os
+import threading
+from .ecocast_redis import acquire_token
+from .ecocast_conf import logger
+from .ecocast_conf import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, REQUEST_TIME_OUT
+
+""" HTTP Client Module
+    Comment:
+        1. Keep-alive sessions per host, created lazily in each worker process(not shared after fork)
+        2. Every call_* function of tasks uses http_get instead of requests.get
+        3. async_get_many fetches many requests of the same URL concurrently(bounded concurrency and rate)
+"""
+
+HTTP_SESSIONS = {}
+HTTP_SESSIONS_PID = None
+HTTP_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(url: str):
+    """ Keep-alive session of the host of the url
+        Args:
+            url (str): Request URL
+
+        Returns:
+            session (object): requests.Session Object
+    """
+    global HTTP_SESSIONS, HTTP_SESSIONS_PID
+    host = urlsplit(url).netloc
+    if HTTP_SESSIONS_PID != os.getpid():
+        with HTTP_SESSIONS_LOCK:
+            if HTTP_SESSIONS_PID != os.getpid():
+                HTTP_SESSIONS = {}
+                HTTP_SESSIONS_PID = os.getpid()
+    session = HTTP_SESSIONS.get(host)
+    if session is None:
+        with HTTP_SESSIONS_LOCK:
+            session = HTTP_SESSIONS.get(host)
+            if session is None:
+                logger.debug('get_session(' + host + ') 실행, pid : ' + str(os.getpid()))
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                                      max_retries=HTTP_MAX_RETRIES)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                HTTP_SESSIONS[host] = session
+    return session
+
+
+def http_get(url: str, params: dict = None, timeout=REQUEST_TIME_OUT):
+    """ GET request over the keep-alive session of the host
+        Args:
+            url (str): Request URL
+            params (dict): Query string parameters
+            timeout (tuple): (connect, read) seconds
+
+        Returns:
+            response (object): requests.Response Object
+
+        Examples:
+            >>> response = http_get(AIRKOREA_HOST + 'MsrstnInfoInqireSvc/getMsrstnList', params_)
+            >>> print(response.json())
+    """
+    return get_session(url).get(url, params=params, timeout=timeout)
+
+
+def close_http_sessions():
+    """ Close every session of the current process
+        Args:
+
+        Returns:
+    """
+    global HTTP_SESSIONS
+    if HTTP_SESSIONS_PID == os.getpid():
+        for session in HTTP_SESSIONS.values():
+            session.close()
+    HTTP_SESSIONS = {}
+
+
+class RateLimiter:
+    """ Start at most rate requests per second in one event loop """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_time > now:
+                await asyncio.sleep(self.next_time - now)
+                now = self.next_time
+            self.next_time = now + self.interval
+
+
+async def async_get_json(session, semaphore, limiter, url: str, params: dict, token: tuple):
+    """ One GET request of async_get_many
+        Args:
+            session (object): aiohttp.ClientSession Object
+            semaphore (object): asyncio.Semaphore bounding the requests in flight
+            limiter (object): RateLimiter Object
+            url (str): Request URL
+            params (dict): Query string parameters
+            token (tuple): (upstream, api_key) of the shared rate limit, None if not limited
+
+        Returns:
+            json_data (dict): Response JSON
+            None (None): Request Timeout Except or not JSON response
+    """
+    async with semaphore:
+        await limiter.wait()
+        if token is not None:
+            wait = acquire_token(*token)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = acquire_token(*token)
+        try:
+            async with session.get(url, params=params) as response:
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.debug('async_get_json(' + str(params) + ') Except : ' + repr(e))
+            return None
+
+
+async def async_get_many_run(url: str, params_list: list, concurrency: int, rate: float, timeout, token):
+    """ Event loop body of async_get_many, one client session for every request """
+    connect, read = timeout
+    client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        return await asyncio.gather(*[async_get_json(session, semaphore, limiter, url, params, token)
+                                      for params in params_list])
+
+
+def async_get_many(url: str, params_list: list, concurrency: int, rate: float, timeout=REQUEST_TIME_OUT,
+                   token: tuple = None):
+    """ Concurrent GET requests of the same URL with different parameters
+        Args:
+            url (str): Request URL
+            params_list (list): Query string parameters of each request
+            concurrency (int): Maximum number of requests in flight
+            rate (float): Maximum number of requests started per second
+            timeout (tuple): (connect, read) seconds
+            token (tuple): (upstream, api_key) of the shared rate limit(acquire_token), None if not limited
+
+        Returns:
+            json_list (list): Response JSON of each request in the order of params_list, None if failed
+
+        Examples:
+            >>> async_get_many(url, [{'stationName': '고읍', ...}, {'stationName': '중구', ...}], 10, 20)
+            [{'response': {'body': {'items': [...]}}}, None]
+    """
+    return asyncio.run(async_get_many_run(url, params_list, concurrency, rate, timeout, token))
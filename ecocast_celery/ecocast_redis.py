@@ -0,0 +1,152 @@
+import redis
+import hashlib
+import os
+from .ecocast_conf import logger
+from .ecocast_conf import REDIS_URL, RATE_LIMITS, IDEMPOTENCY_TTL, TASK_OUTCOME_TTL
+import time
+
+""" Redis Module
+    Comment:
+        1. The broker Redis(REDIS_URL) is shared by every worker process and node
+        2. Token bucket per upstream and API key, so the workers together stay under the provider limits
+        3. Natural key claims(SET NX EX), so a redelivered or duplicated ingestion task runs only once
+        4. Last outcome of each task name in a hash, instead of a result backend for every task
+"""
+
+REDIS_CLIENT = None
+REDIS_CLIENT_PID = None
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local redis_time = redis.call('TIME')
+local now = tonumber(redis_time[1]) + tonumber(redis_time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'time', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+def get_redis():
+    """ Redis client of the current process, created lazily
+        Args:
+
+        Returns:
+            REDIS_CLIENT (object): redis.Redis Object
+    """
+    global REDIS_CLIENT, REDIS_CLIENT_PID
+    if REDIS_CLIENT is None or REDIS_CLIENT_PID != os.getpid():
+        REDIS_CLIENT = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        REDIS_CLIENT_PID = os.getpid()
+    return REDIS_CLIENT
+
+
+def acquire_token(upstream: str, api_key: str, cost: int = 1):
+    """ Take tokens from the bucket of the upstream and API key without waiting
+        Args:
+            upstream (str): Key of RATE_LIMITS
+            api_key (str): API key of the upstream
+            cost (int): Number of tokens
+
+        Returns:
+            wait (float): 0.0 if acquired, otherwise seconds until enough tokens are available
+
+        Examples:
+            >>> if acquire_token('airkorea', AIRKOREA_KEY) > 0:
+            >>>     return True  # Retry with countdown
+    """
+    rate, capacity = RATE_LIMITS[upstream]
+    key = 'rate_limit:' + upstream + ':' + hashlib.sha1(api_key.encode('utf-8')).hexdigest()[:12]
+    try:
+        wait = float(get_redis().eval(TOKEN_BUCKET_SCRIPT, 1, key, rate, capacity, cost))
+    except redis.exceptions.RedisError as e:
+        logger.debug('acquire_token(' + upstream + ') Except : ' + str(e))
+        return 0.0
+    if wait > 0:
+        logger.debug('acquire_token(' + upstream + ') wait : ' + format(wait, '.2f'))
+    return wait
+
+
+def task_key(*natural_key):
+    """ Redis key of the natural key of an ingestion task
+        Args:
+            *natural_key: Source and the values identifying the rows written by the task
+
+        Returns:
+            key (str): 'ingest:' and the values joined by ':'
+
+        Examples:
+            >>> task_key('data_weather_1_hour', 60, 127, '202010262030')
+            'ingest:data_weather_1_hour:60:127:202010262030'
+    """
+    return 'ingest:' + ':'.join(str(value) for value in natural_key)
+
+
+def claim_task(key: str, ttl: int = IDEMPOTENCY_TTL):
+    """ Claim the natural key of an ingestion task before doing the work
+        Args:
+            key (str): Result of task_key
+            ttl (int): Seconds until the claim expires by itself
+
+        Returns:
+            True (bool): Claimed, or Redis is not available (the unique constraints still apply)
+            False (bool): Another worker has it, skip the task
+    """
+    try:
+        claimed = get_redis().set(key, os.getpid(), nx=True, ex=ttl)
+    except redis.exceptions.RedisError as e:
+        logger.debug('claim_task(' + key + ') Except : ' + str(e))
+        return True
+    if not claimed:
+        logger.debug('claim_task(' + key + ') skip')
+    return bool(claimed)
+
+
+def release_task(key: str):
+    """ Release the claim of a task which did not finish its work, so its retry can claim it again
+        Args:
+            key (str): Result of task_key
+
+        Returns:
+    """
+    try:
+        get_redis().delete(key)
+    except redis.exceptions.RedisError as e:
+        logger.debug('release_task(' + key + ') Except : ' + str(e))
+
+
+def record_outcome(task_name: str, status: str, duration: float, row_count: int):
+    """ Keep the last outcome of the task name in the hash 'task_outcome:<task_name>'
+        Args:
+            task_name (str): Name of the Celery task
+            status (str): State of the task(SUCCESS, RETRY, FAILURE, ...)
+            duration (float): Seconds the task ran
+            row_count (int): Rows sent to the database
+
+        Returns:
+
+        Examples:
+            >>> get_redis().hgetall('task_outcome:ecocast_celery.ecocast_app.insert_kw_dust_json')
+            {'status': 'SUCCESS', 'duration': '1.284', 'rows': '3502', 'time': '1603680301', 'SUCCESS': '287', ...}
+    """
+    key = 'task_outcome:' + task_name
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(key, mapping={'status': status, 'duration': format(duration, '.3f'), 'rows': row_count,
+                                'time': int(time.time())})
+        pipe.hincrby(key, status, 1)
+        pipe.expire(key, TASK_OUTCOME_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.debug('record_outcome(' + task_name + ') Except : ' + str(e))
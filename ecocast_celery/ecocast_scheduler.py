@@ -0,0 +1,157 @@
+import redis
+import datetime
+import random
+from .ecocast_redis import get_redis
+from .ecocast_conf import logger
+from .ecocast_conf import PUBLICATION_LAG, PUBLICATION_LAG_HISTORY, PUBLICATION_LAG_MIN_SAMPLES, \
+    PUBLICATION_LAG_QUANTILE, PUBLICATION_LAG_EXPLORE_RATE
+
+""" Adaptive Poll Scheduler Module
+    Comment:
+        1. Each poll of a period records its lag after the data time(dataTime, announceTime, base_time)(record_probe)
+        2. When a new period of a source is first loaded, its publication lag is recorded in Redis(record_publication,
+        called by commit_watermark). The data was published between the last poll finding nothing and the poll
+        finding it(publication_lag_estimate), not at the load time which can never be earlier than our own poll
+        3. Celery Beat fires a planner at each period start, which delays the first poll to a low quantile
+        of the observed lags(first_poll_delay) instead of a fixed minute. Some first polls are sent one max backoff
+        earlier(PUBLICATION_LAG_EXPLORE_RATE), so the quantile also learns an earlier publication
+        4. A probe finding no new data retries with an exponential backoff(poll_backoff)
+"""
+
+LAG_KEY = 'publication_lag:'
+SEEN_KEY = 'publication_seen:'
+PROBE_KEY = 'publication_probe:'
+
+
+def record_probe(source: str, data_time: datetime.datetime, probed_at: datetime.datetime = None):
+    """ Record a poll of the period, before knowing whether it finds the data
+        Args:
+            source (str): Key of PUBLICATION_LAG
+            data_time (datetime.datetime): Data time of the period being polled
+            probed_at (datetime.datetime): Poll time, now if None
+
+        Returns:
+    """
+    if source not in PUBLICATION_LAG:
+        return
+    if probed_at is None:
+        probed_at = datetime.datetime.now()
+    key = PROBE_KEY + source + ':' + data_time.strftime('%Y%m%d%H%M')
+    try:
+        pipeline = get_redis().pipeline()
+        pipeline.rpush(key, (probed_at - data_time).total_seconds())
+        pipeline.expire(key, 24 * 3600)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logger.debug('record_probe(' + source + ') Except : ' + str(e))
+
+
+def publication_lag_estimate(seen_lag: float, probe_list: list):
+    """ Publication lag of a period from its polls instead of its load time
+        Args:
+            seen_lag (float): Lag of the load time
+            probe_list (list): Lags of the polls of the period(record_probe)
+
+        Returns:
+            lag (float): Middle of the last poll finding nothing and the poll finding the data,
+                         the poll finding the data if it was the first one, seen_lag without polls
+
+        Examples:
+            >>> publication_lag_estimate(1030.0, [900.0, 960.0, 1020.0])
+            990.0
+    """
+    probe_list = sorted([lag for lag in probe_list if lag <= seen_lag])
+    if not probe_list:
+        return seen_lag
+    if len(probe_list) == 1:
+        return probe_list[0]
+    return (probe_list[-2] + probe_list[-1]) / 2
+
+
+def record_publication(source: str, data_time: datetime.datetime, seen_at: datetime.datetime = None):
+    """ Record the publication lag of a period the first time it is loaded
+        Args:
+            source (str): Key of PUBLICATION_LAG
+            data_time (datetime.datetime): Data time of the period
+            seen_at (datetime.datetime): Load time, now if None
+
+        Returns:
+            lag (float): Recorded lag in seconds(publication_lag_estimate), None if the period was already recorded
+    """
+    if source not in PUBLICATION_LAG:
+        return None
+    if seen_at is None:
+        seen_at = datetime.datetime.now()
+    lag = (seen_at - data_time).total_seconds()
+    if lag < 0 or lag > 6 * 60 * 60:
+        return None
+    try:
+        client = get_redis()
+        period = source + ':' + data_time.strftime('%Y%m%d%H%M')
+        if not client.set(SEEN_KEY + period, 1, nx=True, ex=2 * 24 * 3600):
+            return None
+        lag = publication_lag_estimate(lag, [float(probe) for probe in client.lrange(PROBE_KEY + period, 0, -1)])
+        pipeline = client.pipeline()
+        pipeline.lpush(LAG_KEY + source, lag)
+        pipeline.ltrim(LAG_KEY + source, 0, PUBLICATION_LAG_HISTORY - 1)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logger.debug('record_publication(' + source + ') Except : ' + str(e))
+        return None
+    logger.debug('record_publication(' + source + ') lag : ' + format(lag, '.0f'))
+    return lag
+
+
+def expected_lag(source: str):
+    """ Seconds after the period start when new data of the source is expected
+        Args:
+            source (str): Key of PUBLICATION_LAG
+
+        Returns:
+            lag (float): PUBLICATION_LAG_QUANTILE of the observed lags, the default lag until enough are observed
+    """
+    default_lag = PUBLICATION_LAG[source][0]
+    try:
+        lag_list = sorted([float(lag) for lag in get_redis().lrange(LAG_KEY + source, 0, -1)])
+    except redis.exceptions.RedisError as e:
+        logger.debug('expected_lag(' + source + ') Except : ' + str(e))
+        return default_lag
+    if len(lag_list) < PUBLICATION_LAG_MIN_SAMPLES:
+        return default_lag
+    return lag_list[int(PUBLICATION_LAG_QUANTILE * (len(lag_list) - 1))]
+
+
+def first_poll_delay(source: str, period_start: datetime.datetime = None, explore: bool = None):
+    """ Countdown of the first poll of a period
+        Args:
+            source (str): Key of PUBLICATION_LAG
+            period_start (datetime.datetime): Start of the period, the current minute if None(Beat fires at it)
+            explore (bool): Poll one max backoff before the expected lag, by PUBLICATION_LAG_EXPLORE_RATE if None
+
+        Returns:
+            countdown (int): Seconds from now
+
+        Examples:
+            >>> first_poll_delay('airkorea_air_quality')
+            912
+    """
+    now = datetime.datetime.now()
+    if period_start is None:
+        period_start = now.replace(second=0, microsecond=0)
+    if explore is None:
+        explore = random.random() < PUBLICATION_LAG_EXPLORE_RATE
+    lag = expected_lag(source) - (PUBLICATION_LAG[source][2] if explore else 0)
+    return max(0, int(lag - (now - period_start).total_seconds()))
+
+
+def poll_backoff(source: str, attempt: int):
+    """ Countdown of the next poll after a probe without new data
+        Args:
+            source (str): Key of PUBLICATION_LAG
+            attempt (int): Number of failed probes of the period(task.request.retries)
+
+        Returns:
+            countdown (int): first backoff * 2 ** attempt, at most the max backoff
+    """
+    first_backoff, max_backoff = PUBLICATION_LAG[source][1:]
+    return min(first_backoff * 2 ** attempt, max_backoff)
@@ -0,0 +1,97 @@
+import redis
+import datetime
+from .ecocast_redis import get_redis
+from .ecocast_scheduler import record_publication
+from .ecocast_conf import logger, psql_connect
+
+""" Ingest Watermark Module
+    Comment:
+        1. ingest_watermark keeps the newest data time loaded per source(airkorea_air_quality, kweather_dust_json)
+        2. The loaders update it in the same transaction as their data(commit_watermark), then mirror it in Redis
+        and record the publication lag of a new period for the poll scheduler
+        3. Freshness checks read Redis first and fall back to a primary key lookup
+"""
+
+WATERMARK_KEY = 'ingest_watermark:'
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'  # Sortable as a string
+MIRROR_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current or current < ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+"""
+
+
+def get_watermark(source: str):
+    """ Newest data time loaded of the source
+        Args:
+            source (str): Source name
+
+        Returns:
+            watermark (datetime.datetime): Newest data time, None if nothing loaded yet
+
+        Examples:
+            >>> print(get_watermark('airkorea_air_quality'))
+            2020-10-16 17:00:00
+    """
+    try:
+        cached = get_redis().get(WATERMARK_KEY + source)
+        if cached is not None:
+            return datetime.datetime.strptime(cached, WATERMARK_FORMAT)
+    except redis.exceptions.RedisError as e:
+        logger.debug('get_watermark(' + source + ') Except : ' + str(e))
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        curs.execute('SELECT ingest_watermark_time FROM ingest_watermark WHERE ingest_watermark_source = %s',
+                     (source,))
+        result = curs.fetchone()
+        curs.close()
+    if result is None:
+        return None
+    mirror_watermark(source, result[0])
+    return result[0]
+
+
+def commit_watermark(conn, source: str, watermark: datetime.datetime):
+    """ Advance the watermark in the transaction of the loaded data, commit, then mirror it in Redis
+        and record the publication lag
+        Args:
+            conn (object): connection Object with the loaded data not committed yet
+            source (str): Source name
+            watermark (datetime.datetime): Newest data time of the loaded data, only commit if None
+
+        Returns:
+
+        Examples:
+            >>> with psql_connect() as conn:
+            >>>     insert_ak_air_quality_rows(conn, values_list)
+            >>>     commit_watermark(conn, 'airkorea_air_quality', ak_air_quality_watermark(values_list))
+    """
+    if watermark is None:
+        conn.commit()
+        return
+    curs = conn.cursor()
+    curs.execute(
+        'INSERT INTO ingest_watermark(ingest_watermark_source, ingest_watermark_time) VALUES(%s, %s) '
+        'ON CONFLICT (ingest_watermark_source) DO UPDATE SET '
+        'ingest_watermark_time = GREATEST(ingest_watermark.ingest_watermark_time, EXCLUDED.ingest_watermark_time), '
+        'ingest_watermark_date = now() RETURNING ingest_watermark_time', (source, watermark))
+    watermark = curs.fetchone()[0]
+    curs.close()
+    conn.commit()
+    mirror_watermark(source, watermark)
+    record_publication(source, watermark)
+
+
+def mirror_watermark(source: str, watermark: datetime.datetime):
+    """ Copy the watermark of the database in Redis, never moving it back
+        Args:
+            source (str): Source name
+            watermark (datetime.datetime): Watermark committed in ingest_watermark
+
+        Returns:
+    """
+    try:
+        get_redis().eval(MIRROR_SCRIPT, 1, WATERMARK_KEY + source, watermark.strftime(WATERMARK_FORMAT))
+    except redis.exceptions.RedisError as e:
+        logger.debug('mirror_watermark(' + source + ') Except : ' + str(e))
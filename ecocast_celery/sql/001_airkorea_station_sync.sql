@@ -0,0 +1,30 @@
+-- Airkorea station catalog sync (ak_station_task.insert_ak_station)
+-- Station names become unique so the catalog can be upserted with ON CONFLICT (airkorea_station_name).
+
+BEGIN;
+
+-- Keep the first row of each station name inserted by the previous full reloads(every 5 seconds, so a name can
+-- have hundreds of thousands of rows). One sort of the table instead of a self-join of every pair of duplicates.
+CREATE TEMP TABLE airkorea_station_first ON COMMIT DROP AS
+SELECT DISTINCT ON (airkorea_station_name) *
+FROM airkorea_station
+ORDER BY airkorea_station_name, ctid;
+
+TRUNCATE airkorea_station;
+
+INSERT INTO airkorea_station
+SELECT *
+FROM airkorea_station_first;
+
+ALTER TABLE airkorea_station
+    ADD CONSTRAINT airkorea_station_name_key UNIQUE (airkorea_station_name);
+
+-- Content hash of the last synced upstream catalog, one row per source
+CREATE TABLE IF NOT EXISTS catalog_sync
+(
+    catalog_sync_source VARCHAR(50) PRIMARY KEY,
+    catalog_sync_hash   CHAR(64)  NOT NULL,
+    catalog_sync_date   TIMESTAMP NOT NULL DEFAULT now()
+);
+
+COMMIT;
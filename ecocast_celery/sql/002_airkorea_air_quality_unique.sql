@@ -0,0 +1,16 @@
+-- Airkorea air quality upsert (ak_air_quality_task.insert_ak_air_quality_rows)
+-- One row per station and hour, so the recent hours of every fetch can be upserted with ON CONFLICT.
+
+BEGIN;
+
+-- Keep the newest row of each station and hour inserted twice by the previous retries
+DELETE FROM airkorea_air_quality a
+    USING airkorea_air_quality b
+WHERE a.airkorea_station_name = b.airkorea_station_name
+  AND a.airkorea_air_quality_time = b.airkorea_air_quality_time
+  AND a.airkorea_air_quality_id < b.airkorea_air_quality_id;
+
+ALTER TABLE airkorea_air_quality
+    ADD CONSTRAINT airkorea_air_quality_station_time_key UNIQUE (airkorea_station_name, airkorea_air_quality_time);
+
+COMMIT;
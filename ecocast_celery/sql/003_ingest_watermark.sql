@@ -0,0 +1,28 @@
+-- Ingest watermark (ecocast_watermark)
+-- Newest data time loaded per source, updated in the same transaction as the data and mirrored in Redis.
+-- Freshness checks become a primary key lookup instead of a sort or a JSON path scan of the data tables.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ingest_watermark
+(
+    ingest_watermark_source VARCHAR(50) PRIMARY KEY,
+    ingest_watermark_time   TIMESTAMP NOT NULL,
+    ingest_watermark_date   TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO ingest_watermark(ingest_watermark_source, ingest_watermark_time)
+SELECT 'airkorea_air_quality', max(airkorea_air_quality_time)
+FROM airkorea_air_quality
+HAVING max(airkorea_air_quality_time) IS NOT NULL
+ON CONFLICT (ingest_watermark_source) DO NOTHING;
+
+INSERT INTO ingest_watermark(ingest_watermark_source, ingest_watermark_time)
+SELECT 'kweather_dust_json',
+       to_timestamp(kweather_dust_json_data -> 'station' -> 0 ->> 'announceTime', 'YYYYMMDDHH24MI')::TIMESTAMP
+FROM kweather_dust_json
+ORDER BY kweather_dust_json_date DESC
+LIMIT 1
+ON CONFLICT (ingest_watermark_source) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,20 @@
+-- Per-station freshness (ak_air_quality_task.insert_ak_air_quality_list)
+-- Newest dataTime loaded per station, updated in the same transaction as airkorea_air_quality.
+-- The hourly sweep only polls the stations older than the current hour.
+
+BEGIN;
+
+ALTER TABLE airkorea_station
+    ADD COLUMN IF NOT EXISTS airkorea_station_data_time TIMESTAMP;
+
+UPDATE airkorea_station s
+SET airkorea_station_data_time = q.data_time
+FROM (SELECT airkorea_station_name, max(airkorea_air_quality_time) AS data_time
+      FROM airkorea_air_quality
+      GROUP BY airkorea_station_name) q
+WHERE s.airkorea_station_name = q.airkorea_station_name;
+
+CREATE INDEX IF NOT EXISTS airkorea_station_data_time_idx
+    ON airkorea_station (airkorea_station_data_time) WHERE airkorea_station_is_active = TRUE;
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- Dataportal forecast idempotent insert (data_weather_task.insert_data_weather_1_hour_rows, _3_hour_rows)
+-- One row per grid, base time and forecast time, so a duplicated or redelivered task is skipped with ON CONFLICT DO NOTHING.
+
+BEGIN;
+
+-- Keep the first row of each grid, base time and forecast time inserted twice by the previous retries
+DELETE FROM data_weather_1_hour a
+    USING data_weather_1_hour b
+WHERE a.data_weather_area_x = b.data_weather_area_x
+  AND a.data_weather_area_y = b.data_weather_area_y
+  AND a.data_weather_1_hour_date = b.data_weather_1_hour_date
+  AND a.data_weather_1_hour_forecast_date = b.data_weather_1_hour_forecast_date
+  AND a.ctid > b.ctid;
+
+ALTER TABLE data_weather_1_hour
+    ADD CONSTRAINT data_weather_1_hour_area_date_key
+        UNIQUE (data_weather_area_x, data_weather_area_y, data_weather_1_hour_date, data_weather_1_hour_forecast_date);
+
+DELETE FROM data_weather_3_hour a
+    USING data_weather_3_hour b
+WHERE a.data_weather_area_x = b.data_weather_area_x
+  AND a.data_weather_area_y = b.data_weather_area_y
+  AND a.data_weather_3_hour_date = b.data_weather_3_hour_date
+  AND a.data_weather_3_hour_forecast_date = b.data_weather_3_hour_forecast_date
+  AND a.ctid > b.ctid;
+
+ALTER TABLE data_weather_3_hour
+    ADD CONSTRAINT data_weather_3_hour_area_date_key
+        UNIQUE (data_weather_area_x, data_weather_area_y, data_weather_3_hour_date, data_weather_3_hour_forecast_date);
+
+COMMIT;
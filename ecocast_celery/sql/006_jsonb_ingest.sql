@@ -0,0 +1,287 @@
+-- Server-side JSON ingest (ecocast_conf.psql_ingest)
+-- Each fetch is sent as one jsonb parameter and unpacked with jsonb_to_recordset in one statement.
+-- Values are coerced to the column types of the tables with jsonb_populate_record, '' and '-' are loaded as NULL.
+-- Every function returns (row_count, newest data time) for the ingest watermark.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION ingest_null(p_value TEXT) RETURNS TEXT
+    LANGUAGE sql
+    IMMUTABLE AS
+$$
+SELECT NULLIF(NULLIF(p_value, ''), '-')
+$$;
+
+-- Airkorea dataTime(YYYY-MM-DD HH:MI), 24:00 is 00:00 of the next day
+CREATE OR REPLACE FUNCTION ingest_ak_time(p_value TEXT) RETURNS TIMESTAMP
+    LANGUAGE sql
+    STABLE AS
+$$
+SELECT CASE
+           WHEN p_value LIKE '%24:00' THEN (left(p_value, 10)::DATE + 1)::TIMESTAMP
+           ELSE to_timestamp(p_value, 'YYYY-MM-DD HH24:MI')::TIMESTAMP
+           END
+$$;
+
+-- Dataportal and Kweather date and time(YYYYMMDDHHMI) without the session time zone, NULL when not 12 digits
+CREATE OR REPLACE FUNCTION ingest_kma_time(p_value TEXT) RETURNS TIMESTAMP
+    LANGUAGE sql
+    IMMUTABLE AS
+$$
+SELECT CASE
+           WHEN p_value ~ '^[0-9]{12}$' THEN make_timestamp(substr(p_value, 1, 4)::INT, substr(p_value, 5, 2)::INT,
+                                                             substr(p_value, 7, 2)::INT, substr(p_value, 9, 2)::INT,
+                                                             substr(p_value, 11, 2)::INT, 0)
+           END
+$$;
+
+-- Airkorea air quality, p_stations: {"<station name>": [<items of the station, newest first>], ...}
+-- Same upsert as ak_air_quality_task.insert_ak_air_quality_rows, row_count is the number of rows written.
+CREATE OR REPLACE FUNCTION ingest_airkorea_air_quality(p_stations JSONB, OUT row_count INTEGER,
+                                                       OUT data_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT s.key AS station_name, i.*
+                  FROM jsonb_each(p_stations) AS s(key, value),
+                       jsonb_to_recordset(s.value) AS i("dataTime" TEXT, "mangName" TEXT, "so2Value" TEXT,
+                                                        "so2Grade" TEXT, "coValue" TEXT, "coGrade" TEXT,
+                                                        "o3Value" TEXT, "o3Grade" TEXT, "no2Value" TEXT,
+                                                        "no2Grade" TEXT, "pm10Value" TEXT, "pm10Grade" TEXT,
+                                                        "pm10Value24" TEXT, "pm25Value" TEXT, "pm25Grade" TEXT,
+                                                        "pm25Value24" TEXT, "khaiValue" TEXT, "khaiGrade" TEXT)),
+         rec AS (SELECT r.*
+                 FROM item,
+                      jsonb_populate_record(NULL::airkorea_air_quality, jsonb_build_object(
+                 'airkorea_air_quality_time', ingest_ak_time("dataTime"),
+                 'airkorea_air_quality_mang', ingest_null("mangName"),
+                 'airkorea_air_quality_so2', ingest_null("so2Value"),
+                 'airkorea_air_quality_so2_grade', ingest_null("so2Grade"),
+                 'airkorea_air_quality_co', ingest_null("coValue"),
+                 'airkorea_air_quality_co_grade', ingest_null("coGrade"),
+                 'airkorea_air_quality_o3', ingest_null("o3Value"),
+                 'airkorea_air_quality_o3_grade', ingest_null("o3Grade"),
+                 'airkorea_air_quality_no2', ingest_null("no2Value"),
+                 'airkorea_air_quality_no2_grade', ingest_null("no2Grade"),
+                 'airkorea_air_quality_pm10', ingest_null("pm10Value"),
+                 'airkorea_air_quality_pm10_grade', ingest_null("pm10Grade"),
+                 'airkorea_air_quality_pm10_forecast', ingest_null("pm10Value24"),
+                 'airkorea_air_quality_pm25', ingest_null("pm25Value"),
+                 'airkorea_air_quality_pm25_grade', ingest_null("pm25Grade"),
+                 'airkorea_air_quality_pm25_forecast', ingest_null("pm25Value24"),
+                 'airkorea_air_quality_khai', ingest_null("khaiValue"),
+                 'airkorea_air_quality_khai_grade', ingest_null("khaiGrade"),
+                 'airkorea_station_name', station_name)) AS r
+                 WHERE "dataTime" IS NOT NULL),
+         upsert AS (
+             INSERT INTO airkorea_air_quality AS a (airkorea_air_quality_time, airkorea_air_quality_mang,
+                                                    airkorea_air_quality_so2, airkorea_air_quality_so2_grade,
+                                                    airkorea_air_quality_co, airkorea_air_quality_co_grade,
+                                                    airkorea_air_quality_o3, airkorea_air_quality_o3_grade,
+                                                    airkorea_air_quality_no2, airkorea_air_quality_no2_grade,
+                                                    airkorea_air_quality_pm10, airkorea_air_quality_pm10_grade,
+                                                    airkorea_air_quality_pm10_forecast, airkorea_air_quality_pm25,
+                                                    airkorea_air_quality_pm25_grade,
+                                                    airkorea_air_quality_pm25_forecast, airkorea_air_quality_khai,
+                                                    airkorea_air_quality_khai_grade, airkorea_station_name)
+                 SELECT airkorea_air_quality_time, airkorea_air_quality_mang, airkorea_air_quality_so2,
+                        airkorea_air_quality_so2_grade, airkorea_air_quality_co, airkorea_air_quality_co_grade,
+                        airkorea_air_quality_o3, airkorea_air_quality_o3_grade, airkorea_air_quality_no2,
+                        airkorea_air_quality_no2_grade, airkorea_air_quality_pm10, airkorea_air_quality_pm10_grade,
+                        airkorea_air_quality_pm10_forecast, airkorea_air_quality_pm25,
+                        airkorea_air_quality_pm25_grade, airkorea_air_quality_pm25_forecast,
+                        airkorea_air_quality_khai, airkorea_air_quality_khai_grade, airkorea_station_name
+                 FROM rec
+                 ON CONFLICT (airkorea_station_name, airkorea_air_quality_time) DO UPDATE SET
+                     airkorea_air_quality_mang = EXCLUDED.airkorea_air_quality_mang,
+                     airkorea_air_quality_so2 = EXCLUDED.airkorea_air_quality_so2,
+                     airkorea_air_quality_so2_grade = EXCLUDED.airkorea_air_quality_so2_grade,
+                     airkorea_air_quality_co = EXCLUDED.airkorea_air_quality_co,
+                     airkorea_air_quality_co_grade = EXCLUDED.airkorea_air_quality_co_grade,
+                     airkorea_air_quality_o3 = EXCLUDED.airkorea_air_quality_o3,
+                     airkorea_air_quality_o3_grade = EXCLUDED.airkorea_air_quality_o3_grade,
+                     airkorea_air_quality_no2 = EXCLUDED.airkorea_air_quality_no2,
+                     airkorea_air_quality_no2_grade = EXCLUDED.airkorea_air_quality_no2_grade,
+                     airkorea_air_quality_pm10 = EXCLUDED.airkorea_air_quality_pm10,
+                     airkorea_air_quality_pm10_grade = EXCLUDED.airkorea_air_quality_pm10_grade,
+                     airkorea_air_quality_pm10_forecast = EXCLUDED.airkorea_air_quality_pm10_forecast,
+                     airkorea_air_quality_pm25 = EXCLUDED.airkorea_air_quality_pm25,
+                     airkorea_air_quality_pm25_grade = EXCLUDED.airkorea_air_quality_pm25_grade,
+                     airkorea_air_quality_pm25_forecast = EXCLUDED.airkorea_air_quality_pm25_forecast,
+                     airkorea_air_quality_khai = EXCLUDED.airkorea_air_quality_khai,
+                     airkorea_air_quality_khai_grade = EXCLUDED.airkorea_air_quality_khai_grade
+                 WHERE (a.airkorea_air_quality_mang, a.airkorea_air_quality_so2, a.airkorea_air_quality_so2_grade,
+                        a.airkorea_air_quality_co, a.airkorea_air_quality_co_grade, a.airkorea_air_quality_o3,
+                        a.airkorea_air_quality_o3_grade, a.airkorea_air_quality_no2,
+                        a.airkorea_air_quality_no2_grade, a.airkorea_air_quality_pm10,
+                        a.airkorea_air_quality_pm10_grade, a.airkorea_air_quality_pm10_forecast,
+                        a.airkorea_air_quality_pm25, a.airkorea_air_quality_pm25_grade,
+                        a.airkorea_air_quality_pm25_forecast, a.airkorea_air_quality_khai,
+                        a.airkorea_air_quality_khai_grade) IS DISTINCT FROM
+                       (EXCLUDED.airkorea_air_quality_mang, EXCLUDED.airkorea_air_quality_so2,
+                        EXCLUDED.airkorea_air_quality_so2_grade, EXCLUDED.airkorea_air_quality_co,
+                        EXCLUDED.airkorea_air_quality_co_grade, EXCLUDED.airkorea_air_quality_o3,
+                        EXCLUDED.airkorea_air_quality_o3_grade, EXCLUDED.airkorea_air_quality_no2,
+                        EXCLUDED.airkorea_air_quality_no2_grade, EXCLUDED.airkorea_air_quality_pm10,
+                        EXCLUDED.airkorea_air_quality_pm10_grade, EXCLUDED.airkorea_air_quality_pm10_forecast,
+                        EXCLUDED.airkorea_air_quality_pm25, EXCLUDED.airkorea_air_quality_pm25_grade,
+                        EXCLUDED.airkorea_air_quality_pm25_forecast, EXCLUDED.airkorea_air_quality_khai,
+                        EXCLUDED.airkorea_air_quality_khai_grade)
+                 RETURNING 1),
+         station AS (
+             UPDATE airkorea_station AS s
+                 SET airkorea_station_data_time = r.data_time
+                 FROM (SELECT airkorea_station_name, max(airkorea_air_quality_time) AS data_time
+                       FROM rec
+                       GROUP BY airkorea_station_name) r
+                 WHERE s.airkorea_station_name = r.airkorea_station_name
+                     AND (s.airkorea_station_data_time IS NULL OR s.airkorea_station_data_time < r.data_time)
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM upsert), (SELECT max(airkorea_air_quality_time) FROM rec)
+    INTO row_count, data_time;
+END
+$$;
+
+-- Dataportal ultra-short-term forecast, p_items: items of the response, one item per category
+CREATE OR REPLACE FUNCTION ingest_data_weather_1_hour(p_items JSONB, OUT row_count INTEGER,
+                                                      OUT base_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_items) AS i("baseDate" TEXT, "baseTime" TEXT, "fcstDate" TEXT,
+                                                        "fcstTime" TEXT, category TEXT, "fcstValue" TEXT,
+                                                        nx INTEGER, ny INTEGER)),
+         forecast AS (SELECT ingest_kma_time("baseDate" || "baseTime") AS base_date,
+                             ingest_kma_time("fcstDate" || "fcstTime") AS forecast_date, nx, ny,
+                             jsonb_object_agg(category, ingest_null("fcstValue")) AS value
+                      FROM item
+                      GROUP BY "baseDate", "baseTime", "fcstDate", "fcstTime", nx, ny),
+         rec AS (SELECT r.*
+                 FROM forecast,
+                      jsonb_populate_record(NULL::data_weather_1_hour, jsonb_build_object(
+                 'data_weather_1_hour_date', base_date, 'data_weather_1_hour_lgt', value -> 'LGT',
+                 'data_weather_1_hour_pty', value -> 'PTY', 'data_weather_1_hour_rn1', value -> 'RN1',
+                 'data_weather_1_hour_sky', value -> 'SKY', 'data_weather_1_hour_t1h', value -> 'T1H',
+                 'data_weather_1_hour_reh', value -> 'REH', 'data_weather_1_hour_uuu', value -> 'UUU',
+                 'data_weather_1_hour_vvv', value -> 'VVV', 'data_weather_1_hour_vec', value -> 'VEC',
+                 'data_weather_1_hour_wsd', value -> 'WSD', 'data_weather_1_hour_forecast_date', forecast_date,
+                 'data_weather_area_x', nx, 'data_weather_area_y', ny)) AS r),
+         ins AS (
+             INSERT INTO data_weather_1_hour (data_weather_1_hour_date, data_weather_1_hour_lgt,
+                                              data_weather_1_hour_pty, data_weather_1_hour_rn1,
+                                              data_weather_1_hour_sky, data_weather_1_hour_t1h,
+                                              data_weather_1_hour_reh, data_weather_1_hour_uuu,
+                                              data_weather_1_hour_vvv, data_weather_1_hour_vec,
+                                              data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+                                              data_weather_area_x, data_weather_area_y)
+                 SELECT data_weather_1_hour_date, data_weather_1_hour_lgt, data_weather_1_hour_pty,
+                        data_weather_1_hour_rn1, data_weather_1_hour_sky, data_weather_1_hour_t1h,
+                        data_weather_1_hour_reh, data_weather_1_hour_uuu, data_weather_1_hour_vvv,
+                        data_weather_1_hour_vec, data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+                        data_weather_area_x, data_weather_area_y
+                 FROM rec
+                 ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_1_hour_date,
+                     data_weather_1_hour_forecast_date) DO NOTHING
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(data_weather_1_hour_date) FROM rec)
+    INTO row_count, base_time;
+END
+$$;
+
+-- Dataportal neighborhood forecast, p_items: items of the response, one item per category
+CREATE OR REPLACE FUNCTION ingest_data_weather_3_hour(p_items JSONB, OUT row_count INTEGER,
+                                                      OUT base_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_items) AS i("baseDate" TEXT, "baseTime" TEXT, "fcstDate" TEXT,
+                                                        "fcstTime" TEXT, category TEXT, "fcstValue" TEXT,
+                                                        nx INTEGER, ny INTEGER)),
+         forecast AS (SELECT ingest_kma_time("baseDate" || "baseTime") AS base_date,
+                             ingest_kma_time("fcstDate" || "fcstTime") AS forecast_date, nx, ny,
+                             jsonb_object_agg(category, ingest_null("fcstValue")) AS value
+                      FROM item
+                      GROUP BY "baseDate", "baseTime", "fcstDate", "fcstTime", nx, ny),
+         rec AS (SELECT r.*
+                 FROM forecast,
+                      jsonb_populate_record(NULL::data_weather_3_hour, jsonb_build_object(
+                 'data_weather_3_hour_date', base_date, 'data_weather_3_hour_pop', value -> 'POP',
+                 'data_weather_3_hour_pty', value -> 'PTY', 'data_weather_3_hour_reh', value -> 'REH',
+                 'data_weather_3_hour_sky', value -> 'SKY', 'data_weather_3_hour_t3h', value -> 'T3H',
+                 'data_weather_3_hour_uuu', value -> 'UUU', 'data_weather_3_hour_vec', value -> 'VEC',
+                 'data_weather_3_hour_vvv', value -> 'VVV', 'data_weather_3_hour_wsd', value -> 'WSD',
+                 'data_weather_3_hour_forecast_date', forecast_date,
+                 'data_weather_area_x', nx, 'data_weather_area_y', ny)) AS r),
+         ins AS (
+             INSERT INTO data_weather_3_hour (data_weather_3_hour_date, data_weather_3_hour_pop,
+                                              data_weather_3_hour_pty, data_weather_3_hour_reh,
+                                              data_weather_3_hour_sky, data_weather_3_hour_t3h,
+                                              data_weather_3_hour_uuu, data_weather_3_hour_vec,
+                                              data_weather_3_hour_vvv, data_weather_3_hour_wsd,
+                                              data_weather_3_hour_forecast_date, data_weather_area_x,
+                                              data_weather_area_y)
+                 SELECT data_weather_3_hour_date, data_weather_3_hour_pop, data_weather_3_hour_pty,
+                        data_weather_3_hour_reh, data_weather_3_hour_sky, data_weather_3_hour_t3h,
+                        data_weather_3_hour_uuu, data_weather_3_hour_vec, data_weather_3_hour_vvv,
+                        data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, data_weather_area_x,
+                        data_weather_area_y
+                 FROM rec
+                 ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_3_hour_date,
+                     data_weather_3_hour_forecast_date) DO NOTHING
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(data_weather_3_hour_date) FROM rec)
+    INTO row_count, base_time;
+END
+$$;
+
+-- Kweather fine dust stations, p_stations: findust -> station of the response
+CREATE OR REPLACE FUNCTION ingest_kweather_dust(p_stations JSONB, OUT row_count INTEGER,
+                                                OUT announce_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_stations) AS i("areaName_wide" TEXT, "areaName_city" TEXT,
+                                                           "areaName_dong" TEXT, "announceTime" TEXT, "Lat" TEXT,
+                                                           "Lng" TEXT, "PM10_VALUE" TEXT, "PM25_VALUE" TEXT)),
+         rec AS (SELECT r.*
+                 FROM item,
+                      jsonb_populate_record(NULL::kweather_dust, jsonb_build_object(
+                 'kweather_dust_sd', ingest_null("areaName_wide"),
+                 'kweather_dust_sgg', ingest_null("areaName_city"),
+                 'kweather_dust_emd', ingest_null("areaName_dong"),
+                 'kweather_dust_announce_time', ingest_kma_time("announceTime"),
+                 'kweather_dust_lat', ingest_null("Lat"), 'kweather_dust_lon', ingest_null("Lng"),
+                 'kweather_dust_pm100', ingest_null("PM10_VALUE"),
+                 'kweather_dust_pm25', ingest_null("PM25_VALUE"))) AS r),
+         ins AS (
+             INSERT INTO kweather_dust (kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd,
+                                        kweather_dust_announce_time, kweather_dust_lat, kweather_dust_lon,
+                                        kweather_dust_pm100, kweather_dust_pm25)
+                 SELECT kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd, kweather_dust_announce_time,
+                        kweather_dust_lat, kweather_dust_lon, kweather_dust_pm100, kweather_dust_pm25
+                 FROM rec
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(kweather_dust_announce_time) FROM rec)
+    INTO row_count, announce_time;
+END
+$$;
+
+-- Kweather fine dust JSON, p_data: the whole response, kept in kweather_dust_json and unpacked into kweather_dust
+CREATE OR REPLACE FUNCTION ingest_kweather_dust_json(p_data JSONB, OUT row_count INTEGER,
+                                                     OUT announce_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    -- Coerced to the type of kweather_dust_json_data(json or jsonb)
+    INSERT INTO kweather_dust_json(kweather_dust_json_data)
+    SELECT kweather_dust_json_data
+    FROM jsonb_populate_record(NULL::kweather_dust_json, jsonb_build_object('kweather_dust_json_data', p_data));
+    SELECT d.row_count, d.announce_time INTO row_count, announce_time
+    FROM ingest_kweather_dust(p_data -> 'station') AS d;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,63 @@
+-- Kweather fine dust relational table (kw_dust_task.load_kw_dust_json, sql/006_jsonb_ingest.sql)
+-- Every snapshot is expanded into kweather_dust at ingest time by ingest_kweather_dust_json(the loader stage),
+-- one row per announce time and dong under a unique (announce_time, sd, sgg, emd) index.
+-- Freshness checks use ingest_watermark(sql/003_ingest_watermark.sql), not kweather_dust_json.
+
+BEGIN;
+
+-- Keep the first row of each announce time and dong loaded twice by the previous loaders
+DELETE FROM kweather_dust a
+    USING kweather_dust b
+WHERE a.kweather_dust_announce_time = b.kweather_dust_announce_time
+  AND a.kweather_dust_sd = b.kweather_dust_sd
+  AND a.kweather_dust_sgg = b.kweather_dust_sgg
+  AND a.kweather_dust_emd = b.kweather_dust_emd
+  AND a.ctid > b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS kweather_dust_announce_area_key
+    ON kweather_dust (kweather_dust_announce_time, kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd);
+
+-- A snapshot loaded twice(redelivery, overlapping tasks) is skipped by the unique index
+CREATE OR REPLACE FUNCTION ingest_kweather_dust(p_stations JSONB, OUT row_count INTEGER,
+                                                OUT announce_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_stations) AS i("areaName_wide" TEXT, "areaName_city" TEXT,
+                                                           "areaName_dong" TEXT, "announceTime" TEXT, "Lat" TEXT,
+                                                           "Lng" TEXT, "PM10_VALUE" TEXT, "PM25_VALUE" TEXT)),
+         rec AS (SELECT r.*
+                 FROM item,
+                      jsonb_populate_record(NULL::kweather_dust, jsonb_build_object(
+                 'kweather_dust_sd', ingest_null("areaName_wide"),
+                 'kweather_dust_sgg', ingest_null("areaName_city"),
+                 'kweather_dust_emd', ingest_null("areaName_dong"),
+                 'kweather_dust_announce_time', ingest_kma_time("announceTime"),
+                 'kweather_dust_lat', ingest_null("Lat"), 'kweather_dust_lon', ingest_null("Lng"),
+                 'kweather_dust_pm100', ingest_null("PM10_VALUE"),
+                 'kweather_dust_pm25', ingest_null("PM25_VALUE"))) AS r),
+         ins AS (
+             INSERT INTO kweather_dust (kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd,
+                                        kweather_dust_announce_time, kweather_dust_lat, kweather_dust_lon,
+                                        kweather_dust_pm100, kweather_dust_pm25)
+                 SELECT kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd, kweather_dust_announce_time,
+                        kweather_dust_lat, kweather_dust_lon, kweather_dust_pm100, kweather_dust_pm25
+                 FROM rec
+                 ON CONFLICT DO NOTHING
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(kweather_dust_announce_time) FROM rec)
+    INTO row_count, announce_time;
+END
+$$;
+
+-- Expand the snapshots stored only as JSON before the loader stage
+SELECT sum(d.row_count) AS expanded_rows
+FROM kweather_dust_json j,
+     ingest_kweather_dust(j.kweather_dust_json_data::JSONB -> 'station') AS d
+WHERE NOT EXISTS(SELECT 1
+                 FROM kweather_dust k
+                 WHERE k.kweather_dust_announce_time =
+                       ingest_kma_time(j.kweather_dust_json_data::JSONB -> 'station' -> 0 ->> 'announceTime'));
+
+COMMIT;
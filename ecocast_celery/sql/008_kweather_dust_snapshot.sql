@@ -0,0 +1,172 @@
+-- Kweather fine dust snapshots (kw_dust_task.load_kw_dust_json, kw_dust_task.reconstruct_kw_dust_json)
+-- The 5-minute snapshots are stored as a full keyframe every p_keyframe_interval snapshots(12: hourly)
+-- and per-station deltas in between, instead of a full kweather_dust_json blob every 5 minutes.
+-- kweather_dust_reconstruct(time) rebuilds the snapshot in effect at the time, equal(jsonb) to the response.
+
+BEGIN;
+
+-- keyframe: the whole response
+-- delta: {"root": response without station, "station": {"<position>": fields changed since the previous snapshot}}
+CREATE TABLE IF NOT EXISTS kweather_dust_snapshot
+(
+    kweather_dust_snapshot_time     TIMESTAMP PRIMARY KEY,
+    kweather_dust_snapshot_keyframe BOOLEAN   NOT NULL,
+    kweather_dust_snapshot_data     JSONB     NOT NULL,
+    kweather_dust_snapshot_date     TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Delta of p_current against p_previous, NULL if the station list changed(length, order of the positions
+-- or removed fields) and a keyframe is needed
+CREATE OR REPLACE FUNCTION kweather_dust_delta(p_previous JSONB, p_current JSONB) RETURNS JSONB
+    LANGUAGE sql
+    IMMUTABLE AS
+$$
+SELECT CASE
+           WHEN p_previous IS NULL
+               OR jsonb_typeof(p_previous -> 'station') IS DISTINCT FROM 'array'
+               OR jsonb_typeof(p_current -> 'station') IS DISTINCT FROM 'array'
+               OR jsonb_array_length(p_previous -> 'station') <> jsonb_array_length(p_current -> 'station')
+               OR EXISTS(SELECT 1
+                         FROM jsonb_array_elements(p_previous -> 'station') WITH ORDINALITY AS p(value, ordinality)
+                                  JOIN jsonb_array_elements(p_current -> 'station') WITH ORDINALITY
+                             AS c(value, ordinality) USING (ordinality)
+                         WHERE jsonb_typeof(p.value) <> 'object'
+                            OR jsonb_typeof(c.value) <> 'object'
+                            OR p.value ->> 'areaName_wide' IS DISTINCT FROM c.value ->> 'areaName_wide'
+                            OR p.value ->> 'areaName_city' IS DISTINCT FROM c.value ->> 'areaName_city'
+                            OR p.value ->> 'areaName_dong' IS DISTINCT FROM c.value ->> 'areaName_dong'
+                            OR NOT c.value ?& ARRAY(SELECT jsonb_object_keys(p.value)))
+               THEN NULL
+           ELSE jsonb_build_object('root', p_current - 'station', 'station', COALESCE(
+                   (SELECT jsonb_object_agg((ordinality - 1)::TEXT,
+                                            (SELECT jsonb_object_agg(f.key, f.value)
+                                             FROM jsonb_each(c.value) AS f(key, value)
+                                             WHERE p.value -> f.key IS DISTINCT FROM f.value))
+                    FROM jsonb_array_elements(p_previous -> 'station') WITH ORDINALITY AS p(value, ordinality)
+                             JOIN jsonb_array_elements(p_current -> 'station') WITH ORDINALITY
+                        AS c(value, ordinality) USING (ordinality)
+                    WHERE p.value <> c.value), '{}'::JSONB))
+           END
+$$;
+
+CREATE OR REPLACE FUNCTION kweather_dust_apply_delta(p_base JSONB, p_delta JSONB) RETURNS JSONB
+    LANGUAGE sql
+    IMMUTABLE AS
+$$
+SELECT (p_delta -> 'root') || jsonb_build_object('station', COALESCE(
+        (SELECT jsonb_agg(CASE
+                              WHEN p_delta -> 'station' ? (s.ordinality - 1)::TEXT
+                                  THEN s.value || (p_delta -> 'station' -> (s.ordinality - 1)::TEXT)
+                              ELSE s.value
+                              END ORDER BY s.ordinality)
+         FROM jsonb_array_elements(p_base -> 'station') WITH ORDINALITY AS s(value, ordinality)), '[]'::JSONB))
+$$;
+
+-- Snapshot in effect at p_time: the latest keyframe with the following deltas applied, NULL if none
+CREATE OR REPLACE FUNCTION kweather_dust_reconstruct(p_time TIMESTAMP) RETURNS JSONB
+    LANGUAGE plpgsql
+    STABLE AS
+$$
+DECLARE
+    v_keyframe_time TIMESTAMP;
+    v_data          JSONB;
+    v_delta         JSONB;
+BEGIN
+    SELECT kweather_dust_snapshot_time, kweather_dust_snapshot_data
+    INTO v_keyframe_time, v_data
+    FROM kweather_dust_snapshot
+    WHERE kweather_dust_snapshot_keyframe
+      AND kweather_dust_snapshot_time <= p_time
+    ORDER BY kweather_dust_snapshot_time DESC
+    LIMIT 1;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    FOR v_delta IN SELECT kweather_dust_snapshot_data
+                   FROM kweather_dust_snapshot
+                   WHERE kweather_dust_snapshot_time > v_keyframe_time
+                     AND kweather_dust_snapshot_time <= p_time
+                   ORDER BY kweather_dust_snapshot_time
+        LOOP
+            v_data := kweather_dust_apply_delta(v_data, v_delta);
+        END LOOP;
+    RETURN v_data;
+END
+$$;
+
+-- Store a response as a keyframe or a delta against the previous snapshot
+-- keyframe is NULL if skipped: the time is already stored, or older than the newest snapshot(would break its delta)
+CREATE OR REPLACE FUNCTION ingest_kweather_dust_snapshot(p_data JSONB, p_keyframe_interval INTEGER DEFAULT 12,
+                                                         OUT keyframe BOOLEAN)
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    v_time          TIMESTAMP := ingest_kma_time(p_data -> 'station' -> 0 ->> 'announceTime');
+    v_previous_time TIMESTAMP;
+    v_keyframe_time TIMESTAMP;
+    v_delta_count   INTEGER;
+    v_delta         JSONB;
+BEGIN
+    IF v_time IS NULL THEN
+        RAISE EXCEPTION 'ingest_kweather_dust_snapshot: no announceTime';
+    END IF;
+    SELECT max(kweather_dust_snapshot_time) INTO v_previous_time FROM kweather_dust_snapshot;
+    IF v_previous_time >= v_time THEN
+        RETURN;
+    END IF;
+    SELECT max(kweather_dust_snapshot_time)
+    INTO v_keyframe_time
+    FROM kweather_dust_snapshot
+    WHERE kweather_dust_snapshot_keyframe;
+    SELECT count(*)
+    INTO v_delta_count
+    FROM kweather_dust_snapshot
+    WHERE kweather_dust_snapshot_time > v_keyframe_time;
+    IF v_keyframe_time IS NOT NULL AND v_delta_count + 1 < p_keyframe_interval THEN
+        v_delta := kweather_dust_delta(kweather_dust_reconstruct(v_previous_time), p_data);
+    END IF;
+    keyframe := v_delta IS NULL;
+    INSERT INTO kweather_dust_snapshot(kweather_dust_snapshot_time, kweather_dust_snapshot_keyframe,
+                                       kweather_dust_snapshot_data)
+    VALUES (v_time, keyframe, COALESCE(v_delta, p_data));
+END
+$$;
+
+-- Loader stage of sql/006_jsonb_ingest.sql, the response is kept as a snapshot instead of a kweather_dust_json blob
+CREATE OR REPLACE FUNCTION ingest_kweather_dust_json(p_data JSONB, OUT row_count INTEGER,
+                                                     OUT announce_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    PERFORM ingest_kweather_dust_snapshot(p_data);
+    SELECT d.row_count, d.announce_time INTO row_count, announce_time
+    FROM ingest_kweather_dust(p_data -> 'station') AS d;
+END
+$$;
+
+-- Existing blobs in announce time order, a blob with the same announce time as an earlier one is skipped
+DO
+$$
+    DECLARE
+        v_data JSONB;
+    BEGIN
+        FOR v_data IN SELECT j.data
+                      FROM (SELECT kweather_dust_json_data::JSONB AS data, kweather_dust_json_date
+                            FROM kweather_dust_json) j,
+                           ingest_kma_time(j.data -> 'station' -> 0 ->> 'announceTime') AS t(announce_time)
+                      WHERE t.announce_time IS NOT NULL
+                      ORDER BY t.announce_time, j.kweather_dust_json_date
+            LOOP
+                PERFORM ingest_kweather_dust_snapshot(v_data);
+            END LOOP;
+    END
+$$;
+
+COMMIT;
+
+-- After checking every snapshot is rebuilt equal(no row returned), the blobs can be removed:
+-- SELECT t.announce_time
+-- FROM kweather_dust_json j,
+--      ingest_kma_time(j.kweather_dust_json_data::JSONB -> 'station' -> 0 ->> 'announceTime') AS t(announce_time)
+-- WHERE kweather_dust_reconstruct(t.announce_time) <> j.kweather_dust_json_data::JSONB;
+-- TRUNCATE kweather_dust_json;
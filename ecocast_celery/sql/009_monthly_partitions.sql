@@ -0,0 +1,213 @@
+-- Monthly range partitions (partition_task.maintain_partitions, ecocast_conf.PARTITION_TABLES)
+-- The time series tables are partitioned by month on their time column with a default partition for stray rows.
+-- maintain_partitions creates the coming months ahead of time and detaches or drops the expired months,
+-- so inserts and the recent-hours queries only touch the hot partition.
+-- kweather_dust_json is no longer written(sql/008_kweather_dust_snapshot.sql) and stays as it is,
+-- kweather_dust_snapshot keeps whole keyframe groups instead(prune_kweather_dust_snapshot).
+-- What partition_by_month keeps and drops of each table:
+--   * non-unique indexes are created again on the partitioned table under the same names
+--   * a primary key is created again with the time column appended(a partitioned key must contain it),
+--     so a serial id stays unique per time instead of table-wide
+--   * unique constraints and unique indexes are dropped and added again below, all of them contain the time column:
+--     airkorea_air_quality_station_time_key, data_weather_1_hour_area_date_key, data_weather_3_hour_area_date_key,
+--     kweather_dust_announce_area_key
+--   * foreign keys and triggers of the tables are not carried over and have to be created again by hand
+
+BEGIN;
+
+-- Column list of a table without its generated columns, for moving rows between tables
+CREATE OR REPLACE FUNCTION partition_column_list(p_table REGCLASS) RETURNS TEXT
+    LANGUAGE sql
+    STABLE AS
+$$
+SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+FROM pg_attribute
+WHERE attrelid = p_table
+  AND attnum > 0
+  AND NOT attisdropped
+  AND attgenerated = ''
+$$;
+
+-- Partition <table>_YYYYMM of the month of p_month, NULL if it exists already
+-- Rows of the month already in <table>_default are moved into the new partition.
+CREATE OR REPLACE FUNCTION create_month_partition(p_table TEXT, p_column TEXT, p_month DATE) RETURNS TEXT
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    v_start     TIMESTAMP := date_trunc('month', p_month);
+    v_end       TIMESTAMP := date_trunc('month', p_month) + INTERVAL '1 month';
+    v_partition TEXT      := p_table || '_' || to_char(p_month, 'YYYYMM');
+    v_columns   TEXT      := partition_column_list(p_table::REGCLASS);
+    v_moved     BIGINT;
+BEGIN
+    IF to_regclass(v_partition) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Generated columns become plain columns of the holding table
+    EXECUTE format('CREATE TEMP TABLE partition_holding (LIKE %I)', p_table || '_default');
+    EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+                       'INSERT INTO partition_holding SELECT * FROM moved',
+                   p_table || '_default', p_column, v_start, p_column, v_end);
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', v_partition, p_table, v_start,
+                   v_end);
+    IF v_moved > 0 THEN
+        EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM partition_holding', p_table, v_columns, v_columns);
+    END IF;
+    DROP TABLE partition_holding;
+    RETURN v_partition;
+END
+$$;
+
+-- Create the partitions of the current and p_months_ahead next months, then detach the partitions older than
+-- p_retention_months(NULL keeps every partition) and drop them if p_drop
+CREATE OR REPLACE FUNCTION maintain_partitions(p_table TEXT, p_column TEXT, p_months_ahead INTEGER,
+                                               p_retention_months INTEGER, p_drop BOOLEAN) RETURNS SETOF TEXT
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    v_partition TEXT;
+    v_expired   DATE;
+BEGIN
+    FOR i IN 0..p_months_ahead
+        LOOP
+            v_partition := create_month_partition(p_table, p_column,
+                                                  (date_trunc('month', now()) + make_interval(months => i))::DATE);
+            IF v_partition IS NOT NULL THEN
+                RETURN NEXT 'created ' || v_partition;
+            END IF;
+        END LOOP;
+    IF p_retention_months IS NULL THEN
+        RETURN;
+    END IF;
+    v_expired := (date_trunc('month', now()) - make_interval(months => p_retention_months))::DATE;
+    FOR v_partition IN SELECT c.relname
+                       FROM pg_inherits i
+                                JOIN pg_class c ON c.oid = i.inhrelid
+                       WHERE i.inhparent = p_table::REGCLASS
+                         AND c.relname ~ ('^' || p_table || '_[0-9]{6}$')
+                         AND to_date(right(c.relname, 6), 'YYYYMM') < v_expired
+                       ORDER BY c.relname
+        LOOP
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', p_table, v_partition);
+            IF p_drop THEN
+                EXECUTE format('DROP TABLE %I', v_partition);
+                RETURN NEXT 'dropped ' || v_partition;
+            ELSE
+                RETURN NEXT 'detached ' || v_partition;
+            END IF;
+        END LOOP;
+END
+$$;
+
+-- Replace a table with a monthly partitioned table of the same columns and rows
+-- Serial sequences move to the new table, non-unique indexes are created again and a primary key is created again
+-- with p_column appended. Unique constraints and unique indexes are created again by the caller.
+CREATE OR REPLACE FUNCTION partition_by_month(p_table TEXT, p_column TEXT, p_months_ahead INTEGER) RETURNS VOID
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    v_old         TEXT := p_table || '_unpartitioned';
+    v_columns     TEXT;
+    v_serial      RECORD;
+    v_month       DATE;
+    v_indexes     TEXT[];
+    v_index       TEXT;
+    v_key_name    TEXT;
+    v_key_columns TEXT[];
+BEGIN
+    SELECT array_agg(pg_get_indexdef(i.indexrelid) ORDER BY i.indexrelid)
+    INTO v_indexes
+    FROM pg_index i
+    WHERE i.indrelid = p_table::REGCLASS
+      AND NOT i.indisunique;
+    SELECT c.conname, array_agg(a.attname::TEXT ORDER BY k.ordinality)
+    INTO v_key_name, v_key_columns
+    FROM pg_constraint c
+             CROSS JOIN unnest(c.conkey) WITH ORDINALITY AS k(attnum, ordinality)
+             JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+    WHERE c.conrelid = p_table::REGCLASS
+      AND c.contype = 'p'
+    GROUP BY c.conname;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', p_table, v_old);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS '
+                       'INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE (%I)', p_table, v_old, p_column);
+    FOR v_serial IN SELECT a.attname, pg_get_serial_sequence(v_old, a.attname) AS sequence_name
+                    FROM pg_attribute a
+                    WHERE a.attrelid = v_old::REGCLASS
+                      AND a.attnum > 0
+                      AND NOT a.attisdropped
+        LOOP
+            IF v_serial.sequence_name IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', v_serial.sequence_name, p_table, v_serial.attname);
+            END IF;
+        END LOOP;
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', p_table || '_default', p_table);
+    EXECUTE format('SELECT date_trunc(''month'', min(%I))::DATE FROM %I', p_column, v_old) INTO v_month;
+    v_month := COALESCE(v_month, date_trunc('month', now())::DATE);
+    WHILE v_month <= date_trunc('month', now()) + make_interval(months => p_months_ahead)
+        LOOP
+            PERFORM create_month_partition(p_table, p_column, v_month);
+            v_month := (v_month + INTERVAL '1 month')::DATE;
+        END LOOP;
+    v_columns := partition_column_list(p_table::REGCLASS);
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %I', p_table, v_columns, v_columns, v_old);
+    -- The old index and key names are free once the old table is dropped
+    EXECUTE format('DROP TABLE %I', v_old);
+    IF v_key_name IS NOT NULL THEN
+        IF NOT p_column = ANY (v_key_columns) THEN
+            v_key_columns := v_key_columns || p_column;
+        END IF;
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (%s)', p_table, v_key_name,
+                       (SELECT string_agg(quote_ident(c), ', ') FROM unnest(v_key_columns) AS c));
+    END IF;
+    FOREACH v_index IN ARRAY COALESCE(v_indexes, '{}')
+        LOOP
+            EXECUTE v_index;
+        END LOOP;
+END
+$$;
+
+SELECT partition_by_month('airkorea_air_quality', 'airkorea_air_quality_time', 2);
+ALTER TABLE airkorea_air_quality
+    ADD CONSTRAINT airkorea_air_quality_station_time_key UNIQUE (airkorea_station_name, airkorea_air_quality_time);
+
+SELECT partition_by_month('data_weather_1_hour', 'data_weather_1_hour_date', 2);
+ALTER TABLE data_weather_1_hour
+    ADD CONSTRAINT data_weather_1_hour_area_date_key
+        UNIQUE (data_weather_area_x, data_weather_area_y, data_weather_1_hour_date, data_weather_1_hour_forecast_date);
+
+SELECT partition_by_month('data_weather_3_hour', 'data_weather_3_hour_date', 2);
+ALTER TABLE data_weather_3_hour
+    ADD CONSTRAINT data_weather_3_hour_area_date_key
+        UNIQUE (data_weather_area_x, data_weather_area_y, data_weather_3_hour_date, data_weather_3_hour_forecast_date);
+
+SELECT partition_by_month('kweather_dust', 'kweather_dust_announce_time', 2);
+CREATE UNIQUE INDEX kweather_dust_announce_area_key
+    ON kweather_dust (kweather_dust_announce_time, kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd);
+
+-- A delta is rebuilt from every snapshot back to its keyframe, so only the snapshots before the last keyframe
+-- older than p_retention_months are deleted, never a keyframe whose deltas are kept
+CREATE OR REPLACE FUNCTION prune_kweather_dust_snapshot(p_retention_months INTEGER) RETURNS INTEGER
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    v_keyframe  TIMESTAMP;
+    v_row_count INTEGER;
+BEGIN
+    SELECT max(kweather_dust_snapshot_time)
+    INTO v_keyframe
+    FROM kweather_dust_snapshot
+    WHERE kweather_dust_snapshot_keyframe
+      AND kweather_dust_snapshot_time <=
+          date_trunc('month', localtimestamp) - make_interval(months => p_retention_months);
+    IF v_keyframe IS NULL THEN
+        RETURN 0;
+    END IF;
+    DELETE FROM kweather_dust_snapshot WHERE kweather_dust_snapshot_time < v_keyframe;
+    GET DIAGNOSTICS v_row_count = ROW_COUNT;
+    RETURN v_row_count;
+END
+$$;
+
+COMMIT;
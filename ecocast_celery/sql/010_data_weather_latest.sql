@@ -0,0 +1,245 @@
+-- Latest forecast per grid and forecast time (data_weather_task.insert_data_weather_1_hour_rows, _3_hour_rows)
+-- The loaders upsert data_weather_X_hour_latest on (area_x, area_y, forecast_date), a newer base time replaces
+-- the forecast. A trigger appends a version to data_weather_X_hour(the history) only when the values changed,
+-- instead of a row per area and forecast time on every hourly or 3-hourly run.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS data_weather_1_hour_latest AS
+SELECT data_weather_1_hour_date, data_weather_1_hour_lgt, data_weather_1_hour_pty, data_weather_1_hour_rn1,
+       data_weather_1_hour_sky, data_weather_1_hour_t1h, data_weather_1_hour_reh, data_weather_1_hour_uuu,
+       data_weather_1_hour_vvv, data_weather_1_hour_vec, data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+       data_weather_area_x, data_weather_area_y
+FROM data_weather_1_hour
+WITH NO DATA;
+
+ALTER TABLE data_weather_1_hour_latest
+    ADD CONSTRAINT data_weather_1_hour_latest_pkey
+        PRIMARY KEY (data_weather_area_x, data_weather_area_y, data_weather_1_hour_forecast_date);
+
+INSERT INTO data_weather_1_hour_latest
+SELECT DISTINCT ON (data_weather_area_x, data_weather_area_y, data_weather_1_hour_forecast_date)
+       data_weather_1_hour_date, data_weather_1_hour_lgt, data_weather_1_hour_pty, data_weather_1_hour_rn1,
+       data_weather_1_hour_sky, data_weather_1_hour_t1h, data_weather_1_hour_reh, data_weather_1_hour_uuu,
+       data_weather_1_hour_vvv, data_weather_1_hour_vec, data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+       data_weather_area_x, data_weather_area_y
+FROM data_weather_1_hour
+ORDER BY data_weather_area_x, data_weather_area_y, data_weather_1_hour_forecast_date, data_weather_1_hour_date DESC;
+
+CREATE OR REPLACE FUNCTION data_weather_1_hour_history() RETURNS TRIGGER
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    INSERT INTO data_weather_1_hour (
+            data_weather_1_hour_date, data_weather_1_hour_lgt, data_weather_1_hour_pty, data_weather_1_hour_rn1,
+            data_weather_1_hour_sky, data_weather_1_hour_t1h, data_weather_1_hour_reh, data_weather_1_hour_uuu,
+            data_weather_1_hour_vvv, data_weather_1_hour_vec, data_weather_1_hour_wsd,
+            data_weather_1_hour_forecast_date, data_weather_area_x, data_weather_area_y)
+    VALUES (NEW.data_weather_1_hour_date, NEW.data_weather_1_hour_lgt, NEW.data_weather_1_hour_pty,
+            NEW.data_weather_1_hour_rn1, NEW.data_weather_1_hour_sky, NEW.data_weather_1_hour_t1h,
+            NEW.data_weather_1_hour_reh, NEW.data_weather_1_hour_uuu, NEW.data_weather_1_hour_vvv,
+            NEW.data_weather_1_hour_vec, NEW.data_weather_1_hour_wsd, NEW.data_weather_1_hour_forecast_date,
+            NEW.data_weather_area_x, NEW.data_weather_area_y)
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_weather_1_hour_latest_insert
+    AFTER INSERT
+    ON data_weather_1_hour_latest
+    FOR EACH ROW
+EXECUTE FUNCTION data_weather_1_hour_history();
+
+CREATE TRIGGER data_weather_1_hour_latest_update
+    AFTER UPDATE
+    ON data_weather_1_hour_latest
+    FOR EACH ROW
+    WHEN ((OLD.data_weather_1_hour_lgt, OLD.data_weather_1_hour_pty, OLD.data_weather_1_hour_rn1,
+           OLD.data_weather_1_hour_sky, OLD.data_weather_1_hour_t1h, OLD.data_weather_1_hour_reh,
+           OLD.data_weather_1_hour_uuu, OLD.data_weather_1_hour_vvv, OLD.data_weather_1_hour_vec,
+           OLD.data_weather_1_hour_wsd) IS DISTINCT FROM
+          (NEW.data_weather_1_hour_lgt, NEW.data_weather_1_hour_pty, NEW.data_weather_1_hour_rn1,
+           NEW.data_weather_1_hour_sky, NEW.data_weather_1_hour_t1h, NEW.data_weather_1_hour_reh,
+           NEW.data_weather_1_hour_uuu, NEW.data_weather_1_hour_vvv, NEW.data_weather_1_hour_vec,
+           NEW.data_weather_1_hour_wsd))
+EXECUTE FUNCTION data_weather_1_hour_history();
+
+-- Loader of sql/006_jsonb_ingest.sql, upserts the latest forecast instead of appending every run
+CREATE OR REPLACE FUNCTION ingest_data_weather_1_hour(p_items JSONB, OUT row_count INTEGER,
+                                                      OUT base_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_items) AS i("baseDate" TEXT, "baseTime" TEXT, "fcstDate" TEXT,
+                                                        "fcstTime" TEXT, category TEXT, "fcstValue" TEXT,
+                                                        nx INTEGER, ny INTEGER)),
+         forecast AS (SELECT ingest_kma_time("baseDate" || "baseTime") AS base_date,
+                             ingest_kma_time("fcstDate" || "fcstTime") AS forecast_date, nx, ny,
+                             jsonb_object_agg(category, ingest_null("fcstValue")) AS value
+                      FROM item
+                      GROUP BY "baseDate", "baseTime", "fcstDate", "fcstTime", nx, ny),
+         rec AS (SELECT r.*
+                 FROM forecast,
+                      jsonb_populate_record(NULL::data_weather_1_hour, jsonb_build_object(
+                 'data_weather_1_hour_date', base_date, 'data_weather_1_hour_lgt', value -> 'LGT',
+                 'data_weather_1_hour_pty', value -> 'PTY', 'data_weather_1_hour_rn1', value -> 'RN1',
+                 'data_weather_1_hour_sky', value -> 'SKY', 'data_weather_1_hour_t1h', value -> 'T1H',
+                 'data_weather_1_hour_reh', value -> 'REH', 'data_weather_1_hour_uuu', value -> 'UUU',
+                 'data_weather_1_hour_vvv', value -> 'VVV', 'data_weather_1_hour_vec', value -> 'VEC',
+                 'data_weather_1_hour_wsd', value -> 'WSD', 'data_weather_1_hour_forecast_date', forecast_date,
+                 'data_weather_area_x', nx, 'data_weather_area_y', ny)) AS r),
+         ins AS (
+             INSERT INTO data_weather_1_hour_latest AS l (
+                                              data_weather_1_hour_date, data_weather_1_hour_lgt,
+                                              data_weather_1_hour_pty, data_weather_1_hour_rn1,
+                                              data_weather_1_hour_sky, data_weather_1_hour_t1h,
+                                              data_weather_1_hour_reh, data_weather_1_hour_uuu,
+                                              data_weather_1_hour_vvv, data_weather_1_hour_vec,
+                                              data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+                                              data_weather_area_x, data_weather_area_y)
+                 SELECT data_weather_1_hour_date, data_weather_1_hour_lgt, data_weather_1_hour_pty,
+                        data_weather_1_hour_rn1, data_weather_1_hour_sky, data_weather_1_hour_t1h,
+                        data_weather_1_hour_reh, data_weather_1_hour_uuu, data_weather_1_hour_vvv,
+                        data_weather_1_hour_vec, data_weather_1_hour_wsd, data_weather_1_hour_forecast_date,
+                        data_weather_area_x, data_weather_area_y
+                 FROM rec
+                 ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_1_hour_forecast_date)
+                     DO UPDATE SET
+                     data_weather_1_hour_date = EXCLUDED.data_weather_1_hour_date,
+                     data_weather_1_hour_lgt = EXCLUDED.data_weather_1_hour_lgt,
+                     data_weather_1_hour_pty = EXCLUDED.data_weather_1_hour_pty,
+                     data_weather_1_hour_rn1 = EXCLUDED.data_weather_1_hour_rn1,
+                     data_weather_1_hour_sky = EXCLUDED.data_weather_1_hour_sky,
+                     data_weather_1_hour_t1h = EXCLUDED.data_weather_1_hour_t1h,
+                     data_weather_1_hour_reh = EXCLUDED.data_weather_1_hour_reh,
+                     data_weather_1_hour_uuu = EXCLUDED.data_weather_1_hour_uuu,
+                     data_weather_1_hour_vvv = EXCLUDED.data_weather_1_hour_vvv,
+                     data_weather_1_hour_vec = EXCLUDED.data_weather_1_hour_vec,
+                     data_weather_1_hour_wsd = EXCLUDED.data_weather_1_hour_wsd
+                 WHERE l.data_weather_1_hour_date < EXCLUDED.data_weather_1_hour_date
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(data_weather_1_hour_date) FROM rec)
+    INTO row_count, base_time;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS data_weather_3_hour_latest AS
+SELECT data_weather_3_hour_date, data_weather_3_hour_pop, data_weather_3_hour_pty, data_weather_3_hour_reh,
+       data_weather_3_hour_sky, data_weather_3_hour_t3h, data_weather_3_hour_uuu, data_weather_3_hour_vec,
+       data_weather_3_hour_vvv, data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, data_weather_area_x,
+       data_weather_area_y
+FROM data_weather_3_hour
+WITH NO DATA;
+
+ALTER TABLE data_weather_3_hour_latest
+    ADD CONSTRAINT data_weather_3_hour_latest_pkey
+        PRIMARY KEY (data_weather_area_x, data_weather_area_y, data_weather_3_hour_forecast_date);
+
+INSERT INTO data_weather_3_hour_latest
+SELECT DISTINCT ON (data_weather_area_x, data_weather_area_y, data_weather_3_hour_forecast_date)
+       data_weather_3_hour_date, data_weather_3_hour_pop, data_weather_3_hour_pty, data_weather_3_hour_reh,
+       data_weather_3_hour_sky, data_weather_3_hour_t3h, data_weather_3_hour_uuu, data_weather_3_hour_vec,
+       data_weather_3_hour_vvv, data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, data_weather_area_x,
+       data_weather_area_y
+FROM data_weather_3_hour
+ORDER BY data_weather_area_x, data_weather_area_y, data_weather_3_hour_forecast_date, data_weather_3_hour_date DESC;
+
+CREATE OR REPLACE FUNCTION data_weather_3_hour_history() RETURNS TRIGGER
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    INSERT INTO data_weather_3_hour (
+            data_weather_3_hour_date, data_weather_3_hour_pop, data_weather_3_hour_pty, data_weather_3_hour_reh,
+            data_weather_3_hour_sky, data_weather_3_hour_t3h, data_weather_3_hour_uuu, data_weather_3_hour_vec,
+            data_weather_3_hour_vvv, data_weather_3_hour_wsd, data_weather_3_hour_forecast_date,
+            data_weather_area_x, data_weather_area_y)
+    VALUES (NEW.data_weather_3_hour_date, NEW.data_weather_3_hour_pop, NEW.data_weather_3_hour_pty,
+            NEW.data_weather_3_hour_reh, NEW.data_weather_3_hour_sky, NEW.data_weather_3_hour_t3h,
+            NEW.data_weather_3_hour_uuu, NEW.data_weather_3_hour_vec, NEW.data_weather_3_hour_vvv,
+            NEW.data_weather_3_hour_wsd, NEW.data_weather_3_hour_forecast_date, NEW.data_weather_area_x,
+            NEW.data_weather_area_y)
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER data_weather_3_hour_latest_insert
+    AFTER INSERT
+    ON data_weather_3_hour_latest
+    FOR EACH ROW
+EXECUTE FUNCTION data_weather_3_hour_history();
+
+CREATE TRIGGER data_weather_3_hour_latest_update
+    AFTER UPDATE
+    ON data_weather_3_hour_latest
+    FOR EACH ROW
+    WHEN ((OLD.data_weather_3_hour_pop, OLD.data_weather_3_hour_pty, OLD.data_weather_3_hour_reh,
+           OLD.data_weather_3_hour_sky, OLD.data_weather_3_hour_t3h, OLD.data_weather_3_hour_uuu,
+           OLD.data_weather_3_hour_vec, OLD.data_weather_3_hour_vvv, OLD.data_weather_3_hour_wsd) IS DISTINCT FROM
+          (NEW.data_weather_3_hour_pop, NEW.data_weather_3_hour_pty, NEW.data_weather_3_hour_reh,
+           NEW.data_weather_3_hour_sky, NEW.data_weather_3_hour_t3h, NEW.data_weather_3_hour_uuu,
+           NEW.data_weather_3_hour_vec, NEW.data_weather_3_hour_vvv, NEW.data_weather_3_hour_wsd))
+EXECUTE FUNCTION data_weather_3_hour_history();
+
+-- Loader of sql/006_jsonb_ingest.sql, upserts the latest forecast instead of appending every run
+CREATE OR REPLACE FUNCTION ingest_data_weather_3_hour(p_items JSONB, OUT row_count INTEGER,
+                                                      OUT base_time TIMESTAMP)
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    WITH item AS (SELECT *
+                  FROM jsonb_to_recordset(p_items) AS i("baseDate" TEXT, "baseTime" TEXT, "fcstDate" TEXT,
+                                                        "fcstTime" TEXT, category TEXT, "fcstValue" TEXT,
+                                                        nx INTEGER, ny INTEGER)),
+         forecast AS (SELECT ingest_kma_time("baseDate" || "baseTime") AS base_date,
+                             ingest_kma_time("fcstDate" || "fcstTime") AS forecast_date, nx, ny,
+                             jsonb_object_agg(category, ingest_null("fcstValue")) AS value
+                      FROM item
+                      GROUP BY "baseDate", "baseTime", "fcstDate", "fcstTime", nx, ny),
+         rec AS (SELECT r.*
+                 FROM forecast,
+                      jsonb_populate_record(NULL::data_weather_3_hour, jsonb_build_object(
+                 'data_weather_3_hour_date', base_date, 'data_weather_3_hour_pop', value -> 'POP',
+                 'data_weather_3_hour_pty', value -> 'PTY', 'data_weather_3_hour_reh', value -> 'REH',
+                 'data_weather_3_hour_sky', value -> 'SKY', 'data_weather_3_hour_t3h', value -> 'T3H',
+                 'data_weather_3_hour_uuu', value -> 'UUU', 'data_weather_3_hour_vec', value -> 'VEC',
+                 'data_weather_3_hour_vvv', value -> 'VVV', 'data_weather_3_hour_wsd', value -> 'WSD',
+                 'data_weather_3_hour_forecast_date', forecast_date,
+                 'data_weather_area_x', nx, 'data_weather_area_y', ny)) AS r),
+         ins AS (
+             INSERT INTO data_weather_3_hour_latest AS l (
+                                              data_weather_3_hour_date, data_weather_3_hour_pop,
+                                              data_weather_3_hour_pty, data_weather_3_hour_reh,
+                                              data_weather_3_hour_sky, data_weather_3_hour_t3h,
+                                              data_weather_3_hour_uuu, data_weather_3_hour_vec,
+                                              data_weather_3_hour_vvv, data_weather_3_hour_wsd,
+                                              data_weather_3_hour_forecast_date, data_weather_area_x,
+                                              data_weather_area_y)
+                 SELECT data_weather_3_hour_date, data_weather_3_hour_pop, data_weather_3_hour_pty,
+                        data_weather_3_hour_reh, data_weather_3_hour_sky, data_weather_3_hour_t3h,
+                        data_weather_3_hour_uuu, data_weather_3_hour_vec, data_weather_3_hour_vvv,
+                        data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, data_weather_area_x,
+                        data_weather_area_y
+                 FROM rec
+                 ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_3_hour_forecast_date)
+                     DO UPDATE SET
+                     data_weather_3_hour_date = EXCLUDED.data_weather_3_hour_date,
+                     data_weather_3_hour_pop = EXCLUDED.data_weather_3_hour_pop,
+                     data_weather_3_hour_pty = EXCLUDED.data_weather_3_hour_pty,
+                     data_weather_3_hour_reh = EXCLUDED.data_weather_3_hour_reh,
+                     data_weather_3_hour_sky = EXCLUDED.data_weather_3_hour_sky,
+                     data_weather_3_hour_t3h = EXCLUDED.data_weather_3_hour_t3h,
+                     data_weather_3_hour_uuu = EXCLUDED.data_weather_3_hour_uuu,
+                     data_weather_3_hour_vec = EXCLUDED.data_weather_3_hour_vec,
+                     data_weather_3_hour_vvv = EXCLUDED.data_weather_3_hour_vvv,
+                     data_weather_3_hour_wsd = EXCLUDED.data_weather_3_hour_wsd
+                 WHERE l.data_weather_3_hour_date < EXCLUDED.data_weather_3_hour_date
+                 RETURNING 1)
+    SELECT (SELECT count(*) FROM ins), (SELECT max(data_weather_3_hour_date) FROM rec)
+    INTO row_count, base_time;
+END
+$$;
+
+COMMIT;
@@ -1,62 +1,223 @@
 import requests
-from ..ecocast_conf import logger, psql_connect, psql_select
-from ..ecocast_conf import AIRKOREA_HOST, AIRKOREA_KEY, REQUEST_TIME_OUT
+import datetime
+from ..ecocast_redis import acquire_token
+from ..ecocast_http import http_get, async_get_many
+from ..ecocast_watermark import commit_watermark
+from ..ecocast_conf import logger, psql_connect, psql_bulk_insert, psql_ingest
+from ..ecocast_conf import AIRKOREA_HOST, AIRKOREA_KEY, AK_SWEEP_CONCURRENCY, AK_SWEEP_RATE, AK_SIDO_NAMES
+from ..ecocast_conf import AK_AIR_QUALITY_HISTORY_ROWS, DB_INGEST_JSONB, AK_SIDO_ALIASES, AK_REPOLL_STALE_HOURS
 
 """ Airkorea Air Quality Data Task """
 
+AK_AIR_QUALITY_VALUE_COLUMNS = (
+    'airkorea_air_quality_mang', 'airkorea_air_quality_so2', 'airkorea_air_quality_so2_grade',
+    'airkorea_air_quality_co', 'airkorea_air_quality_co_grade', 'airkorea_air_quality_o3',
+    'airkorea_air_quality_o3_grade', 'airkorea_air_quality_no2', 'airkorea_air_quality_no2_grade',
+    'airkorea_air_quality_pm10', 'airkorea_air_quality_pm10_grade', 'airkorea_air_quality_pm10_forecast',
+    'airkorea_air_quality_pm25', 'airkorea_air_quality_pm25_grade', 'airkorea_air_quality_pm25_forecast',
+    'airkorea_air_quality_khai', 'airkorea_air_quality_khai_grade')
 
-def insert_ak_air_quality_list():
+
+def insert_ak_air_quality_list(repoll: bool = False):
     """ List of station names to be called to API of the Airkorea's air quality data
         Args:
+            repoll (bool): Poll again of the same hour, stations without data for AK_REPOLL_STALE_HOURS are left out
 
         Returns:
-            station_result (list): Station name in which the column of is_active is true
-            True (bool): Request Timeout Except or The database time and API time are the same
+            station_result (list): (name, address) of the active stations whose newest data is older than the hour
+
+        Comment:
+            Each station keeps its newest dataTime(airkorea_station_data_time), so a late station is polled again
+            without polling the stations already up to date. A station listed as active but not reporting
+            is only polled by the first poll of each hour.
 
         Examples:
-            >>> print(insert_ak_air_quality_list)
-            [('고읍',), ('중구',), ('한강대로',), ('종로구',), ... ]
-    """
-    logger.debug('insert_ak_air_quality_list 실행')
-    conn = psql_connect()
-    select_time_sql = 'SELECT airkorea_air_quality_time FROM airkorea_air_quality ' \
-                      'ORDER BY airkorea_air_quality_id DESC LIMIT 1'
-    select_station_sql = 'SELECT airkorea_station_name FROM airkorea_station WHERE airkorea_station_is_active = TRUE'
-    time_result = psql_select(conn, select_time_sql)
-    station_result = psql_select(conn, select_station_sql)
-    conn.close()
-    if time_result:
-        db_time = time_result[0][0].strftime('%Y-%m-%d %H:%M')
-    else:
-        db_time = '2010-01-01 00:00'
-    try:
-        ak_time = call_ak_air_quality(station_result[0][0])[0]['dataTime']
-    except TypeError:
-        return True
-    if db_time == ak_time:
-        logger.debug('db_time : ' + db_time + ', ak_time : ' + ak_time)
-        return True
+            >>> print(insert_ak_air_quality_list())
+            [('고읍', '경기 양주시 고읍남로 ...'), ('중구', '서울 중구 덕수궁길 15'), ... ]
+    """
+    logger.debug('insert_ak_air_quality_list(' + str(repoll) + ') 실행')
+    current_hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    select_sql = 'SELECT airkorea_station_name, airkorea_station_address FROM airkorea_station ' \
+                 'WHERE airkorea_station_is_active = TRUE ' \
+                 'AND (airkorea_station_data_time IS NULL OR airkorea_station_data_time < %s)'
+    params_ = (current_hour,)
+    if repoll:
+        select_sql += ' AND airkorea_station_data_time >= %s'
+        params_ += (current_hour - datetime.timedelta(hours=AK_REPOLL_STALE_HOURS),)
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        curs.execute(select_sql, params_)
+        station_result = curs.fetchall()
+        curs.close()
+    logger.debug('insert_ak_air_quality_list stale stations : ' + str(len(station_result)))
     return station_result
 
 
+def ak_station_sido_names(station_result: list):
+    """ Sidos of the stations, so a poll for a few late stations only requests their sidos
+        Args:
+            station_result (list): Result of insert_ak_air_quality_list
+
+        Returns:
+            sido_names (list): Items of AK_SIDO_NAMES in their order, every sido if an address has no known sido
+    """
+    sido_set = set()
+    for station_name, address in station_result:
+        sido_name = ak_address_sido(address)
+        if sido_name is None:
+            return list(AK_SIDO_NAMES)
+        sido_set.add(sido_name)
+    return [sido_name for sido_name in AK_SIDO_NAMES if sido_name in sido_set]
+
+
+def ak_address_sido(address: str):
+    """ Sido of a station address, '경남 창원시 ...' or '경상남도 창원시 ...' to '경남', None if unknown """
+    first_word = (address or '').split(' ')[0]
+    first_word = AK_SIDO_ALIASES.get(first_word, first_word)
+    for sido_name in AK_SIDO_NAMES:
+        if first_word.startswith(sido_name):
+            return sido_name
+    return None
+
+
 def insert_ak_air_quality(station_name: str):
     """ Receive AirKorea's air quality data and insert it into the database
         Args:
             station_name (str): Station name of Station data provided by Airkorea
 
         Returns:
-            None (None): Success or no station data
+            None (None): Success or no station data, null data is repaired later by backfill_ak_air_quality
             Retry (str): Retry due to Request Timeout Except
-            True (bool): Call null_ak_air_quality due to null data
     """
     logger.debug('insert_ak_air_quality(' + station_name + ') 실행')
-    try:
-        air_quality_data = call_ak_air_quality(station_name)[0]
-    except IndexError as ie:
-        logger.debug('insert_ak_air_quality(' + station_name + ') Except : ' + str(ie))
-        return None
-    except TypeError:
+    air_quality_list = call_ak_air_quality(station_name)
+    if air_quality_list is True:
         return 'Retry'
+    if not air_quality_list:
+        logger.debug('insert_ak_air_quality(' + station_name + ') no data')
+        return None
+    load_ak_air_quality({station_name: air_quality_list})
+
+
+def sweep_ak_air_quality(station_names: list):
+    """ Receive AirKorea's air quality data of many stations concurrently and insert it in one transaction
+        Args:
+            station_names (list): Station names of Station data provided by Airkorea
+
+        Returns:
+            failed_list (list): Station names to be retried due to Request Timeout Except
+            null_list (list): Station names in null value, repaired later by backfill_ak_air_quality
+    """
+    logger.debug('sweep_ak_air_quality(' + str(len(station_names)) + ') 실행')
+    url = AIRKOREA_HOST + 'ArpltnInforInqireSvc/getMsrstnAcctoRltmMesureDnsty'
+    params_list = [ak_air_quality_params(station_name) for station_name in station_names]
+    json_list = async_get_many(url, params_list, AK_SWEEP_CONCURRENCY, AK_SWEEP_RATE,
+                               token=('airkorea', AIRKOREA_KEY))
+    station_dict = {}
+    failed_list = []
+    null_list = []
+    for station_name, json_data in zip(station_names, json_list):
+        try:
+            air_quality_list = json_data['response']['body']['items']
+        except (TypeError, KeyError):
+            failed_list.append(station_name)
+            continue
+        if not air_quality_list:
+            logger.debug('sweep_ak_air_quality(' + station_name + ') no data')
+            continue
+        station_dict[station_name] = air_quality_list
+        if has_null_value(ak_air_quality_values(air_quality_list[0], station_name)):
+            null_list.append(station_name)
+    row_count = load_ak_air_quality(station_dict)
+    logger.debug('sweep_ak_air_quality inserted : ' + str(row_count) + ', failed : ' + str(len(failed_list)) +
+                 ', null : ' + str(len(null_list)))
+    return failed_list, null_list
+
+
+def province_ak_air_quality(station_names: list, sido_names: list = None):
+    """ Receive AirKorea's air quality data of the sidos in bulk and insert the active stations in one transaction
+        Args:
+            station_names (list): Station names of Station data provided by Airkorea
+            sido_names (list): Sidos to be requested(ak_station_sido_names), every sido if None
+
+        Returns:
+            failed_list (list): Station names to be retried due to Request Timeout Except of their sido
+            null_list (list): Station names in null value, repaired later by backfill_ak_air_quality
+
+        Comment:
+            At most 17 requests(getCtprvnRltmMesureDnsty) instead of one request per station.
+    """
+    logger.debug('province_ak_air_quality(' + str(len(station_names)) + ') 실행')
+    if sido_names is None:
+        sido_names = AK_SIDO_NAMES
+    url = AIRKOREA_HOST + 'ArpltnInforInqireSvc/getCtprvnRltmMesureDnsty'
+    params_list = [ak_province_params(sido_name) for sido_name in sido_names]
+    json_list = async_get_many(url, params_list, AK_SWEEP_CONCURRENCY, AK_SWEEP_RATE,
+                               token=('airkorea', AIRKOREA_KEY))
+    air_quality_dict = {}
+    province_failed = False
+    for sido_name, json_data in zip(sido_names, json_list):
+        try:
+            air_quality_list = json_data['response']['body']['items']
+        except (TypeError, KeyError):
+            logger.debug('province_ak_air_quality(' + sido_name + ') failed')
+            province_failed = True
+            continue
+        for air_quality_data in air_quality_list:
+            air_quality_dict.setdefault(air_quality_data['stationName'], air_quality_data)
+    station_dict = {}
+    failed_list = []
+    null_list = []
+    for station_name in station_names:
+        air_quality_data = air_quality_dict.get(station_name)
+        if air_quality_data is None:
+            if province_failed:
+                failed_list.append(station_name)
+            continue
+        station_dict[station_name] = [air_quality_data]
+        if has_null_value(ak_air_quality_values(air_quality_data, station_name)):
+            null_list.append(station_name)
+    row_count = load_ak_air_quality(station_dict)
+    logger.debug('province_ak_air_quality inserted : ' + str(row_count) + ', failed : ' +
+                 str(len(failed_list)) + ', null : ' + str(len(null_list)))
+    return failed_list, null_list
+
+
+def load_ak_air_quality(station_dict: dict):
+    """ Upsert AirKorea's air quality data of many stations in one transaction and advance the watermark
+        Args:
+            station_dict (dict): Station name: Airkorea's air quality data of the station, newest first
+
+        Returns:
+            row_count (int): Number of rows written(DB_INGEST_JSONB) or sent
+
+        Comment:
+            With DB_INGEST_JSONB the data is unpacked by ingest_airkorea_air_quality in one statement.
+            Both paths store '' and '-' as NULL.
+    """
+    with psql_connect() as conn:
+        if DB_INGEST_JSONB:
+            row_count, data_time = psql_ingest(conn, 'ingest_airkorea_air_quality', station_dict)
+        else:
+            values_list = []
+            for station_name, air_quality_list in station_dict.items():
+                values_list.extend(ak_air_quality_values_list(air_quality_list, station_name))
+            row_count = insert_ak_air_quality_rows(conn, values_list)
+            data_time = ak_air_quality_watermark(values_list)
+        commit_watermark(conn, 'airkorea_air_quality', data_time)
+    return row_count
+
+
+def ak_air_quality_values(air_quality_data: dict, station_name: str):
+    """ AirKorea's air quality data conversion to a row of airkorea_air_quality
+        Args:
+            air_quality_data (dict): An item of Airkorea's air quality data
+            station_name (str): Station name of Station data provided by Airkorea
+
+        Returns:
+            values_data (tuple): Row of airkorea_air_quality, values not measured yet('' or '-') as None
+                                 like ingest_null of the jsonb path(sql/006_jsonb_ingest.sql)
+    """
     values_data = (
         air_quality_data['dataTime'], air_quality_data['mangName'], air_quality_data['so2Value'],
         air_quality_data['so2Grade'],
@@ -67,68 +228,232 @@ def insert_ak_air_quality(station_name: str):
         air_quality_data['pm10Value24'], air_quality_data['pm25Value'], air_quality_data['pm25Grade'],
         air_quality_data['pm25Value24'],
         air_quality_data['khaiValue'], air_quality_data['khaiGrade'], station_name)
-    conn = psql_connect()
-    curs = conn.cursor()
-    curs.execute(
-        'INSERT INTO airkorea_air_quality(airkorea_air_quality_time, airkorea_air_quality_mang, '
+    return (values_data[0],) + ak_null_normalize(values_data[1:-1]) + (station_name,)
+
+
+def ak_air_quality_values_list(air_quality_list: list, station_name: str):
+    """ AirKorea's air quality data of recent hours conversion to rows of airkorea_air_quality
+        Args:
+            air_quality_list (list): Airkorea's air quality data, newest first
+            station_name (str): Station name of Station data provided by Airkorea
+
+        Returns:
+            values_list (list): Rows of airkorea_air_quality, newest first
+    """
+    return [ak_air_quality_values(air_quality_data, station_name) for air_quality_data in air_quality_list]
+
+
+def ak_air_quality_watermark(values_list: list):
+    """ Newest dataTime of rows of airkorea_air_quality
+        Args:
+            values_list (list): Rows made by ak_air_quality_values
+
+        Returns:
+            watermark (datetime.datetime): Newest data time, None if no row
+    """
+    if not values_list:
+        return None
+    return max([parse_ak_time(values_data[0]) for values_data in values_list])
+
+
+def has_null_value(values_data: tuple):
+    """ Whether Airkorea's air quality data has a value not measured yet(None, '' or '-')
+        Args:
+            values_data (tuple): Row of airkorea_air_quality
+
+        Returns:
+            True (bool): Has null data
+            False (bool): No null data
+    """
+    for value_data in values_data:
+        if value_data is None or value_data == '' or value_data == '-':
+            return True
+    return False
+
+
+def insert_ak_air_quality_rows(conn, values_list: list):
+    """ Upsert rows of airkorea_air_quality in one statement
+        Args:
+            conn (object): connection Object
+            values_list (list): Rows made by ak_air_quality_values
+
+        Returns:
+            row_count (int): Number of rows sent
+
+        Comment:
+            An hour already stored is only rewritten when a value changed(a null value measured later),
+            so the recent hours of every fetch repair earlier null values without another request.
+    """
+    update_set = ', '.join([column + ' = EXCLUDED.' + column for column in AK_AIR_QUALITY_VALUE_COLUMNS])
+    changed = '(' + ', '.join(['a.' + column for column in AK_AIR_QUALITY_VALUE_COLUMNS]) + \
+              ') IS DISTINCT FROM (' + \
+              ', '.join(['EXCLUDED.' + column for column in AK_AIR_QUALITY_VALUE_COLUMNS]) + ')'
+    update_ak_station_data_time(conn, values_list)
+    return psql_bulk_insert(
+        conn,
+        'INSERT INTO airkorea_air_quality AS a (airkorea_air_quality_time, airkorea_air_quality_mang, '
         'airkorea_air_quality_so2, airkorea_air_quality_so2_grade, airkorea_air_quality_co, '
         'airkorea_air_quality_co_grade, airkorea_air_quality_o3, airkorea_air_quality_o3_grade, '
         'airkorea_air_quality_no2, airkorea_air_quality_no2_grade, '
         'airkorea_air_quality_pm10, airkorea_air_quality_pm10_grade, airkorea_air_quality_pm10_forecast, '
         'airkorea_air_quality_pm25, airkorea_air_quality_pm25_grade, airkorea_air_quality_pm25_forecast, '
-        'airkorea_air_quality_khai, airkorea_air_quality_khai_grade, airkorea_station_name) '
-        'VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
-    for value_data in values_data:
-        if value_data == '' or value_data == '-':
-            return True
+        'airkorea_air_quality_khai, airkorea_air_quality_khai_grade, airkorea_station_name) VALUES %s '
+        'ON CONFLICT (airkorea_station_name, airkorea_air_quality_time) DO UPDATE SET ' + update_set +
+        ' WHERE ' + changed,
+        values_list)
 
 
-def null_ak_air_quality(station_name: str):
-    """ If receive AirKorea's air quality data in null value
+def insert_ak_air_quality_batch(station_names: list):
+    """ Receive AirKorea's air quality data of a chunk of stations over the shared session and insert it
+        in one transaction
+        Args:
+            station_names (list): Station names of Station data provided by Airkorea
+
+        Returns:
+            failed_list (list): Station names to be retried due to Request Timeout Except
+            null_list (list): Station names in null value, repaired later by backfill_ak_air_quality
+    """
+    logger.debug('insert_ak_air_quality_batch(' + str(len(station_names)) + ') 실행')
+    station_dict = {}
+    failed_list = []
+    null_list = []
+    for station_name in station_names:
+        air_quality_list = call_ak_air_quality(station_name)
+        if air_quality_list is True:
+            failed_list.append(station_name)
+            continue
+        if not air_quality_list:
+            logger.debug('insert_ak_air_quality_batch(' + station_name + ') no data')
+            continue
+        station_dict[station_name] = air_quality_list
+        if has_null_value(ak_air_quality_values(air_quality_list[0], station_name)):
+            null_list.append(station_name)
+    load_ak_air_quality(station_dict)
+    return failed_list, null_list
+
 
+def backfill_ak_air_quality():
+    """ Repair airkorea_air_quality rows of the current and previous hour still in null value
         Args:
-            station_name (str): Station name of station data provided by Airkorea
 
         Returns:
-            None (None): Success or no station data
-            True (bool): Retry due to null data
+            row_count (int): Number of rows repaired
+            True (bool): Retry due to Request Timeout Except of every station
+
+        Comment:
+            One periodic sweep instead of a retry chain per station in null value.
+            Each station is fetched once with two rows(current and previous hour) and every fix is applied
+            with one UPDATE ... FROM (VALUES ...).
     """
-    logger.debug('null_ak_air_quality(' + station_name + ') 실행')
-    try:
-        air_quality_data = call_ak_air_quality(station_name)[0]
-    except IndexError as e:
-        logger.debug('null_ak_air_quality(' + station_name + ') Except : ' + str(e))
-        return None
-    except TypeError:
+    logger.debug('backfill_ak_air_quality 실행')
+    since = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=1)
+    null_condition = ' OR '.join(
+        [column + " IN ('', '-') OR " + column + ' IS NULL' for column in AK_AIR_QUALITY_VALUE_COLUMNS])
+    select_null_sql = 'SELECT airkorea_station_name, airkorea_air_quality_time, ' + \
+                      ', '.join(AK_AIR_QUALITY_VALUE_COLUMNS) + ' FROM airkorea_air_quality ' \
+                      'WHERE airkorea_air_quality_time >= %s AND (' + null_condition + ')'
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        curs.execute(select_null_sql, (since,))
+        null_result = curs.fetchall()
+        curs.close()
+    if not null_result:
+        return 0
+    null_dict = {}
+    for null_row in null_result:
+        null_dict[(null_row[0], null_row[1])] = tuple(null_row[2:])
+    station_names = sorted({null_row[0] for null_row in null_result})
+    url = AIRKOREA_HOST + 'ArpltnInforInqireSvc/getMsrstnAcctoRltmMesureDnsty'
+    params_list = [ak_air_quality_params(station_name, 2) for station_name in station_names]
+    json_list = async_get_many(url, params_list, AK_SWEEP_CONCURRENCY, AK_SWEEP_RATE,
+                               token=('airkorea', AIRKOREA_KEY))
+    values_list = []
+    failed_count = 0
+    for station_name, json_data in zip(station_names, json_list):
+        try:
+            air_quality_list = json_data['response']['body']['items']
+        except (TypeError, KeyError):
+            failed_count += 1
+            continue
+        for air_quality_data in air_quality_list:
+            values_data = ak_air_quality_values(air_quality_data, station_name)
+            db_values = null_dict.get((station_name, parse_ak_time(air_quality_data['dataTime'])))
+            if db_values is not None and ak_null_normalize(db_values) != values_data[1:-1]:
+                values_list.append(values_data)
+    if failed_count == len(station_names):
         return True
-    values_data = (
-        air_quality_data['so2Value'], air_quality_data['so2Grade'],
-        air_quality_data['coValue'], air_quality_data['coGrade'], air_quality_data['o3Value'],
-        air_quality_data['o3Grade'],
-        air_quality_data['no2Value'], air_quality_data['no2Grade'], air_quality_data['pm10Value'],
-        air_quality_data['pm10Grade'],
-        air_quality_data['pm10Value24'], air_quality_data['pm25Value'], air_quality_data['pm25Grade'],
-        air_quality_data['pm25Value24'],
-        air_quality_data['khaiValue'], air_quality_data['khaiGrade'], air_quality_data['dataTime'], station_name)
-    for value_ in values_data:
-        if value_ == '' or value_ == '-':
-            return True
-    conn = psql_connect()
-    curs = conn.cursor()
-    curs.execute(
-        'UPDATE airkorea_air_quality SET airkorea_air_quality_so2 = %s, airkorea_air_quality_so2_grade = %s, '
-        'airkorea_air_quality_co = %s, airkorea_air_quality_co_grade = %s, airkorea_air_quality_o3 = %s, '
-        'airkorea_air_quality_o3_grade = %s, airkorea_air_quality_no2 = %s, airkorea_air_quality_no2_grade = %s, '
-        'airkorea_air_quality_pm10 = %s, airkorea_air_quality_pm10_grade = %s, airkorea_air_quality_pm10_forecast = %s, '
-        'airkorea_air_quality_pm25 = %s, airkorea_air_quality_pm25_grade = %s, '
-        'airkorea_air_quality_pm25_forecast = %s, airkorea_air_quality_khai = %s, airkorea_air_quality_khai_grade = %s '
-        'WHERE airkorea_air_quality_time = %s AND airkorea_station_name = %s', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
+    with psql_connect() as conn:
+        update_ak_air_quality_rows(conn, values_list)
+        conn.commit()
+    logger.debug('backfill_ak_air_quality null rows : ' + str(len(null_dict)) + ', repaired : ' +
+                 str(len(values_list)) + ', failed stations : ' + str(failed_count))
+    return len(values_list)
+
+
+def ak_null_normalize(values_data: tuple):
+    """ Values not measured yet('', '-', NULL) as None, also for rows stored before both paths wrote NULL """
+    return tuple(None if value_data in ('', '-') else value_data for value_data in values_data)
+
+
+def parse_ak_time(data_time: str):
+    """ Airkorea's dataTime conversion to datetime
+        Args:
+            data_time (str): dataTime of Airkorea's air quality data(YYYY-MM-DD HH:MI)
+
+        Returns:
+            datetime (datetime.datetime): Parsed value, 24:00 is 00:00 of the next day
+    """
+    if data_time.endswith('24:00'):
+        return datetime.datetime.strptime(data_time[:10], '%Y-%m-%d') + datetime.timedelta(days=1)
+    return datetime.datetime.strptime(data_time, '%Y-%m-%d %H:%M')
+
+
+def update_ak_station_data_time(conn, values_list: list):
+    """ Advance the newest dataTime of each station in the transaction of the loaded rows
+        Args:
+            conn (object): connection Object
+            values_list (list): Rows made by ak_air_quality_values
+
+        Returns:
+            row_count (int): Number of stations sent
+    """
+    data_time_dict = {}
+    for values_data in values_list:
+        data_time = parse_ak_time(values_data[0])
+        if values_data[-1] not in data_time_dict or data_time_dict[values_data[-1]] < data_time:
+            data_time_dict[values_data[-1]] = data_time
+    return psql_bulk_insert(
+        conn,
+        'UPDATE airkorea_station AS s SET airkorea_station_data_time = v.data_time '
+        'FROM (VALUES %s) AS v(station_name, data_time) WHERE s.airkorea_station_name = v.station_name '
+        'AND (s.airkorea_station_data_time IS NULL OR s.airkorea_station_data_time < v.data_time)',
+        list(data_time_dict.items()))
+
+
+def update_ak_air_quality_rows(conn, values_list: list):
+    """ Update measured values of airkorea_air_quality rows in one statement
+        Args:
+            conn (object): connection Object
+            values_list (list): Rows made by ak_air_quality_values, matched by time and station name
+
+        Returns:
+            row_count (int): Number of rows sent
+    """
+    return psql_bulk_insert(
+        conn,
+        'UPDATE airkorea_air_quality AS a SET airkorea_air_quality_so2 = v.so2, '
+        'airkorea_air_quality_so2_grade = v.so2_grade, airkorea_air_quality_co = v.co, '
+        'airkorea_air_quality_co_grade = v.co_grade, airkorea_air_quality_o3 = v.o3, '
+        'airkorea_air_quality_o3_grade = v.o3_grade, airkorea_air_quality_no2 = v.no2, '
+        'airkorea_air_quality_no2_grade = v.no2_grade, airkorea_air_quality_pm10 = v.pm10, '
+        'airkorea_air_quality_pm10_grade = v.pm10_grade, airkorea_air_quality_pm10_forecast = v.pm10_forecast, '
+        'airkorea_air_quality_pm25 = v.pm25, airkorea_air_quality_pm25_grade = v.pm25_grade, '
+        'airkorea_air_quality_pm25_forecast = v.pm25_forecast, airkorea_air_quality_khai = v.khai, '
+        'airkorea_air_quality_khai_grade = v.khai_grade '
+        'FROM (VALUES %s) AS v(data_time, mang, so2, so2_grade, co, co_grade, o3, o3_grade, no2, no2_grade, pm10, '
+        'pm10_grade, pm10_forecast, pm25, pm25_grade, pm25_forecast, khai, khai_grade, station_name) '
+        'WHERE a.airkorea_air_quality_time = v.data_time::timestamp AND a.airkorea_station_name = v.station_name',
+        values_list)
 
 
 def call_ak_air_quality(station_name: str):
@@ -138,7 +463,7 @@ def call_ak_air_quality(station_name: str):
 
         Returns:
             json_data['list'] (list): Airkorea's air quality data
-            True (bool): Request Timeout Except
+            True (bool): Request Timeout Except or no token of the rate limit
 
         Examples:
             >>> print(call_ak_air_quality('고읍'))
@@ -146,13 +471,38 @@ def call_ak_air_quality(station_name: str):
     """
     logger.debug('call_ak_air_quality(' + station_name + ') 실행')
     url = AIRKOREA_HOST + 'ArpltnInforInqireSvc/getMsrstnAcctoRltmMesureDnsty'
-    params_ = {'serviceKey': AIRKOREA_KEY, 'numOfRows': 1, 'pageNo': 1, 'stationName': station_name,
-               'dataTerm': 'DAILY',
-               'ver': 1.3, 'returnType': 'json'}
+    params_ = ak_air_quality_params(station_name)
+    if acquire_token('airkorea', AIRKOREA_KEY) > 0:
+        return True
     try:
-        response = requests.get(url, params_, timeout=REQUEST_TIME_OUT)
+        response = http_get(url, params_)
         json_data = response.json()
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_ak_air_quality(' + station_name + ') Except : ' + str(e))
         return True
     return json_data['response']['body']['items']
+
+
+def ak_air_quality_params(station_name: str, num_of_rows: int = AK_AIR_QUALITY_HISTORY_ROWS):
+    """ Parameters of Airkorea's air quality data API call
+        Args:
+            station_name (str): Station name of station data provided by Airkorea
+            num_of_rows (int): Number of hourly rows, newest first
+
+        Returns:
+            params_ (dict): Query string parameters of getMsrstnAcctoRltmMesureDnsty
+    """
+    return {'serviceKey': AIRKOREA_KEY, 'numOfRows': num_of_rows, 'pageNo': 1, 'stationName': station_name,
+            'dataTerm': 'DAILY', 'ver': 1.3, 'returnType': 'json'}
+
+
+def ak_province_params(sido_name: str):
+    """ Parameters of Airkorea's air quality data API call by sido
+        Args:
+            sido_name (str): Sido name(서울, 부산, ... )
+
+        Returns:
+            params_ (dict): Query string parameters of getCtprvnRltmMesureDnsty
+    """
+    return {'serviceKey': AIRKOREA_KEY, 'numOfRows': 1000, 'pageNo': 1, 'sidoName': sido_name, 'ver': 1.3,
+            'returnType': 'json'}
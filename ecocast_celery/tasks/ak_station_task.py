@@ -1,42 +1,110 @@
 import requests
-from ..ecocast_conf import logger, psql_connect
-from ..ecocast_conf import AIRKOREA_HOST, AIRKOREA_KEY, REQUEST_TIME_OUT
+import hashlib
+import json
+from ..ecocast_redis import acquire_token
+from ..ecocast_http import http_get
+from ..ecocast_conf import logger, psql_connect, psql_select, psql_bulk_insert
+from ..ecocast_conf import AIRKOREA_HOST, AIRKOREA_KEY, AK_STATION_PAGE_ROWS
 
 """ Airkorea Station Data Task """
 
 
 def insert_ak_station():
-    """ Receive AirKorea's station data and insert it into the database
+    """ Receive AirKorea's station data and sync it into the database
         Args:
 
         Returns:
             True (bool): Retry due to null data
             None (None): Success
+
+        Comment:
+            Only new or changed stations are upserted and stations missing upstream are deactivated.
+            Deactivation is skipped when fewer stations than totalCount were received, so a short list
+            never deactivates real stations. An unchanged catalog(same content hash) costs no write.
     """
     logger.debug('insert_ak_station 실행')
-    conn = psql_connect()
-    curs = conn.cursor()
-    station_list = call_ak_station()
-    if station_list is True:
+    station_result = call_ak_station()
+    if station_result is True:
         return True
+    station_list, total_count = station_result
+    station_dict = {}
     for ak_station_dict in station_list:
-        if ak_station_dict['dmX'] == '':
-            ak_station_dict['dmX'] = -1
-        if ak_station_dict['dmY'] == '':
-            ak_station_dict['dmY'] = -1
-        if ak_station_dict['year'] == '':
-            ak_station_dict['year'] = 0
-        values_data = (
-            ak_station_dict['addr'], ak_station_dict['dmX'], ak_station_dict['dmY'],
-            ak_station_dict['item'], ak_station_dict['mangName'],
-            ak_station_dict['stationName'], ak_station_dict['year'])
-        curs.execute(
-            'INSERT INTO airkorea_station(airkorea_station_address, airkorea_station_lat, airkorea_station_lon, '
-            'airkorea_station_item, airkorea_station_mang, airkorea_station_name, airkorea_station_year) '
-            'VALUES(%s, %s, %s, %s, %s, %s, %s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()  # DB_POOL.putconn(conn)
+        values_data = ak_station_values(ak_station_dict)
+        station_dict[values_data[0]] = values_data
+    catalog_hash = hashlib.sha256(
+        json.dumps(sorted(station_dict.values()), ensure_ascii=False).encode('utf-8')).hexdigest()
+    select_hash_sql = "SELECT catalog_sync_hash FROM catalog_sync WHERE catalog_sync_source = 'airkorea_station'"
+    select_station_sql = 'SELECT airkorea_station_name, airkorea_station_address, airkorea_station_lat, ' \
+                         'airkorea_station_lon, airkorea_station_item, airkorea_station_mang, ' \
+                         'airkorea_station_year, airkorea_station_is_active FROM airkorea_station'
+    with psql_connect() as conn:
+        hash_result = psql_select(conn, select_hash_sql)
+        if hash_result and hash_result[0][0] == catalog_hash:
+            logger.debug('insert_ak_station catalog unchanged : ' + catalog_hash)
+            return None
+        db_station_dict = {}
+        for db_station in psql_select(conn, select_station_sql):
+            db_station_dict[db_station[0]] = (ak_station_values_normalize(db_station[:7]), db_station[7])
+        changed_list = []
+        for station_name, values_data in station_dict.items():
+            db_station = db_station_dict.get(station_name)
+            if db_station is None or db_station[0] != values_data or db_station[1] is not True:
+                changed_list.append(values_data)
+        removed_list = [station_name for station_name, db_station in db_station_dict.items()
+                        if db_station[1] is True and station_name not in station_dict]
+        psql_bulk_insert(
+            conn,
+            'INSERT INTO airkorea_station(airkorea_station_name, airkorea_station_address, airkorea_station_lat, '
+            'airkorea_station_lon, airkorea_station_item, airkorea_station_mang, airkorea_station_year) VALUES %s '
+            'ON CONFLICT (airkorea_station_name) DO UPDATE SET '
+            'airkorea_station_address = EXCLUDED.airkorea_station_address, '
+            'airkorea_station_lat = EXCLUDED.airkorea_station_lat, '
+            'airkorea_station_lon = EXCLUDED.airkorea_station_lon, '
+            'airkorea_station_item = EXCLUDED.airkorea_station_item, '
+            'airkorea_station_mang = EXCLUDED.airkorea_station_mang, '
+            'airkorea_station_year = EXCLUDED.airkorea_station_year, airkorea_station_is_active = TRUE',
+            changed_list)
+        if len(station_list) < total_count:
+            logger.debug('insert_ak_station incomplete list : ' + str(len(station_list)) + ' / ' + str(total_count))
+            removed_list = []
+        curs = conn.cursor()
+        if removed_list and station_dict:
+            curs.execute('UPDATE airkorea_station SET airkorea_station_is_active = FALSE '
+                         'WHERE airkorea_station_name = ANY(%s)', (removed_list,))
+        curs.execute("INSERT INTO catalog_sync(catalog_sync_source, catalog_sync_hash) "
+                     "VALUES('airkorea_station', %s) ON CONFLICT (catalog_sync_source) DO UPDATE SET "
+                     "catalog_sync_hash = EXCLUDED.catalog_sync_hash, catalog_sync_date = now()", (catalog_hash,))
+        curs.close()
+        conn.commit()
+    logger.debug('insert_ak_station changed : ' + str(len(changed_list)) + ', removed : ' + str(len(removed_list)))
+
+
+def ak_station_values(ak_station_dict: dict):
+    """ AirKorea's station data conversion to a row of airkorea_station
+        Args:
+            ak_station_dict (dict): Station data provided by Airkorea
+
+        Returns:
+            values_data (tuple): (name, address, lat, lon, item, mang, year)
+    """
+    return ak_station_values_normalize(
+        (ak_station_dict['stationName'], ak_station_dict['addr'], ak_station_dict['dmX'], ak_station_dict['dmY'],
+         ak_station_dict['item'], ak_station_dict['mangName'], ak_station_dict['year']))
+
+
+def ak_station_values_normalize(values_data: tuple):
+    """ Same types for the API data and the database data, so that both can be compared
+        Args:
+            values_data (tuple): (name, address, lat, lon, item, mang, year)
+
+        Returns:
+            values_data (tuple): Empty lat, lon to -1 and empty year to 0
+    """
+    station_name, address, lat, lon, item, mang, year = values_data
+    lat = -1.0 if lat in ('', None) else float(lat)
+    lon = -1.0 if lon in ('', None) else float(lon)
+    year = 0 if year in ('', None) else int(year)
+    return station_name, address, lat, lon, item, mang, year
 
 
 def call_ak_station():
@@ -44,20 +112,34 @@ def call_ak_station():
         Args:
 
         Returns:
-            json_data['list'] (list): Airkorea's station data
-            True (bool): Request Timeout Except
+            station_list (list): Airkorea's station data of every page
+            total_count (int): totalCount of the API, more than len(station_list) if a page came back short
+            True (bool): Request Timeout Except or no token of the rate limit
 
         Examples:
             >>> print(call_ak_station())
-            [{'_returnType': 'json', 'addr': '경남 창원시 의창구 원이대로 450(시설관리공단 실내수영장 앞)', 'districtNum': '', ... ]
+            ([{'_returnType': 'json', 'addr': '경남 창원시 의창구 원이대로 450(시설관리공단 실내수영장 앞)', ... ], 652)
     """
     logger.debug('call_ak_station 실행')
     url = AIRKOREA_HOST + 'MsrstnInfoInqireSvc/getMsrstnList'
-    params_ = {'serviceKey': AIRKOREA_KEY, 'numOfRows': 700, 'pageNo': 1, 'returnType': 'json'}
-    try:
-        response = requests.get(url, params_, timeout=REQUEST_TIME_OUT)
-        json_data = response.json()  # json_data = json.loads(response.text)
-    except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
-        logger.debug('call_ak_station Except : ' + str(e))
-        return True
-    return json_data['response']['body']['items']
+    station_list = []
+    total_count = 0
+    page_no = 1
+    while True:
+        params_ = {'serviceKey': AIRKOREA_KEY, 'numOfRows': AK_STATION_PAGE_ROWS, 'pageNo': page_no,
+                   'returnType': 'json'}
+        if acquire_token('airkorea', AIRKOREA_KEY) > 0:
+            return True
+        try:
+            response = http_get(url, params_)
+            json_data = response.json()  # json_data = json.loads(response.text)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout,
+                requests.exceptions.ConnectionError) as e:
+            logger.debug('call_ak_station Except : ' + str(e))
+            return True
+        body = json_data['response']['body']
+        total_count = int(body.get('totalCount') or 0)
+        station_list.extend(body['items'])
+        if not body['items'] or len(station_list) >= total_count:
+            return station_list, total_count
+        page_no += 1
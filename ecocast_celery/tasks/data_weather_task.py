@@ -1,10 +1,17 @@
 import requests
-from ..ecocast_conf import logger, psql_connect, psql_dict_select
-from ..ecocast_conf import DATA_WEATHER_HOST, DATA_WEATHER_KEY, REQUEST_TIME_OUT
+from ..ecocast_redis import acquire_token
+from ..ecocast_http import http_get
+from ..ecocast_watermark import commit_watermark
+from ..ecocast_conf import logger, psql_connect, psql_dict_select, psql_bulk_insert, psql_ingest
+from ..ecocast_conf import DATA_WEATHER_HOST, DATA_WEATHER_KEY, DB_INGEST_JSONB
 import datetime
 
 """ Public Data Portal Weather Data Task """
 
+# Categories in the column order of data_weather_1_hour and data_weather_3_hour
+DATA_WEATHER_1_HOUR_CATEGORIES = ('LGT', 'PTY', 'RN1', 'SKY', 'T1H', 'REH', 'UUU', 'VVV', 'VEC', 'WSD')
+DATA_WEATHER_3_HOUR_CATEGORIES = ('POP', 'PTY', 'REH', 'SKY', 'T3H', 'UUU', 'VEC', 'VVV', 'WSD')
+
 
 def insert_data_weather_area_list():
     """ List of coordinates x, y to be called to API of the Dataportal's ultra-short-term forecast weather data
@@ -18,10 +25,9 @@ def insert_data_weather_area_list():
             [{'data_weather_area_x': 61.0, 'data_weather_area_y': 126.0}, {'data_weather_area_x': 62.0, ... ]
     """
     logger.debug('insert_data_weather_area_list 실행')
-    conn = psql_connect()
     select_area_sql = 'SELECT data_weather_area_x, data_weather_area_y FROM data_weather_area WHERE data_weather_area_is_active = TRUE'
-    area_result = psql_dict_select(conn, select_area_sql)
-    conn.close()
+    with psql_connect() as conn:
+        area_result = psql_dict_select(conn, select_area_sql)
     return area_result
 
 
@@ -30,42 +36,53 @@ def insert_data_weather_1_hour(x: int, y: int, now: datetime.datetime):
         Args:
             x (int): X-coordinate of area to be called
             y (int): Y-coordinate of area to be called
-            now (datetime.datetime): Current Time
+            now (datetime.datetime): Current Time or the base time
 
         Returns:
             None (None): Success
             True (bool): Retry due to Request Timeout Except
     """
     logger.debug('insert_data_weather_1_hour(' + str(x) + ',' + str(y) + ') 실행')
-    base_date = now.strftime('%Y%m%d')
-    base_time = str(int(now.strftime('%H') + '30'))
-    if len(base_time) < 4:
-        base_time = '0' + base_time
+    base_date, base_time = data_weather_base_1_hour(now)
     weather_list = call_data_weather_1_hour(x, y, base_date, base_time)
     if weather_list is True:
         return True
-    weather_data_list = data_weather_conversion(x, y, base_date, base_time, weather_list)
-    conn = psql_connect()
-    curs = conn.cursor()
-    for weather_data_dict in weather_data_list:
-        values_data = (
-            datetime.datetime.strptime(weather_data_dict['baseDate'] + weather_data_dict['baseTime'], '%Y%m%d%H%M'),
-            weather_data_dict['LGT'], weather_data_dict['PTY'], weather_data_dict['RN1'],
-            weather_data_dict['SKY'], weather_data_dict['T1H'], weather_data_dict['REH'],
-            weather_data_dict['UUU'], weather_data_dict['VVV'], weather_data_dict['VEC'],
-            weather_data_dict['WSD'],
-            datetime.datetime.strptime(weather_data_dict['fcstDate'] + weather_data_dict['fcstTime'], '%Y%m%d%H%M'),
-            weather_data_dict['nx'], weather_data_dict['ny'])
-        curs.execute(
-            'INSERT INTO data_weather_1_hour(data_weather_1_hour_date, data_weather_1_hour_lgt, '
-            'data_weather_1_hour_pty, data_weather_1_hour_rn1, data_weather_1_hour_sky, '
-            'data_weather_1_hour_t1h, data_weather_1_hour_reh, data_weather_1_hour_uuu, '
-            'data_weather_1_hour_vvv, data_weather_1_hour_vec, data_weather_1_hour_wsd, '
-            'data_weather_1_hour_forecast_date, data_weather_area_x, data_weather_area_y) '
-            'VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
+    with psql_connect() as conn:
+        if DB_INGEST_JSONB:
+            psql_ingest(conn, 'ingest_data_weather_1_hour', weather_list)
+        else:
+            insert_data_weather_1_hour_rows(conn, data_weather_pivot_rows(
+                data_weather_pivot([weather_list], DATA_WEATHER_1_HOUR_CATEGORIES), DATA_WEATHER_1_HOUR_CATEGORIES))
+        commit_watermark(conn, 'data_weather_1_hour', datetime.datetime.strptime(base_date + base_time, '%Y%m%d%H%M'))
+
+
+def insert_data_weather_1_hour_rows(conn, values_list: list):
+    """ Upsert rows of data_weather_1_hour_latest in one statement, rows of several areas can be sent together
+        An area and forecast time must appear once in values_list.
+        Args:
+            conn (object): connection Object
+            values_list (list): Result of data_weather_pivot_rows with DATA_WEATHER_1_HOUR_CATEGORIES
+
+        Returns:
+            row_count (int): Number of rows sent
+
+        Comment:
+            A newer base time replaces the forecast of the area and forecast time.
+            The trigger of data_weather_1_hour_latest appends the version to data_weather_1_hour(history)
+            only when a value changed(sql/010_data_weather_latest.sql).
+    """
+    columns = ['data_weather_1_hour_' + category.lower() for category in DATA_WEATHER_1_HOUR_CATEGORIES]
+    update_set = ', '.join([column + ' = EXCLUDED.' + column for column in columns])
+    return psql_bulk_insert(
+        conn,
+        'INSERT INTO data_weather_1_hour_latest AS l (data_weather_1_hour_date, data_weather_1_hour_lgt, '
+        'data_weather_1_hour_pty, data_weather_1_hour_rn1, data_weather_1_hour_sky, '
+        'data_weather_1_hour_t1h, data_weather_1_hour_reh, data_weather_1_hour_uuu, '
+        'data_weather_1_hour_vvv, data_weather_1_hour_vec, data_weather_1_hour_wsd, '
+        'data_weather_1_hour_forecast_date, data_weather_area_x, data_weather_area_y) VALUES %s '
+        'ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_1_hour_forecast_date) DO UPDATE SET '
+        'data_weather_1_hour_date = EXCLUDED.data_weather_1_hour_date, ' + update_set +
+        ' WHERE l.data_weather_1_hour_date < EXCLUDED.data_weather_1_hour_date', values_list)
 
 
 def call_data_weather_1_hour(x: int, y: int, base_date: str, base_time: str):
@@ -79,7 +96,7 @@ def call_data_weather_1_hour(x: int, y: int, base_date: str, base_time: str):
 
         Returns:
             json_data['response']['body']['items']['item'] (list): Dataportal's ultra-short-term forecast weather data
-            True (bool): Request Timeout Except
+            True (bool): Request Timeout Except or no token of the rate limit
 
         Examples:
             >>> print(call_data_weather_1_hour(60, 127, '20201026', '2030'))
@@ -89,13 +106,19 @@ def call_data_weather_1_hour(x: int, y: int, base_date: str, base_time: str):
     url = DATA_WEATHER_HOST + 'getUltraSrtFcst'
     param = {'serviceKey': DATA_WEATHER_KEY, 'numOfRows': 100, 'pageNo': 1, 'dataType': 'JSON',
              'base_date': base_date, 'base_time': base_time, 'nx': x, 'ny': y}
+    if acquire_token('data_weather', DATA_WEATHER_KEY) > 0:
+        return True
     try:
-        response = requests.get(url, param, timeout=REQUEST_TIME_OUT)
+        response = http_get(url, param)
         json_data = response.json()
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_data_weather_1_hour(' + str(x) + ', ' + str(y) + ') Except : ' + str(e))
         return True
-    return json_data['response']['body']['items']['item']
+    try:
+        return json_data['response']['body']['items']['item']
+    except (KeyError, TypeError):
+        logger.debug('call_data_weather_1_hour(' + str(x) + ', ' + str(y) + ') no data : ' + str(json_data))
+        return True
 
 
 def insert_data_weather_3_hour(x: int, y: int, now: datetime.datetime):
@@ -103,41 +126,53 @@ def insert_data_weather_3_hour(x: int, y: int, now: datetime.datetime):
         Args:
             x (int): X-coordinate of area to be called
             y (int): Y-coordinate of area to be called
-            now (datetime.datetime): Current Time
+            now (datetime.datetime): Current Time or the base time
 
         Returns:
             None (None): Success
             True (bool): Retry due to Request Timeout Except
     """
     logger.debug('insert_data_weather_3_hour(' + str(x) + ',' + str(y) + ') 실행')
-    base_date = now.strftime('%Y%m%d')
-    base_time = str(int(now.strftime('%H') + '00'))
-    if len(base_time) < 4:
-        base_time = '0' + base_time
+    base_date, base_time = data_weather_base_3_hour(now)
     weather_list = call_data_weather_3_hour(x, y, base_date, base_time)
     if weather_list is True:
         return True
-    weather_data_list = data_weather_conversion(x, y, base_date, base_time, weather_list)
-    conn = psql_connect()
-    curs = conn.cursor()
-    for weather_data_dict in weather_data_list:
-        values_data = (
-            datetime.datetime.strptime(weather_data_dict['baseDate'] + weather_data_dict['baseTime'], '%Y%m%d%H%M'),
-            weather_data_dict['POP'], weather_data_dict['PTY'], weather_data_dict['REH'],
-            weather_data_dict['SKY'], weather_data_dict['T3H'], weather_data_dict['UUU'],
-            weather_data_dict['VEC'], weather_data_dict['VVV'], weather_data_dict['WSD'],
-            datetime.datetime.strptime(weather_data_dict['fcstDate'] + weather_data_dict['fcstTime'], '%Y%m%d%H%M'),
-            weather_data_dict['nx'], weather_data_dict['ny'])
-        curs.execute(
-            'INSERT INTO data_weather_3_hour(data_weather_3_hour_date, data_weather_3_hour_pop, '
-            'data_weather_3_hour_pty, data_weather_3_hour_reh, data_weather_3_hour_sky, '
-            'data_weather_3_hour_t3h, data_weather_3_hour_uuu, data_weather_3_hour_vec, '
-            'data_weather_3_hour_vvv, data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, '
-            'data_weather_area_x, data_weather_area_y) '
-            'VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
+    with psql_connect() as conn:
+        if DB_INGEST_JSONB:
+            psql_ingest(conn, 'ingest_data_weather_3_hour', weather_list)
+        else:
+            insert_data_weather_3_hour_rows(conn, data_weather_pivot_rows(
+                data_weather_pivot([weather_list], DATA_WEATHER_3_HOUR_CATEGORIES), DATA_WEATHER_3_HOUR_CATEGORIES))
+        commit_watermark(conn, 'data_weather_3_hour', datetime.datetime.strptime(base_date + base_time, '%Y%m%d%H%M'))
+
+
+def insert_data_weather_3_hour_rows(conn, values_list: list):
+    """ Upsert rows of data_weather_3_hour_latest in one statement, rows of several areas can be sent together
+        An area and forecast time must appear once in values_list.
+        Args:
+            conn (object): connection Object
+            values_list (list): Result of data_weather_pivot_rows with DATA_WEATHER_3_HOUR_CATEGORIES
+
+        Returns:
+            row_count (int): Number of rows sent
+
+        Comment:
+            A newer base time replaces the forecast of the area and forecast time.
+            The trigger of data_weather_3_hour_latest appends the version to data_weather_3_hour(history)
+            only when a value changed(sql/010_data_weather_latest.sql).
+    """
+    columns = ['data_weather_3_hour_' + category.lower() for category in DATA_WEATHER_3_HOUR_CATEGORIES]
+    update_set = ', '.join([column + ' = EXCLUDED.' + column for column in columns])
+    return psql_bulk_insert(
+        conn,
+        'INSERT INTO data_weather_3_hour_latest AS l (data_weather_3_hour_date, data_weather_3_hour_pop, '
+        'data_weather_3_hour_pty, data_weather_3_hour_reh, data_weather_3_hour_sky, '
+        'data_weather_3_hour_t3h, data_weather_3_hour_uuu, data_weather_3_hour_vec, '
+        'data_weather_3_hour_vvv, data_weather_3_hour_wsd, data_weather_3_hour_forecast_date, '
+        'data_weather_area_x, data_weather_area_y) VALUES %s '
+        'ON CONFLICT (data_weather_area_x, data_weather_area_y, data_weather_3_hour_forecast_date) DO UPDATE SET '
+        'data_weather_3_hour_date = EXCLUDED.data_weather_3_hour_date, ' + update_set +
+        ' WHERE l.data_weather_3_hour_date < EXCLUDED.data_weather_3_hour_date', values_list)
 
 
 def call_data_weather_3_hour(x: int, y: int, base_date: str, base_time: str):
@@ -150,7 +185,7 @@ def call_data_weather_3_hour(x: int, y: int, base_date: str, base_time: str):
 
         Returns:
             json_data['response']['body']['items']['item'] (list): Dataportal's neighborhood forecast weather data
-            True (bool): Request Timeout Except
+            True (bool): Request Timeout Except or no token of the rate limit
 
         Examples:
             >>> print(call_data_weather_3_hour(60, 127, '20201027', '1400'))
@@ -160,56 +195,124 @@ def call_data_weather_3_hour(x: int, y: int, base_date: str, base_time: str):
     url = DATA_WEATHER_HOST + 'getVilageFcst'
     param = {'serviceKey': DATA_WEATHER_KEY, 'numOfRows': 250, 'pageNo': 1, 'dataType': 'JSON',
              'base_date': base_date, 'base_time': base_time, 'nx': x, 'ny': y}
+    if acquire_token('data_weather', DATA_WEATHER_KEY) > 0:
+        return True
     try:
-        response = requests.get(url, param, timeout=REQUEST_TIME_OUT)
+        response = http_get(url, param)
         json_data = response.json()
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_data_weather_3_hour(' + str(x) + ', ' + str(y) + ') Except : ' + str(e))
         return True
-    return json_data['response']['body']['items']['item']
+    try:
+        return json_data['response']['body']['items']['item']
+    except (KeyError, TypeError):
+        logger.debug('call_data_weather_3_hour(' + str(x) + ', ' + str(y) + ') no data : ' + str(json_data))
+        return True
 
 
-def data_weather_conversion(x: int, y: int, base_date: str, base_time: str, data_dict: dict):
-    """ Dataportal's weather data Dict conversion to List
+def data_weather_base_1_hour(now: datetime.datetime):
+    """ Base date and time of the ultra-short-term forecast published in the hour of now
         Args:
-            x (int): X-coordinate of area to be called
-            y (int): Y-coordinate of area to be called
-            base_date (str): Current date
-            base_time (str): Current time
-            data_dict: Recalled Weather data from the Dataportal
+            now (datetime.datetime): Current Time
+
+        Returns:
+            base_date (str): YYYYMMDD
+            base_time (str): HH30
+    """
+    return now.strftime('%Y%m%d'), now.strftime('%H') + '30'
+
+
+def data_weather_base_3_hour(now: datetime.datetime):
+    """ Base date and time of the neighborhood forecast published in the hour of now
+        Args:
+            now (datetime.datetime): Current Time
 
         Returns:
-            weather_list (list): Clean up data by date and time and convert from dict data type to list data type
+            base_date (str): YYYYMMDD
+            base_time (str): HH00
+    """
+    return now.strftime('%Y%m%d'), now.strftime('%H') + '00'
 
-        Examples:
-            >>> x_ = 60
-            >>> y_ = 127
-            >>> now_ = datetime.datetime.now()
-            >>> base_date = now.strftime('%Y%m%d')
-            >>> base_time = str(int(now.strftime('%H') + '00'))
-            >>> if len(base_time) < 4:
-            >>>     base_time = '0' + base_time
-            >>> area_ = call_data_weather_1_hour(x_, y_, base_date, base_time)
-            >>> print(area_)
-            [{'baseDate': '20201027', 'baseTime': '1130', ... }, {'baseDate': '20201027', 'baseTime': '1130', ...]
-            >>> print(data_weather_conversion(x, y, base_date, base_time, area_)
-            [{'baseDate': '20201027', 'baseTime': '1130', 'fcstDate': '20201027', 'fcstTime': '1200', 'nx': 60, 'ny': 127, 'LGT': '0', 'PTY': '0', ... ]
+
+def probe_data_weather(hours: int, area: dict, now: datetime.datetime):
+    """ Whether the forecast of the base time of now is published yet, with one area
+        Args:
+            hours (int): 1(ultra-short-term forecast) or 3(neighborhood forecast)
+            area (dict): An item of insert_data_weather_area_list
+            now (datetime.datetime): Current Time
+
+        Returns:
+            True (bool): Published
+            False (bool): Not published yet or Request Timeout Except
     """
-    forecast_time_dict = {}
-    for forecast_time in data_dict:
-        key_name = str(forecast_time['fcstDate']) + str(forecast_time['fcstTime'])
-        forecast_time_dict[key_name] = (forecast_time['fcstDate'], forecast_time['fcstTime'])
+    x = int(area['data_weather_area_x'])
+    y = int(area['data_weather_area_y'])
+    if hours == 1:
+        weather_list = call_data_weather_1_hour(x, y, *data_weather_base_1_hour(now))
+    else:
+        weather_list = call_data_weather_3_hour(x, y, *data_weather_base_3_hour(now))
+    return weather_list is not True and len(weather_list) > 0
 
-    hourly_data_dict = {}
-    for key, val in forecast_time_dict.items():
-        hourly_data_dict[key] = {'baseDate': base_date, 'baseTime': base_time, 'fcstDate': val[0],
-                                 'fcstTime': val[1], 'nx': x, 'ny': y}
 
-    for key in hourly_data_dict:
-        for weather in data_dict:
-            if (str(weather['fcstDate']) + str(weather['fcstTime'])) == key:
-                hourly_data_dict[key].update({weather['category']: weather['fcstValue']})
+def parse_data_weather_date(date_time: str, date_cache: dict):
+    """ Dataportal's date and time(YYYYMMDDHHMI) conversion to datetime, parsed once per distinct value
+        Args:
+            date_time (str): baseDate + baseTime or fcstDate + fcstTime
+            date_cache (dict): Already parsed values
 
-    weather_list = list(hourly_data_dict.values())
+        Returns:
+            date_cache[date_time] (datetime.datetime): Parsed value
+    """
+    if date_time not in date_cache:
+        date_cache[date_time] = datetime.datetime.strptime(date_time, '%Y%m%d%H%M')
+    return date_cache[date_time]
+
+
+def data_weather_pivot(weather_lists: list, categories: tuple):
+    """ Dataportal's weather data of many areas pivoted to columns in one pass, a row per area, base and forecast time
+        Args:
+            weather_lists (list): Results of call_data_weather_1_hour or call_data_weather_3_hour, one list per area
+            categories (tuple): DATA_WEATHER_1_HOUR_CATEGORIES or DATA_WEATHER_3_HOUR_CATEGORIES
+
+        Returns:
+            columns (dict): Column name(base_date, each category, forecast_date, nx, ny): list of values,
+                            a category missing from the response is None
+
+        Examples:
+            >>> columns = data_weather_pivot([area_1, area_2], DATA_WEATHER_1_HOUR_CATEGORIES)
+            >>> print(columns['T1H'][:3], columns['nx'][:3])
+            ['12', '13', '13'] [60, 60, 60]
+    """
+    columns = {name: [] for name in ('base_date',) + categories + ('forecast_date', 'nx', 'ny')}
+    category_columns = [columns[category] for category in categories]
+    row_index = {}
+    date_cache = {}
+    for weather_list in weather_lists:
+        for weather in weather_list:
+            key = (weather['nx'], weather['ny'], weather['baseDate'], weather['baseTime'], weather['fcstDate'],
+                   weather['fcstTime'])
+            index = row_index.get(key)
+            if index is None:
+                index = row_index[key] = len(columns['nx'])
+                columns['base_date'].append(parse_data_weather_date(key[2] + key[3], date_cache))
+                columns['forecast_date'].append(parse_data_weather_date(key[4] + key[5], date_cache))
+                columns['nx'].append(key[0])
+                columns['ny'].append(key[1])
+                for category_column in category_columns:
+                    category_column.append(None)
+            if weather['category'] in columns:
+                columns[weather['category']][index] = weather['fcstValue']
+    return columns
 
-    return weather_list
+
+def data_weather_pivot_rows(columns: dict, categories: tuple):
+    """ Columns of data_weather_pivot to rows in the column order of data_weather_1_hour and data_weather_3_hour
+        Args:
+            columns (dict): Result of data_weather_pivot
+            categories (tuple): Categories given to data_weather_pivot
+
+        Returns:
+            values_list (list): Rows for insert_data_weather_1_hour_rows, insert_data_weather_3_hour_rows or COPY
+    """
+    return list(zip(columns['base_date'], *[columns[category] for category in categories], columns['forecast_date'],
+                    columns['nx'], columns['ny']))
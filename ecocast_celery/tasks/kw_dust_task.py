@@ -1,10 +1,22 @@
 import requests
 import json
 import datetime
-from ..ecocast_conf import logger, psql_connect, psql_select
-from ..ecocast_conf import KWEATHER_HOST, REQUEST_TIME_OUT
+from ..ecocast_http import http_get
+from ..ecocast_watermark import get_watermark, commit_watermark
+from ..ecocast_conf import logger, psql_connect, psql_copy, psql_ingest
+from ..ecocast_conf import KWEATHER_HOST, DB_INGEST_JSONB
 
-""" Kweather Fine Dust Data Task """
+""" Kweather Fine Dust Data Task
+    Comment:
+        1. Each snapshot is expanded into kweather_dust in the same transaction,
+        unique by (announce time, sd, sgg, emd)(sql/007_kweather_dust_relational.sql)
+        2. Per-dong reads use kweather_dust, freshness uses ingest_watermark
+        3. The responses are kept in kweather_dust_snapshot as hourly keyframes and 5-minute deltas
+        (sql/008_kweather_dust_snapshot.sql), reconstruct_kw_dust_json rebuilds the response of a time
+"""
+
+KW_DUST_COLUMNS = ('kweather_dust_sd', 'kweather_dust_sgg', 'kweather_dust_emd', 'kweather_dust_announce_time',
+                   'kweather_dust_lat', 'kweather_dust_lon', 'kweather_dust_pm100', 'kweather_dust_pm25')
 
 
 def insert_kw_dust():
@@ -15,23 +27,63 @@ def insert_kw_dust():
             None (None): Success
             True (bool): Retry due to timeout
     """
-    conn = psql_connect()
-    curs = conn.cursor()
     kw_dust_list = call_kw_dust()
     if kw_dust_list is True:
         return True
+    with psql_connect() as conn:
+        if DB_INGEST_JSONB:
+            psql_ingest(conn, 'ingest_kweather_dust', kw_dust_list)
+        else:
+            copy_kw_dust(conn, kw_dust_rows(kw_dust_list))
+        conn.commit()
+
+
+def kw_dust_rows(kw_dust_list: list):
+    """ Kweather's fine dust station data conversion to rows of kweather_dust
+        Args:
+            kw_dust_list (list): Kweather's fine dust station data
+
+        Returns:
+            values_list (list): Rows of kweather_dust, list of tuple
+    """
+    values_list = []
+    time_cache = {}
     for kw_dust_dict in kw_dust_list:
-        values_data = (kw_dust_dict['areaName_wide'], kw_dust_dict['areaName_city'], kw_dust_dict['areaName_dong'],
-                       datetime.datetime.strptime(kw_dust_dict['announceTime'], '%Y%m%d%H%M'), kw_dust_dict['Lat'],
-                       kw_dust_dict['Lng'], kw_dust_dict['PM10_VALUE'], kw_dust_dict['PM25_VALUE'])
-        curs.execute(
-            'INSERT INTO kweather_dust(kweather_dust_sd, kweather_dust_sgg, kweather_dust_emd, '
-            'kweather_dust_announce_time, kweather_dust_lat, kweather_dust_lon, kweather_dust_pm100, '
-            'kweather_dust_pm25) '
-            'VALUES(%s, %s, %s, %s, %s, %s, %s, %s)', values_data)
-    conn.commit()
+        announce_time = kw_dust_dict['announceTime']
+        if announce_time not in time_cache:
+            time_cache[announce_time] = datetime.datetime.strptime(announce_time, '%Y%m%d%H%M')
+        values_list.append((kw_dust_dict['areaName_wide'], kw_dust_dict['areaName_city'],
+                            kw_dust_dict['areaName_dong'], time_cache[announce_time], kw_dust_dict['Lat'],
+                            kw_dust_dict['Lng'], kw_dust_dict['PM10_VALUE'], kw_dust_dict['PM25_VALUE']))
+    return values_list
+
+
+def copy_kw_dust(conn, values_list: list):
+    """ Load rows of kweather_dust with a single COPY command into a staging table, then one INSERT
+        Args:
+            conn (object): connection Object
+            values_list (list): Result of kw_dust_rows
+
+        Returns:
+            row_count (int): Number of rows inserted
+
+        Comment:
+            COPY has no ON CONFLICT, so the rows go to the temporary kweather_dust_load first and a snapshot
+            already loaded(by insert_kw_dust or insert_kw_dust_json) is skipped by the unique index of kweather_dust.
+    """
+    if not values_list:
+        return 0
+    columns = ', '.join(KW_DUST_COLUMNS)
+    curs = conn.cursor()
+    curs.execute('CREATE TEMP TABLE IF NOT EXISTS kweather_dust_load ON COMMIT DELETE ROWS AS '
+                 'SELECT ' + columns + ' FROM kweather_dust WITH NO DATA')
+    psql_copy(conn, 'kweather_dust_load', KW_DUST_COLUMNS, values_list)
+    curs.execute('INSERT INTO kweather_dust (' + columns + ') SELECT ' + columns + ' FROM kweather_dust_load '
+                 'ON CONFLICT DO NOTHING')
+    row_count = curs.rowcount
+    curs.execute('TRUNCATE kweather_dust_load')
     curs.close()
-    conn.close()
+    return row_count
 
 
 def call_kw_dust():
@@ -47,7 +99,7 @@ def call_kw_dust():
             [{'areaName_wide': '서울특별시', 'areaName_city': '종로구', 'areaName_dong': '청운효자동', ... ]
     """
     try:
-        response = requests.get(KWEATHER_HOST, timeout=REQUEST_TIME_OUT)
+        response = http_get(KWEATHER_HOST)
         json_data = response.json()[0]['findust']['station']
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_kw_dust Except : ' + str(e))
@@ -56,7 +108,7 @@ def call_kw_dust():
 
 
 def insert_kw_dust_json():
-    """ Receive Kweather's fine dust data and insert it into the database as JSON
+    """ Receive Kweather's fine dust data and insert it into the database as JSON and as rows of kweather_dust
         Args:
 
         Returns:
@@ -67,24 +119,14 @@ def insert_kw_dust_json():
     json_data = call_kw_dust_json()
     if json_data is True:
         return True
-    conn = psql_connect()
-    select_time_sql = "SELECT kweather_dust_json_data -> 'station' -> 1 ->> 'announceTime' AS announceTime " \
-                      "FROM kweather_dust_json ORDER BY kweather_dust_json_date DESC LIMIT 1"
-    db_time = psql_select(conn, select_time_sql)
-    kw_time = json_data['station'][0]['announceTime']
-    if db_time:
-        db_time = db_time[0][0]
-    else:
-        db_time = '2010-01-01 00:00'
-    if db_time == kw_time:
-        logger.debug('db_time : ' + db_time + ', kw_time : ' + kw_time)
+    db_time = get_watermark('kweather_dust_json')
+    kw_time = datetime.datetime.strptime(json_data['station'][0]['announceTime'], '%Y%m%d%H%M')
+    if db_time is not None and db_time >= kw_time:
+        logger.debug('db_time : ' + str(db_time) + ', kw_time : ' + str(kw_time))
         return True
-    values_data = (json.dumps(json_data, ensure_ascii=False),)
-    curs = conn.cursor()
-    curs.execute('INSERT INTO kweather_dust_json(kweather_dust_json_data) VALUES(%s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
+    with psql_connect() as conn:
+        load_kw_dust_json(conn, json_data)
+        commit_watermark(conn, 'kweather_dust_json', kw_time)
 
 
 def null_kw_dust_json():
@@ -99,20 +141,54 @@ def null_kw_dust_json():
     json_data = call_kw_dust_json()
     if json_data is True:
         return True
-    conn = psql_connect()
-    select_time_sql = "SELECT kweather_dust_json_data -> 'station' -> 1 ->> 'announceTime' AS announceTime " \
-                      "FROM kweather_dust_json ORDER BY kweather_dust_json_date DESC LIMIT 1"
-    db_time = psql_select(conn, select_time_sql)[0][0]
-    kw_time = json_data['station'][0]['announceTime']
-    if db_time == kw_time:
-        logger.debug('db_time : ' + db_time + ', kw_time : ' + kw_time)
+    db_time = get_watermark('kweather_dust_json')
+    kw_time = datetime.datetime.strptime(json_data['station'][0]['announceTime'], '%Y%m%d%H%M')
+    if db_time is not None and db_time >= kw_time:
+        logger.debug('db_time : ' + str(db_time) + ', kw_time : ' + str(kw_time))
         return True
+    with psql_connect() as conn:
+        load_kw_dust_json(conn, json_data)
+        commit_watermark(conn, 'kweather_dust_json', kw_time)
+
+
+def load_kw_dust_json(conn, json_data: dict):
+    """ Store Kweather's fine dust JSON data as a snapshot and insert its station rows, the transaction is left open
+        Args:
+            conn (object): connection Object
+            json_data (dict): Result of call_kw_dust_json
+
+        Returns:
+            row_count (int): Number of rows of kweather_dust
+    """
+    if DB_INGEST_JSONB:
+        return psql_ingest(conn, 'ingest_kweather_dust_json', json_data)[0]
     values_data = (json.dumps(json_data, ensure_ascii=False),)
     curs = conn.cursor()
-    curs.execute('INSERT INTO kweather_dust_json(kweather_dust_json_data) VALUES(%s)', values_data)
-    conn.commit()
+    curs.execute('SELECT ingest_kweather_dust_snapshot(%s::JSONB)', values_data)
     curs.close()
-    conn.close()
+    return copy_kw_dust(conn, kw_dust_rows(json_data['station']))
+
+
+def reconstruct_kw_dust_json(announce_time: datetime.datetime):
+    """ Kweather's fine dust JSON data in effect at the time, rebuilt from the keyframe and deltas of
+        kweather_dust_snapshot
+        Args:
+            announce_time (datetime.datetime): Time to be rebuilt, the latest snapshot at or before it is returned
+
+        Returns:
+            json_data (dict): Same as the result of call_kw_dust_json, None if no snapshot
+
+        Examples:
+            >>> json_data = reconstruct_kw_dust_json(datetime.datetime(2020, 10, 26, 20, 35))
+            >>> print(json_data['station'][0]['announceTime'])
+            202010262035
+    """
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        curs.execute('SELECT kweather_dust_reconstruct(%s)', (announce_time,))
+        json_data = curs.fetchone()[0]
+        curs.close()
+    return json_data
 
 
 def call_kw_dust_json():
@@ -128,7 +204,7 @@ def call_kw_dust_json():
             {'station': [{'areaName_wide': '서울특별시', 'areaName_city': '종로구', 'areaName_dong': '청운효자동', ... ]}
     """
     try:
-        response = requests.get(KWEATHER_HOST, timeout=REQUEST_TIME_OUT)
+        response = http_get(KWEATHER_HOST)
         json_data = response.json()[0]['findust']
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_kw_dust_json Except : ' + str(e))
@@ -1,7 +1,9 @@
 import requests
 import json
+from ..ecocast_redis import acquire_token
+from ..ecocast_http import http_get
 from ..ecocast_conf import logger, psql_connect
-from ..ecocast_conf import OPENWEATHER_HOST, OPENWEATHER_KEY, REQUEST_TIME_OUT
+from ..ecocast_conf import OPENWEATHER_HOST, OPENWEATHER_KEY
 
 """ Openweather Weather Data Task """
 
@@ -31,13 +33,12 @@ def insert_ow_weather_json(lat: float, lon: float):
     json_data = call_ow_weather_json(lat, lon)
     if json_data is True:
         return True
-    conn = psql_connect()
     values_data = (json.dumps(json_data, ensure_ascii=False),)
-    curs = conn.cursor()
-    curs.execute('INSERT INTO openweather_weather_json(openweather_weather_json_data) VALUES(%s)', values_data)
-    conn.commit()
-    curs.close()
-    conn.close()
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        curs.execute('INSERT INTO openweather_weather_json(openweather_weather_json_data) VALUES(%s)', values_data)
+        conn.commit()
+        curs.close()
 
 
 def call_ow_weather_json(lat: float, lon: float):
@@ -48,7 +49,7 @@ def call_ow_weather_json(lat: float, lon: float):
 
         Returns:
             json_data (dict): Openweather's weather data
-            True (bool): Request Timeout Except
+            True (bool): Request Timeout Except or no token of the rate limit
 
         Examples:
             >>> print(call_ow_weather_json(37.496550, 127.024774))
@@ -56,8 +57,10 @@ def call_ow_weather_json(lat: float, lon: float):
     """
     logger.debug('call_ow_weather_json 실행')
     params_ = {'lat': lat, 'lon': lon, 'exclude': '', 'appid': OPENWEATHER_KEY, 'units': 'metric', 'lang': 'kr'}
+    if acquire_token('openweather', OPENWEATHER_KEY) > 0:
+        return True
     try:
-        response = requests.get(OPENWEATHER_HOST, params_, timeout=REQUEST_TIME_OUT)
+        response = http_get(OPENWEATHER_HOST, params_)
         json_data = response.json()
     except (requests.exceptions.Timeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
         logger.debug('call_ow_weather_json Except : ' + str(e))
@@ -0,0 +1,38 @@
+from ..ecocast_conf import logger, psql_connect
+from ..ecocast_conf import PARTITION_TABLES, PARTITION_MONTHS_AHEAD, PARTITION_DROP_EXPIRED
+from ..ecocast_conf import LATEST_FORECAST_RETENTION_DAYS, KWEATHER_SNAPSHOT_RETENTION_MONTHS
+
+""" Monthly Partition Maintenance Task """
+
+
+def maintain_partitions():
+    """ Create the partitions of the coming months and detach or drop the expired ones of PARTITION_TABLES
+        Past forecasts older than LATEST_FORECAST_RETENTION_DAYS are pruned from data_weather_*_latest
+        and keyframe groups of kweather_dust_snapshot older than KWEATHER_SNAPSHOT_RETENTION_MONTHS
+        Args:
+
+        Returns:
+            action_list (list): Partitions created, detached or dropped and rows pruned
+
+        Examples:
+            >>> print(maintain_partitions())
+            ['created airkorea_air_quality_202101', 'detached data_weather_1_hour_201912', ... ]
+    """
+    logger.debug('maintain_partitions 실행')
+    action_list = []
+    with psql_connect() as conn:
+        curs = conn.cursor()
+        for table, (column, retention_months) in PARTITION_TABLES.items():
+            curs.execute('SELECT maintain_partitions(%s, %s, %s, %s, %s)',
+                         (table, column, PARTITION_MONTHS_AHEAD, retention_months, PARTITION_DROP_EXPIRED))
+            action_list.extend([row[0] for row in curs.fetchall()])
+        curs.execute('SELECT prune_kweather_dust_snapshot(%s)', (KWEATHER_SNAPSHOT_RETENTION_MONTHS,))
+        action_list.append('pruned kweather_dust_snapshot ' + str(curs.fetchone()[0]))
+        for table in ('data_weather_1_hour', 'data_weather_3_hour'):
+            curs.execute('DELETE FROM ' + table + '_latest WHERE ' + table + '_forecast_date < '
+                         'now() - make_interval(days => %s)', (LATEST_FORECAST_RETENTION_DAYS,))
+            action_list.append('pruned ' + table + '_latest ' + str(curs.rowcount))
+        curs.close()
+        conn.commit()
+    logger.debug('maintain_partitions : ' + str(action_list))
+    return action_list
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+""" Test Configuration
+    Comment:
+        ecocast_conf writes its log to ./ecocast_celery/tasks/log relative to the working directory,
+        so the tests run from a temporary directory holding that folder.
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_DIR = tempfile.mkdtemp(prefix='ecocast_celery_test_')
+os.makedirs(os.path.join(TEST_DIR, 'ecocast_celery', 'tasks', 'log'))
+os.chdir(TEST_DIR)
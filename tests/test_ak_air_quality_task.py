@@ -0,0 +1,39 @@
+import datetime
+from ecocast_celery.tasks.ak_air_quality_task import parse_ak_time, ak_address_sido, ak_station_sido_names, \
+    ak_air_quality_values, has_null_value
+from ecocast_celery.ecocast_conf import AK_SIDO_NAMES
+
+
+def test_parse_ak_time():
+    assert parse_ak_time('2020-10-16 17:00') == datetime.datetime(2020, 10, 16, 17)
+
+
+def test_parse_ak_time_24_is_next_day():
+    assert parse_ak_time('2020-10-16 24:00') == datetime.datetime(2020, 10, 17)
+    assert parse_ak_time('2020-12-31 24:00') == datetime.datetime(2021, 1, 1)
+
+
+def test_ak_address_sido():
+    assert ak_address_sido('경남 창원시 의창구 원이대로 450') == '경남'
+    assert ak_address_sido('경상남도 창원시 의창구 원이대로 450') == '경남'
+    assert ak_address_sido('서울특별시 중구 덕수궁길 15') == '서울'
+    assert ak_address_sido('') is None
+
+
+def test_ak_station_sido_names_only_sidos_of_stale_stations():
+    assert ak_station_sido_names([('중구', '서울 중구 덕수궁길 15'), ('고읍', '경기 양주시 고읍남로')]) == ['서울', '경기']
+    assert ak_station_sido_names([('중구', '서울 중구 덕수궁길 15'), ('미상', None)]) == list(AK_SIDO_NAMES)
+
+
+def test_ak_air_quality_values_not_measured_as_none():
+    air_quality_data = {'dataTime': '2020-10-16 17:00', 'mangName': '도시대기', 'so2Value': '-', 'so2Grade': '',
+                        'coValue': '0.6', 'coGrade': '1', 'o3Value': '0.021', 'o3Grade': '1', 'no2Value': '0.020',
+                        'no2Grade': '1', 'pm10Value': '-', 'pm10Grade': '', 'pm10Value24': '31', 'pm25Value': '12',
+                        'pm25Grade': '1', 'pm25Value24': '14', 'khaiValue': '52', 'khaiGrade': '2'}
+    values_data = ak_air_quality_values(air_quality_data, '중구')
+    assert values_data[0] == '2020-10-16 17:00'
+    assert values_data[-1] == '중구'
+    assert values_data[2:4] == (None, None)
+    assert values_data[10:12] == (None, None)
+    assert values_data[4] == '0.6'
+    assert has_null_value(values_data)
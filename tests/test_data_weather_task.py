@@ -0,0 +1,29 @@
+import datetime
+from ecocast_celery.tasks.data_weather_task import data_weather_pivot, data_weather_pivot_rows
+
+
+def weather_item(nx, ny, fcst_time, category, value):
+    return {'baseDate': '20201026', 'baseTime': '2030', 'fcstDate': '20201026', 'fcstTime': fcst_time,
+            'category': category, 'fcstValue': value, 'nx': nx, 'ny': ny}
+
+
+def test_data_weather_pivot_row_per_area_and_forecast_time():
+    weather_lists = [
+        [weather_item(60, 127, '2100', 'T1H', '12'), weather_item(60, 127, '2100', 'REH', '80'),
+         weather_item(60, 127, '2200', 'T1H', '11')],
+        [weather_item(61, 126, '2100', 'T1H', '13'), weather_item(61, 126, '2100', 'XXX', '1')],
+    ]
+    columns = data_weather_pivot(weather_lists, ('T1H', 'REH'))
+    assert columns['nx'] == [60, 60, 61]
+    assert columns['ny'] == [127, 127, 126]
+    assert columns['T1H'] == ['12', '11', '13']
+    assert columns['REH'] == ['80', None, None]
+    assert columns['base_date'] == [datetime.datetime(2020, 10, 26, 20, 30)] * 3
+    assert columns['forecast_date'][1] == datetime.datetime(2020, 10, 26, 22)
+    assert 'XXX' not in columns
+
+
+def test_data_weather_pivot_rows_column_order():
+    columns = data_weather_pivot([[weather_item(60, 127, '2100', 'T1H', '12')]], ('T1H', 'REH'))
+    assert data_weather_pivot_rows(columns, ('T1H', 'REH')) == [
+        (datetime.datetime(2020, 10, 26, 20, 30), '12', None, datetime.datetime(2020, 10, 26, 21), 60, 127)]
@@ -0,0 +1,114 @@
+import datetime
+import time
+import types
+from ecocast_celery import ecocast_app
+from ecocast_celery.tasks import ak_air_quality_task, data_weather_task
+from ecocast_celery.ecocast_app import stagger_countdowns, data_weather_task_args, data_weather_task_base
+
+
+def test_stagger_countdowns_first_task_runs_immediately():
+    assert stagger_countdowns(1, (2, 4)) == [0]
+    assert stagger_countdowns(0, (2, 4)) == []
+
+
+def test_stagger_countdowns_steps_within_interval():
+    countdowns = stagger_countdowns(50, (11, 20))
+    assert len(countdowns) == 50
+    assert countdowns[0] == 0
+    assert all(11 <= b - a <= 20 for a, b in zip(countdowns, countdowns[1:]))
+
+
+def test_data_weather_task_args_independent_of_system_time_zone(monkeypatch):
+    area = {'data_weather_area_x': 60.0, 'data_weather_area_y': 127.0}
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    args = data_weather_task_args(area, '20201026', '2030')
+    assert args == [60, 127, 1603711800, 2]
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    assert data_weather_task_base(args[2], args[3]) == datetime.datetime(2020, 10, 26, 20, 30)
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_stagger_countdowns_fit_in_window():
+    countdowns = stagger_countdowns(600, (11, 20), 3000)
+    assert len(countdowns) == 600
+    assert countdowns[0] == 0
+    assert countdowns[-1] == 3000
+    assert countdowns == sorted(countdowns)
+
+
+class RetryCalled(Exception):
+    """ Raised by the fake Task.retry with its keyword arguments """
+
+
+def run_retry_chain(monkeypatch, task, start, attempts):
+    """ Run a bound task and its retries with a clock moved by each retry countdown
+        Args:
+            monkeypatch (object): pytest fixture
+            task (object): Celery task
+            start (datetime.datetime): Clock of the first run
+            attempts (int): Number of runs
+
+        Returns:
+            clock_list (list): Clock of each run
+    """
+    clock = {'now': start}
+
+    class FakeDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock['now']
+
+    def fake_retry(**kwargs):
+        raise RetryCalled(kwargs)
+
+    monkeypatch.setattr(ecocast_app, 'datetime', types.SimpleNamespace(datetime=FakeDatetime,
+                                                                       timedelta=datetime.timedelta))
+    monkeypatch.setattr(task, 'retry', fake_retry)
+    args = []
+    clock_list = []
+    for retries in range(attempts):
+        clock_list.append(clock['now'])
+        task.push_request(retries=retries)
+        try:
+            task.run(*args)
+        except RetryCalled as e:
+            args = e.args[0]['args']
+            clock['now'] += datetime.timedelta(seconds=e.args[0]['countdown'])
+        else:
+            break
+        finally:
+            task.pop_request()
+    return clock_list
+
+
+def test_data_weather_retry_chain_keeps_base_time_across_the_hour(monkeypatch):
+    probe_list = []
+    claim_list = []
+    monkeypatch.setattr(ecocast_app, 'claim_task', lambda key: claim_list.append(key) or True)
+    monkeypatch.setattr(ecocast_app, 'record_probe', lambda source, data_time: None)
+    monkeypatch.setattr(data_weather_task, 'insert_data_weather_area_list',
+                        lambda: [{'data_weather_area_x': 60.0, 'data_weather_area_y': 127.0}])
+    monkeypatch.setattr(data_weather_task, 'probe_data_weather',
+                        lambda hours, area, now: probe_list.append(data_weather_task.data_weather_base_1_hour(now)))
+    clock_list = run_retry_chain(monkeypatch, ecocast_app.insert_data_weather_area_list_1_hour,
+                                 datetime.datetime(2020, 10, 26, 20, 46), 10)
+    assert clock_list[-1].hour == 21
+    assert probe_list == [('20201026', '2030')] * 10
+    assert all(':202010262030:' in key for key in claim_list)
+
+
+def test_ak_air_quality_retry_chain_stops_when_the_hour_rolls_over(monkeypatch):
+    hour_list = []
+    monkeypatch.setattr(ecocast_app, 'claim_task', lambda key: True)
+    monkeypatch.setattr(ecocast_app, 'record_probe', lambda source, data_time: hour_list.append(data_time))
+    monkeypatch.setattr(ak_air_quality_task, 'insert_ak_air_quality_list',
+                        lambda repoll: [('중구', '서울 중구 덕수궁길 15')])
+    monkeypatch.setattr(ecocast_app.province_ak_air_quality, 'apply_async', lambda **kwargs: None)
+    monkeypatch.setattr(ecocast_app.ecocast_conf, 'AK_AIR_QUALITY_MODE', 'province')
+    clock_list = run_retry_chain(monkeypatch, ecocast_app.insert_ak_air_quality_list,
+                                 datetime.datetime(2020, 10, 26, 20, 1), 16)
+    assert clock_list[-1].hour == 21
+    assert hour_list and set(hour_list) == {datetime.datetime(2020, 10, 26, 20)}
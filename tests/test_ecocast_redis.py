@@ -0,0 +1,47 @@
+import pytest
+import redis
+from ecocast_celery import ecocast_redis
+from ecocast_celery.ecocast_redis import acquire_token
+from ecocast_celery.ecocast_conf import RATE_LIMITS
+
+fakeredis = pytest.importorskip('fakeredis')  # Runs TOKEN_BUCKET_SCRIPT with Lua(fakeredis[lua])
+
+
+class BrokenRedis:
+    """ Redis client whose every command fails """
+
+    def eval(self, *args):
+        raise redis.exceptions.ConnectionError('connection refused')
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(ecocast_redis, 'get_redis', lambda: client)
+    return client
+
+
+def test_acquire_token_burst_up_to_capacity(fake_redis):
+    rate, capacity = RATE_LIMITS['airkorea']
+    assert all(acquire_token('airkorea', 'KEY') == 0.0 for _ in range(capacity))
+    wait = acquire_token('airkorea', 'KEY')
+    assert 0 < wait <= 1 / rate
+
+
+def test_acquire_token_bucket_per_api_key(fake_redis):
+    rate, capacity = RATE_LIMITS['openweather']
+    for _ in range(capacity):
+        acquire_token('openweather', 'KEY_A')
+    assert acquire_token('openweather', 'KEY_A') > 0
+    assert acquire_token('openweather', 'KEY_B') == 0.0
+
+
+def test_acquire_token_wait_for_cost(fake_redis):
+    rate, capacity = RATE_LIMITS['openweather']
+    assert acquire_token('openweather', 'KEY', cost=capacity) == 0.0
+    assert acquire_token('openweather', 'KEY', cost=2) == pytest.approx(2 / rate, rel=0.05)
+
+
+def test_acquire_token_fails_open_without_redis(monkeypatch):
+    monkeypatch.setattr(ecocast_redis, 'get_redis', lambda: BrokenRedis())
+    assert acquire_token('airkorea', 'KEY') == 0.0
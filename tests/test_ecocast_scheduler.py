@@ -0,0 +1,80 @@
+import datetime
+from ecocast_celery import ecocast_scheduler
+from ecocast_celery.ecocast_scheduler import poll_backoff, first_poll_delay, expected_lag, record_probe, \
+    record_publication, publication_lag_estimate
+from ecocast_celery.ecocast_conf import PUBLICATION_LAG
+
+
+def test_poll_backoff_doubles_up_to_max():
+    first_backoff, max_backoff = PUBLICATION_LAG['airkorea_air_quality'][1:]
+    assert poll_backoff('airkorea_air_quality', 0) == first_backoff
+    assert poll_backoff('airkorea_air_quality', 1) == first_backoff * 2
+    assert poll_backoff('airkorea_air_quality', 20) == max_backoff
+
+
+class FakeRedis:
+    """ In-memory stand-in of the few Redis commands used by ecocast_scheduler """
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def lrange(self, key, start, end):
+        values = self.data.get(key, [])
+        return [str(value) for value in values[start:None if end == -1 else end + 1]]
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value)
+
+    def lpush(self, key, value):
+        self.data.setdefault(key, []).insert(0, value)
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:end + 1]
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+
+def poll_period(source, data_time, publication_lag, explore):
+    """ First poll at first_poll_delay, back off until the data is published, then load it 5 seconds later """
+    probe_lag = first_poll_delay(source, datetime.datetime.now(), explore)
+    attempt = 0
+    while True:
+        record_probe(source, data_time, data_time + datetime.timedelta(seconds=probe_lag))
+        if probe_lag >= publication_lag:
+            break
+        probe_lag += poll_backoff(source, attempt)
+        attempt += 1
+    record_publication(source, data_time, data_time + datetime.timedelta(seconds=probe_lag + 5))
+
+
+def test_publication_lag_estimate_between_empty_and_finding_poll():
+    assert publication_lag_estimate(1030.0, [900.0, 960.0, 1020.0]) == 990.0
+    assert publication_lag_estimate(905.0, [900.0]) == 900.0
+    assert publication_lag_estimate(905.0, []) == 905.0
+
+
+def test_first_poll_delay_learns_earlier_publication(monkeypatch):
+    monkeypatch.setattr(ecocast_scheduler, 'get_redis', lambda client=FakeRedis(): client)
+    source = 'data_weather_1_hour'
+    data_time = datetime.datetime(2020, 10, 1, 0, 30)
+    for period in range(60):
+        poll_period(source, data_time, 900, period % 4 == 0)
+        data_time += datetime.timedelta(hours=1)
+    assert 840 <= expected_lag(source) <= 960
+    for period in range(200):
+        poll_period(source, data_time, 300, period % 4 == 0)
+        data_time += datetime.timedelta(hours=1)
+    assert expected_lag(source) <= 360